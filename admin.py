@@ -1,10 +1,15 @@
 from enum import IntEnum, auto
-import os
 
 import click
-import scrypt
+
+from simple_recipes import app
+from simple_recipes.qr_codes import pregenerate_qr_codes
+from simple_recipes.assets import build_assets
+from simple_recipes.passwords import hash_password
 
 from simple_recipes.db.users import *
+from simple_recipes.db.recipes import compile_recipe_texts, generate_missing_renditions, \
+    move_images_to_blob_store, delete_unreferenced_blobs, get_recipe_ids
 
 class Options(IntEnum):
     SHOW_USER_INFO = auto()
@@ -12,6 +17,12 @@ class Options(IntEnum):
     UNLOCK_USER = auto()
     ADD_USER = auto()
     CHANGE_USER_PASSWORD = auto()
+    COMPILE_RECIPE_TEXTS = auto()
+    GENERATE_IMAGE_RENDITIONS = auto()
+    MOVE_IMAGES_TO_BLOB_STORE = auto()
+    DELETE_UNREFERENCED_BLOBS = auto()
+    GENERATE_QR_CODES = auto()
+    BUILD_STATIC_ASSETS = auto()
     SHOW_OPTIONS = auto()
     QUIT = auto()
 
@@ -54,19 +65,43 @@ def main():
         elif option == Options.ADD_USER:
             user_name = input("Enter new user name: ")
             pw = click.prompt("Enter password: ", hide_input=True)
-            salt = os.urandom(64)
-            hashed = scrypt.hash(pw, salt)
-            add_user(user_name, hashed, salt)
+            add_user(user_name, *hash_password(pw))
             print(f"\nAccount created for '{user_name}'\n")
         #############################################################
         elif option == Options.CHANGE_USER_PASSWORD:
             user_name = input("Enter user name: ")
             pw = click.prompt("Enter new password: ", hide_input=True)
-            salt = os.urandom(64)
-            hashed = scrypt.hash(pw, salt)
-            update_user_password(hashed, salt, user_name=user_name)
+            update_user_password(*hash_password(pw), user_name=user_name)
             print(f"\nPassword change for User ID '{user_name}'")
         #############################################################
+        elif option == Options.COMPILE_RECIPE_TEXTS:
+            count = compile_recipe_texts()
+            print(f"\nCompiled ingredients and instructions for {count} recipes\n")
+        #############################################################
+        elif option == Options.GENERATE_IMAGE_RENDITIONS:
+            count = generate_missing_renditions()
+            print(f"\nGenerated renditions for {count} images\n")
+        #############################################################
+        elif option == Options.MOVE_IMAGES_TO_BLOB_STORE:
+            count = move_images_to_blob_store()
+            print(f"\nMoved {count} images to the blob store\n")
+        #############################################################
+        elif option == Options.DELETE_UNREFERENCED_BLOBS:
+            count = delete_unreferenced_blobs()
+            print(f"\nDeleted {count} unreferenced blob files\n")
+        #############################################################
+        elif option == Options.GENERATE_QR_CODES:
+            # share links point at the public site, not wherever this runs.
+            base_url = app.config['SITE_URL'] or \
+                input("Enter site URL (e.g. https://example.com): ")
+            with app.test_request_context(base_url=base_url):
+                count = pregenerate_qr_codes(get_recipe_ids(), kinds=('svg', 'png'))
+            print(f"\nGenerated {count} QR codes\n")
+        #############################################################
+        elif option == Options.BUILD_STATIC_ASSETS:
+            count = build_assets()
+            print(f"\nBuilt {count} static files into {app.config['ASSET_BUILD_PATH']}\n")
+        #############################################################
 
         option = int(input("Enter option number: "))
 
@@ -1,21 +1,137 @@
 import io
+import os
+import threading
 
-from flask import Flask
+from flask import Flask, jsonify, abort
 import werkzeug
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from flask_wtf.csrf import CSRFProtect
 from flaskext.markdown import Markdown
 import flask_login
 from flask_talisman import Talisman
 
-from pint import UnitRegistry
-
 app = Flask(__name__)
 app.config['SECRET_KEY'] = b'\x98R\xcd}\xe5\xa9\xe3\x110?\x82\x11\xf2\xa7\x17\x9c'
 
 if app.config['ENV'] == 'development':
     app.config['DATABASE_URL'] = 'host=localhost port=5432 dbname=recipes user=postgres password=admin'
 
+# per-process database connection pool (see simple_recipes.db.pool)
+app.config.setdefault('DB_POOL_MIN_SIZE', int(os.environ.get('DB_POOL_MIN_SIZE', 0)))
+app.config.setdefault('DB_POOL_MAX_SIZE', int(os.environ.get('DB_POOL_MAX_SIZE', 5)))
+app.config.setdefault('DB_POOL_TIMEOUT', float(os.environ.get('DB_POOL_TIMEOUT', 30)))
+app.config.setdefault('DB_POOL_CHECK_ON_CHECKOUT', True)
+
+# seconds before the cached measurement unit catalog is reloaded
+app.config.setdefault('UNITS_CACHE_TTL', int(os.environ.get('UNITS_CACHE_TTL', 300)))
+
+# rendered recipe pages for anonymous visitors (see simple_recipes.caching).
+# pages are keyed by the recipe's updated_at, so edits show up at once;
+# the TTL only bounds how long unused pages take up memory.
+app.config.setdefault('RECIPE_CACHE_SIZE', int(os.environ.get('RECIPE_CACHE_SIZE', 512)))
+app.config.setdefault('RECIPE_CACHE_TTL', int(os.environ.get('RECIPE_CACHE_TTL', 300)))
+
+# where new recipe image contents are stored: 'database' (inline bytea)
+# or 'filesystem' (content-addressed files under IMAGE_STORAGE_PATH)
+app.config.setdefault('IMAGE_STORAGE', os.environ.get('IMAGE_STORAGE', 'database'))
+app.config.setdefault('IMAGE_STORAGE_PATH', os.environ.get('IMAGE_STORAGE_PATH',
+    os.path.join(app.instance_path, 'images')))
+
+# image upload processing (see simple_recipes.image_processing.process_upload)
+app.config.setdefault('UPLOAD_MAX_DIMENSIONS', (2048, 2048))
+app.config.setdefault('UPLOAD_CONVERT_TO_WEBP', False)
+app.config.setdefault('UPLOAD_PROCESSES', int(os.environ.get('UPLOAD_PROCESSES', 2)))
+app.config.setdefault('UPLOAD_TIMEOUT', float(os.environ.get('UPLOAD_TIMEOUT', 60)))
+
+# recipe search results per page, and how far matches are counted
+app.config.setdefault('RECIPE_SEARCH_PAGE_SIZE', int(os.environ.get('RECIPE_SEARCH_PAGE_SIZE', 50)))
+app.config.setdefault('RECIPE_SEARCH_COUNT_LIMIT', int(os.environ.get('RECIPE_SEARCH_COUNT_LIMIT', 1000)))
+# pantry searches only rank the recipes using the most pantry items
+app.config.setdefault('PANTRY_SEARCH_CANDIDATES', int(os.environ.get('PANTRY_SEARCH_CANDIDATES', 500)))
+
+# search results (see simple_recipes.caching); kept short, since
+# other workers only see an edit once their copy expires.
+app.config.setdefault('RECIPE_SEARCH_CACHE_SIZE', int(os.environ.get('RECIPE_SEARCH_CACHE_SIZE', 256)))
+app.config.setdefault('RECIPE_SEARCH_CACHE_TTL', int(os.environ.get('RECIPE_SEARCH_CACHE_TTL', 60)))
+
+# recipe and tag name suggestions (see simple_recipes.db.typeahead):
+# 'memory' (in-process prefix index) or 'database' (pg_trgm queries)
+app.config.setdefault('TYPEAHEAD_BACKEND', os.environ.get('TYPEAHEAD_BACKEND', 'memory'))
+app.config.setdefault('TYPEAHEAD_TTL', int(os.environ.get('TYPEAHEAD_TTL', 300)))
+
+# users loaded for authenticated requests; the TTL bounds how long
+# other workers keep accepting a user after they're locked or renamed.
+app.config.setdefault('USER_CACHE_SIZE', int(os.environ.get('USER_CACHE_SIZE', 1024)))
+app.config.setdefault('USER_CACHE_TTL', int(os.environ.get('USER_CACHE_TTL', 60)))
+
+# password hashing (see simple_recipes.passwords). new and upgraded
+# hashes use these scrypt costs; each user's are stored with their hash.
+app.config.setdefault('SCRYPT_N', int(os.environ.get('SCRYPT_N', 16384)))
+app.config.setdefault('SCRYPT_R', int(os.environ.get('SCRYPT_R', 8)))
+app.config.setdefault('SCRYPT_P', int(os.environ.get('SCRYPT_P', 1)))
+# hashing runs in its own processes; logins beyond the queue limit,
+# or waiting longer than the timeout (seconds), get a 503.
+app.config.setdefault('PASSWORD_PROCESSES', int(os.environ.get('PASSWORD_PROCESSES', 2)))
+app.config.setdefault('PASSWORD_QUEUE_LIMIT', int(os.environ.get('PASSWORD_QUEUE_LIMIT', 8)))
+app.config.setdefault('PASSWORD_TIMEOUT', float(os.environ.get('PASSWORD_TIMEOUT', 10)))
+
+# login attempts allowed per client address, and failed ones per user
+# name, within the window (seconds). the 'memory' backend counts per
+# worker process; 'sqlite' shares the counts through a file at
+# LOGIN_RATE_LIMIT_PATH.
+app.config.setdefault('LOGIN_ATTEMPTS_PER_USER', int(os.environ.get('LOGIN_ATTEMPTS_PER_USER', 5)))
+app.config.setdefault('LOGIN_ATTEMPTS_PER_CLIENT', int(os.environ.get('LOGIN_ATTEMPTS_PER_CLIENT', 20)))
+app.config.setdefault('LOGIN_RATE_LIMIT_WINDOW', int(os.environ.get('LOGIN_RATE_LIMIT_WINDOW', 300)))
+app.config.setdefault('LOGIN_RATE_LIMIT_BACKEND', os.environ.get('LOGIN_RATE_LIMIT_BACKEND', 'memory'))
+app.config.setdefault('LOGIN_RATE_LIMIT_PATH', os.environ.get('LOGIN_RATE_LIMIT_PATH',
+    os.path.join(app.instance_path, 'login_attempts.sqlite3')))
+
+# proxies in front of the app whose X-Forwarded-For is trusted for
+# client addresses: 0 when serving directly, 1 behind Heroku's router
+# (see Procfile). trusting a proxy that isn't there lets clients pick
+# their own address.
+app.config.setdefault('TRUSTED_PROXY_COUNT', int(os.environ.get('TRUSTED_PROXY_COUNT', 0)))
+
+# seconds between batched writes of successful logins' last_login
+app.config.setdefault('LOGIN_FLUSH_INTERVAL', int(os.environ.get('LOGIN_FLUSH_INTERVAL', 30)))
+
+# where session contents are kept (see simple_recipes.sessions):
+# 'filesystem' or 'sqlite' keep them on the server, with only a session
+# ID in the cookie; 'cookie' keeps Flask's signed-cookie sessions.
+# server-side sessions expire SESSION_LIFETIME seconds after last use.
+app.config.setdefault('SESSION_BACKEND', os.environ.get('SESSION_BACKEND', 'filesystem'))
+app.config.setdefault('SESSION_STORE_PATH', os.environ.get('SESSION_STORE_PATH',
+    os.path.join(app.instance_path, 'sessions')))
+app.config.setdefault('SESSION_LIFETIME', int(os.environ.get('SESSION_LIFETIME', 7 * 24 * 60 * 60)))
+
+# generated share QR codes (see simple_recipes.qr_codes). they point at
+# SITE_URL, the site's public address, or if that isn't set, at the
+# address each request came to. the file limit bounds the disk tier.
+app.config.setdefault('SITE_URL', os.environ.get('SITE_URL'))
+app.config.setdefault('QR_CODE_CACHE_SIZE', int(os.environ.get('QR_CODE_CACHE_SIZE', 256)))
+app.config.setdefault('QR_CODE_CACHE_PATH', os.environ.get('QR_CODE_CACHE_PATH',
+    os.path.join(app.instance_path, 'qr_codes')))
+app.config.setdefault('QR_CODE_DISK_LIMIT', int(os.environ.get('QR_CODE_DISK_LIMIT', 10000)))
+
+# pint's on-disk cache of parsed unit definitions: ':auto:' for the
+# user cache directory, or None to parse them from scratch every time.
+# With gunicorn --preload, set UNIT_REGISTRY_PRELOAD to build the registry
+# once in the master process instead of on first use in every worker.
+app.config.setdefault('UNIT_REGISTRY_CACHE_FOLDER', 
+    os.environ.get('UNIT_REGISTRY_CACHE_FOLDER', ':auto:'))
+app.config.setdefault('UNIT_REGISTRY_PRELOAD', bool(os.environ.get('UNIT_REGISTRY_PRELOAD')))
+
+# output of simple_recipes.assets.build_assets
+app.config.setdefault('ASSET_BUILD_PATH', os.environ.get('ASSET_BUILD_PATH',
+    os.path.join(app.root_path, 'static_build')))
+
+if app.config['TRUSTED_PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+
+from simple_recipes.sessions import get_session_interface
+app.session_interface = get_session_interface(app) or app.session_interface
+
 csrf = CSRFProtect(app)
 Markdown(app, extensions=['tables', 'def_list'])
 
@@ -27,19 +143,55 @@ Talisman(app, content_security_policy=False)
 #####################################################################
 # Unit registry stuff
 
-# relaxed conversion for temperatures
-# see https://pint.readthedocs.io/en/stable/user/nonmult.html
-ureg = UnitRegistry(autoconvert_offset_to_baseunit = True)
+# building the registry (and importing pint) is slow,
+# so it only happens once something actually needs units.
+_ureg = None
+_ureg_lock = threading.Lock()
+
+def _reset_ureg_lock():
+    global _ureg_lock
+    _ureg_lock = threading.Lock()
+
+# a lock held by another thread at fork time would never be released.
+os.register_at_fork(after_in_child=_reset_ureg_lock)
+
+def get_unit_registry():
+    '''returns the shared pint UnitRegistry, building it on first use.'''
+    global _ureg
+    if _ureg is None:
+        with _ureg_lock:
+            if _ureg is None:
+                from pint import UnitRegistry
+
+                options = {}
+                if app.config['UNIT_REGISTRY_CACHE_FOLDER']:
+                    options['cache_folder'] = app.config['UNIT_REGISTRY_CACHE_FOLDER']
 
-# define aliases for units
-ureg.define('@alias fluid_ounce = fl_oz')
+                # relaxed conversion for temperatures
+                # see https://pint.readthedocs.io/en/stable/user/nonmult.html
+                ureg = UnitRegistry(autoconvert_offset_to_baseunit = True, **options)
 
-Q_ = ureg.Quantity
+                # define aliases for units
+                ureg.define('@alias fluid_ounce = fl_oz')
+                _ureg = ureg
+    return _ureg
+
+def Q_(*args, **kwargs):
+    return get_unit_registry().Quantity(*args, **kwargs)
+
+if app.config['UNIT_REGISTRY_PRELOAD']: get_unit_registry()
 #####################################################################
 
 from simple_recipes.controllers.tag_controllers import *
 from simple_recipes.controllers.recipe_controllers import *
 from simple_recipes.controllers.user_controllers import *
+from simple_recipes.caching import get_cache_stats
+from simple_recipes.db import get_pool_stats
+from simple_recipes.assets import asset_url, get_built_name, send_asset
+from simple_recipes.passwords import PasswordServiceUnavailable
+from simple_recipes.rate_limiting import TooManyLoginAttempts
+
+app.add_template_global(asset_url)
     
 @app.route('/')
 def index():
@@ -55,12 +207,41 @@ def handle_forbidden(e):
     return render_template('errors/forbidden.html'), \
         werkzeug.exceptions.Forbidden.code
 
+@app.errorhandler(PasswordServiceUnavailable)
+def handle_password_service_unavailable(e):
+    return render_template('errors/unavailable.html', message=str(e)), \
+        werkzeug.exceptions.ServiceUnavailable.code, {'Retry-After': '5'}
+
+@app.errorhandler(TooManyLoginAttempts)
+def handle_too_many_login_attempts(e):
+    return render_template('errors/too_many_requests.html', message=str(e)), \
+        werkzeug.exceptions.TooManyRequests.code, {'Retry-After': str(e.retry_after)}
+
 @app.route('/robots.txt')
 def robot_txt():
     return Response(    "User-agent: *\n"
                         "Disallow: /", 
                         mimetype='text/plain')
 
+@app.route('/stats/')
+@flask_login.login_required
+def get_stats():
+    return jsonify({
+        'caches': get_cache_stats(),
+        'db_pool': get_pool_stats(),
+    })
+
+@app.route('/assets/<path:file_name>')
+def get_asset(file_name):
+    response = send_asset(file_name)
+    if response is None:
+        abort(werkzeug.exceptions.NotFound.code)
+    return response
+
 @app.route('/images/<path:file_name>')
 def lightbox_image(file_name):
-    return app.send_static_file(f'lightbox/{file_name}')
\ No newline at end of file
+    built_name = get_built_name(f'lightbox/{file_name}')
+    if built_name is None:
+        return app.send_static_file(f'lightbox/{file_name}')
+    # this URL isn't fingerprinted, so it has to be revalidated.
+    return send_asset(built_name, cache_control='no-cache')
\ No newline at end of file
@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from flask import request, send_file, url_for
+
+from simple_recipes import app
+
+MANIFEST_NAME = 'manifest.json'
+
+# fingerprinted names change with their contents, so they never need revalidating.
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# types worth compressing; images are compressed already.
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.svg', '.ico', '.txt', '.json'}
+
+# precompressed siblings, in order of preference: (Content-Encoding, suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+css_url_pattern = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+#####################################################################
+# build step
+
+def _minify(name, text):
+    '''minifies JS and CSS when rjsmin / rcssmin are installed,
+    and otherwise leaves them as they are.'''
+    ext = os.path.splitext(name)[1]
+    try:
+        if ext == '.js':
+            import rjsmin
+            return rjsmin.jsmin(text)
+        if ext == '.css':
+            import rcssmin
+            return rcssmin.cssmin(text)
+    except ImportError:
+        pass
+    return text
+
+def _compress(data):
+    '''returns {suffix: compressed bytes} for every encoding that's
+    available and actually makes the file smaller.'''
+    compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        compressed['.br'] = brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    return {suffix: c for suffix, c in compressed.items() if len(c) < len(data)}
+
+def _get_fingerprinted_name(name, data):
+    root, ext = posixpath.splitext(name)
+    return f'{root}.{hashlib.md5(data).hexdigest()[:12]}{ext}'
+
+def _rewrite_css_urls(name, text, assets):
+    '''points relative url()s in a stylesheet at fingerprinted files.'''
+    directory = posixpath.dirname(name)
+
+    def replace(match):
+        quote, ref = match.groups()
+        target = posixpath.normpath(posixpath.join(directory, ref))
+        if target not in assets: return match.group(0)
+        return f'url({quote}{posixpath.relpath(assets[target], directory or ".")}{quote})'
+
+    return css_url_pattern.sub(replace, text)
+
+def build_assets(static_folder=None, output_folder=None):
+    '''writes a minified, fingerprinted copy of every static file
+    (e.g. style.css -> style.0123456789ab.css) to output_folder,
+    with .gz and .br siblings for text files, plus a manifest mapping
+    original names to fingerprinted ones.
+    Stylesheets are processed last, so url()s can refer to the
+    fingerprinted names of the files they reference.
+    Returns the number of files built.
+    '''
+    static_folder = static_folder or app.static_folder
+    output_folder = output_folder or app.config['ASSET_BUILD_PATH']
+
+    names = []
+    for directory, _, file_names in os.walk(static_folder):
+        for file_name in file_names:
+            path = os.path.relpath(os.path.join(directory, file_name), static_folder)
+            names.append(path.replace(os.sep, '/'))
+    names.sort(key=lambda name: (name.endswith('.css'), name))
+
+    if os.path.isdir(output_folder): shutil.rmtree(output_folder)
+
+    assets, encodings = {}, {}
+    for name in names:
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            data = f.read()
+
+        ext = posixpath.splitext(name)[1]
+        if ext in ('.js', '.css'):
+            # surrogateescape round-trips files that aren't valid UTF-8.
+            text = _minify(name, data.decode('utf-8', 'surrogateescape'))
+            if ext == '.css': text = _rewrite_css_urls(name, text, assets)
+            data = text.encode('utf-8', 'surrogateescape')
+
+        built_name = _get_fingerprinted_name(name, data)
+        variants = {'': data}
+        if ext in COMPRESSIBLE_EXTENSIONS: variants.update(_compress(data))
+
+        for suffix, variant in variants.items():
+            path = os.path.join(output_folder, built_name + suffix)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(variant)
+
+        assets[name] = built_name
+        encodings[built_name] = [suffix for _, suffix in ENCODINGS if suffix in variants]
+
+    with open(os.path.join(output_folder, MANIFEST_NAME), 'w') as f:
+        json.dump({'assets': assets, 'encodings': encodings}, f, indent=2, sort_keys=True)
+
+    return len(assets)
+
+#####################################################################
+# runtime
+
+_manifest = None
+
+def get_manifest():
+    '''the build manifest, loaded once per process.
+    Without a build, it's empty and static files are served as they are.
+    '''
+    global _manifest
+    if _manifest is None:
+        path = os.path.join(app.config['ASSET_BUILD_PATH'], MANIFEST_NAME)
+        try:
+            with open(path) as f:
+                _manifest = json.load(f)
+        except FileNotFoundError:
+            _manifest = {'assets': {}, 'encodings': {}}
+    return _manifest
+
+def get_built_name(name):
+    '''returns the fingerprinted name of a static file, or None if it isn't built.'''
+    return get_manifest()['assets'].get(name)
+
+def asset_url(endpoint, **values):
+    '''drop-in replacement for url_for in templates: static files
+    are linked by their fingerprinted names, once they're built.
+    '''
+    if endpoint == 'static':
+        built_name = get_built_name(values.get('filename'))
+        if built_name is not None:
+            values['file_name'] = built_name
+            del values['filename']
+            return url_for('get_asset', **values)
+    return url_for(endpoint, **values)
+
+def send_asset(built_name, cache_control=ASSET_CACHE_CONTROL):
+    '''sends a built file, precompressed according to Accept-Encoding.
+    Returns None if there's no such file.
+    '''
+    available = get_manifest()['encodings'].get(built_name)
+    if available is None: return None
+
+    path = os.path.join(app.config['ASSET_BUILD_PATH'], built_name)
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if suffix in available and request.accept_encodings[name]:
+            path, encoding = path + suffix, name
+            break
+
+    response = send_file(path,
+        mimetype=mimetypes.guess_type(built_name)[0] or 'application/octet-stream',
+        conditional=True)
+    if encoding: response.headers['Content-Encoding'] = encoding
+    if available: response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import threading
+import time
+
+from simple_recipes import app
+
+# every LRUCache, by name, so their stats can be reported together.
+caches = {}
+
+class LRUCache:
+    '''a bounded, thread-safe, process-local LRU cache,
+    with an optional time-to-live for entries (in seconds).
+    Hits, misses and evictions are counted for get_stats().
+    '''
+    def __init__(self, name, maxsize=128, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[0] if entry else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+def get_cache_stats():
+    '''returns {cache name: stats} for every LRUCache in this process.'''
+    return {name: cache.get_stats() for name, cache in caches.items()}
+
+#####################################################################
+# rendered recipe pages
+
+rendered_recipes = LRUCache('rendered_recipes', 
+    maxsize=app.config['RECIPE_CACHE_SIZE'],
+    ttl=app.config['RECIPE_CACHE_TTL'])
+
+def get_recipe_cache_key(recipe_id, updated_at, *args):
+    '''cache key for a recipe page. updated_at is the recipe's
+    (see db.recipes.get_recipe_updated_at), so a page is no longer
+    found in any worker once an edit to it has committed.
+    args are e.g. multiplier and unit system.
+    '''
+    return (recipe_id, updated_at) + args
+
+#####################################################################
+# recipe search results, keyed by normalized query and page
+
+recipe_searches = LRUCache('recipe_searches',
+    maxsize=app.config['RECIPE_SEARCH_CACHE_SIZE'],
+    ttl=app.config['RECIPE_SEARCH_CACHE_TTL'])
+
+def clear_recipe_searches():
+    '''drops all cached search results. Call it after any write to
+    recipes, their tags or their authors: any edit can change what
+    a search matches, or how it ranks, so they can't be dropped per recipe.
+    Rendered pages need no invalidation; their keys include the
+    recipe's updated_at, which the database keeps current.
+    '''
+    recipe_searches.clear()
+
+#####################################################################
+# user principals for flask_login's user_loader (see simple_recipes.db.users)
+
+user_principals = LRUCache('user_principals',
+    maxsize=app.config['USER_CACHE_SIZE'],
+    ttl=app.config['USER_CACHE_TTL'])
@@ -1,7 +1,9 @@
+from concurrent.futures import TimeoutError
+import os
 import re
 
 import werkzeug
-from flask import render_template, redirect, url_for, request, session, Response, abort, flash
+from flask import render_template, redirect, url_for, request, session, Response, abort, flash, jsonify
 import flask_login
 
 from simple_recipes import app, login_manager
@@ -9,14 +11,15 @@ from simple_recipes import app, login_manager
 from simple_recipes.db import get_measurement_units, get_units_concatenated
 from simple_recipes.db.recipes import get_recipe
 from simple_recipes.db.tags import get_tags
+from simple_recipes.db.typeahead import get_name_suggestions
 
-from simple_recipes.unit_conversion import parse_quantity_string, convert_quantity, convert_recipe_text
+from simple_recipes.unit_conversion import parse_quantity_string, convert_quantity, convert_recipe_text, compile_recipe_text, render_recipe_text
 
+from simple_recipes.caching import rendered_recipes, recipe_searches, get_recipe_cache_key
 from simple_recipes.forms import RecipeForm, RecipeConversionForm, RecipeSearchForm, DeletionForm
 import simple_recipes.controllers
 from simple_recipes.controllers.recipe_controllers.recipe_images import *
 from simple_recipes.controllers.recipe_controllers.recipe_ingredients import *
-from simple_recipes.controllers.recipe_controllers.recipe_instructions import *
 from simple_recipes.controllers.recipe_controllers.recipe_tags import *
 
 @app.route('/recipes/')
@@ -25,49 +28,121 @@ def search_recipes():
 
     search = request.args.get('what', '')
     opt = request.args.get('how', '')
-    tsquery = ''
-    
-    if opt.upper() == 'ALL':
-        tsquery = ' & '.join(search.split())
-    elif opt.upper() == 'ANY':
-        tsquery = ' | '.join(search.split())
-    else:
-        tsquery = search
+    query = db.normalize_search_query(search, opt)
+        
+    tag_ids = sorted(set(request.args.getlist('tag', type=int)))
         
-    recipes, count = None, 0
-    if tsquery:
-        recipes = db.get_recipes(tsquery)
-        count = len(recipes)
+    results, next_url = None, None
+    if query:
+        after = parse_search_cursor(request.args.get('after'))
+        cache_key = (query, tuple(tag_ids), after)
+        results = recipe_searches.get(cache_key)
+        if results is None:
+            results = db.get_recipes(query, after=after, 
+                tag_ids=tag_ids, with_facets=True)
+            recipe_searches.set(cache_key, results)
+        if results['next']:
+            next_url = url_for('search_recipes', what=search, how=opt, tag=tag_ids, 
+                after=format_search_cursor(results['next']))
         form.how.data = opt
         form.what.data = search
     else: form.how.data = 'all'
         
     return render_template('recipes/recipe_search.html', 
-        recipes=recipes, form=form, count=count)
+        results=results, form=form, next_url=next_url, 
+        search=search, how=opt, tag_ids=tag_ids)
+
+@app.route('/typeahead/')
+def typeahead():
+    '''JSON list of recipes and tags whose names match the
+    beginning of a word in ?q=, for autocompleting searches.'''
+    q = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+
+    suggestions = []
+    for kind, id, name in get_name_suggestions(q, limit) if q.strip() else []:
+        if kind == 'recipe':
+            url = url_for('get_recipe', recipe_id=id, subpath=name)
+        else:
+            url = url_for('get_tag', tag_id=id)
+        suggestions.append({'type': kind, 'id': id, 'name': name, 'url': url})
+    return jsonify(suggestions)
+
+@app.route('/recipes/pantry/')
+def search_recipes_by_ingredients():
+    '''JSON list of recipes that can be made (or nearly) with the
+    pantry items given as ?item=eggs&item=flour or ?items=eggs, flour,
+    best covered first.'''
+    items = request.args.getlist('item')
+    for text in request.args.getlist('items'): items.extend(text.split(','))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+
+    recipes = db.get_recipes_by_ingredients(items[:50], limit)
+    for recipe in recipes:
+        recipe['url'] = url_for('get_recipe', 
+            recipe_id=recipe['recipe_id'], subpath=recipe['recipe_name'])
+    return jsonify(recipes)
+
+def format_search_cursor(cursor):
+    rank, recipe_id = cursor
+    return f'{rank!r}_{recipe_id}'
+
+def parse_search_cursor(text):
+    '''(rank, recipe_id) from format_search_cursor, or None if invalid.'''
+    try:
+        rank, recipe_id = text.split('_')
+        return float(rank), int(recipe_id)
+    except (AttributeError, ValueError):
+        return None
         
+def render_recipe_field(field, tokens, multiplier, to_system, units):
+    '''renders the ingredients or instructions of a recipe.
+    Only ingredients are scaled by the multiplier; quantities in the
+    instructions (oven temperatures, times) are only converted.'''
+    return render_recipe_text(
+        tokens, 
+        multiplier=multiplier if field == 'ingredients' else 1, 
+        to_system=to_system,
+        units=units,
+        quantity_tag='span',
+        Class="quantity")
+
 @app.route('/recipes/<int:recipe_id>/')
 @app.route('/recipes/<int:recipe_id>/<path:subpath>')
 def get_recipe(recipe_id, subpath=None):
     multiplier = request.args.get('multiplier', default=1, type=float)
     to_system = request.args.get('unit_system', default=None)
     
-    formdata = None
-    if 'formdata' in session: formdata = session.pop('formdata')
-    if 'pages' in session: session.pop('pages')
+    # the page only varies per user for logged-in users (edit links)
+    # and when there are flashed messages, so cache it for everyone else.
+    # without a session cookie there's neither, and the server-side
+    # session isn't loaded just to find that out.
+    is_cacheable = (app.session_cookie_name not in request.cookies
+        or (not flask_login.current_user.is_authenticated
+            and '_flashes' not in session))
+    if is_cacheable:
+        # a primary key lookup, instead of loading and rendering the recipe.
+        updated_at = db.get_recipe_updated_at(recipe_id)
+        if updated_at is None:
+            abort(werkzeug.exceptions.NotFound.code)
+        cache_key = get_recipe_cache_key(recipe_id, updated_at, multiplier, to_system)
+        page = rendered_recipes.get(cache_key)
+        if page is not None: return page
     
     data = db.get_recipe(recipe_id)
     if data:
         units = get_measurement_units()
         data['servings'] *= multiplier
-        data['ingredients'] = convert_recipe_text(
-            data['ingredients'], 
-            multiplier=multiplier, 
-            to_system=to_system,
-            units=units,
-            quantity_tag='span',
-            Class="quantity")
-
-        return render_template('recipes/recipe_base.html', data=data)
+        for field in ('ingredients', 'instructions'):
+            if not data[field]: continue
+            # fall back to compiling here for recipes saved before
+            # token streams were stored.
+            tokens = data[f'{field}_tokens'] or compile_recipe_text(data[field])
+            data[field] = render_recipe_field(field, tokens, multiplier, to_system, units)
+
+        page = render_template('recipes/recipe_base.html', data=data)
+        if is_cacheable: rendered_recipes.set(cache_key, page)
+        return page
     else:
         abort(werkzeug.exceptions.NotFound.code)
 
@@ -78,10 +153,46 @@ def convert_recipe(recipe_id):
     data = db.get_recipe(recipe_id)
     return render_template('recipes/recipe_convert.html', form=form, data=data)
         
+def save_new_recipe(form):
+    '''creates the recipe from a validated RecipeForm and its uploaded
+    images, returning its ID. Problems with the images are added to
+    the form's errors instead, and None is returned.'''
+    files = [f for f in request.files.getlist(form.image_uploads.name) 
+        if f.filename]
+    file_descriptions = form.image_descriptions.data.split('\n')
+    if files and len(files) != len(file_descriptions):
+        form.image_descriptions.errors.append('Some files were missing descriptions')
+        return None
+
+    # everything is saved in one transaction, so a failure
+    # part way through doesn't leave a half-made recipe behind.
+    temp_paths = []
+    try:
+        try:
+            images = process_image_uploads(
+                files, file_descriptions, temp_paths)
+        except ValueError:
+            form.image_uploads.errors.append('Some files were not valid images')
+            return None
+        except TimeoutError:
+            form.image_uploads.errors.append(
+                'Processing the images took too long, please try again')
+            return None
+
+        data = dict(form.data, created_by=flask_login.current_user.id)
+        return db.create_recipe(data, 
+            tag_ids=form.recipe_tags.data, images=images)
+    finally:
+        for path in temp_paths: os.remove(path)
+
 @app.route('/recipes/add/', methods=['GET', 'POST'])
 @flask_login.login_required
 def add_recipe():
+    '''adds a whole recipe, with its tags and images, in one request.
+    Clients asking for JSON get {recipe_id, url} back instead of a redirect,
+    or {errors} with a 400 if the recipe couldn't be added.'''
     form = RecipeForm()
+    wants_json = request.accept_mimetypes.best == 'application/json'
     
     tags = [(t['tag_id'], t['tag_name']) for t in get_tags()]
     form.recipe_tags.choices = tags
@@ -89,21 +200,27 @@ def add_recipe():
     unit_string = get_units_concatenated("|")
     
     if form.validate_on_submit():
-        recipe_id = db.update_recipe_basic(form.data)
-        session['formdata'] = request.form
-        session['pages'] = [
-            'edit_recipe_ingredients', 
-            'edit_recipe_instructions', 
-            'edit_recipe_tags']
-        session['tag_choices'] = tags
-            
-        return redirect(url_for(session['pages'].pop(0), 
-            recipe_id=recipe_id), code=307)
-    else:
-        regex = r"/(\d+[\d\s./]*(" + unit_string + r")?)\s+/gi"
-        form.created_by.data = flask_login.current_user.id
-        return render_template('recipes/recipe_add.html', 
-            form=form, quantity_regex=regex, unit_string=unit_string)
+        recipe_id = save_new_recipe(form)
+        if recipe_id is not None:
+            if wants_json:
+                return jsonify({
+                    'recipe_id' : recipe_id,
+                    'url' : url_for('get_recipe', recipe_id=recipe_id)
+                }), 201
+            return redirect(url_for('get_recipe', recipe_id=recipe_id))
+
+    if form.errors:
+        if wants_json:
+            return jsonify({'errors' : form.errors}), \
+                werkzeug.exceptions.BadRequest.code
+        # shown above the form, which keeps what was entered.
+        for errors in form.errors.values():
+            for error in errors: flash(error)
+
+    regex = r"/(\d+[\d\s./]*(" + unit_string + r")?)\s+/gi"
+    form.created_by.data = flask_login.current_user.id
+    return render_template('recipes/recipe_add.html', 
+        form=form, quantity_regex=regex, unit_string=unit_string)
     
 @app.route('/recipes/<int:recipe_id>/edit/', methods=['GET', 'POST'])
 @app.route('/recipes/<int:recipe_id>/edit/basic/', methods=['GET', 'POST'])
@@ -121,9 +238,11 @@ def edit_recipe_basic(recipe_id):
     form.servings.flags.required = True
     
     if form.validate_on_submit():
-        data = form.data
+        # only the fields on this page, so the recipe's text is left alone.
+        data = {k: form.data[k] for k in 
+            ('recipe_name', 'recipe_desc', 'servings', 'total_time_minutes')}
         data.update({"recipe_id": recipe_id})
-        db.update_recipe_basic(data)
+        db.add_or_update_recipe(data)
         return redirect(url_for('get_recipe', recipe_id=recipe_id))
     else:
         # prepopulate fields
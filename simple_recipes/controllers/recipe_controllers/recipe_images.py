@@ -1,43 +1,193 @@
+from concurrent.futures import TimeoutError
+import hashlib
 import io
+import os
+import tempfile
 
 import werkzeug
 from werkzeug.utils import secure_filename
-from flask import render_template, redirect, url_for, request, session, Response, abort, flash
+from flask import render_template, redirect, url_for, request, session, Response, abort, flash, send_file
 import flask_login
 from PIL import Image
-import pyqrcode
 
 from simple_recipes import app, login_manager
 from simple_recipes.db import recipes as db
 from simple_recipes.forms import RecipeForm
+from simple_recipes import qr_codes
+from simple_recipes.image_processing import RENDITION_SIZES, WIDTH_VARIANTS, \
+    process_uploads, get_variant_name
 import simple_recipes.controllers
 
+# an image ID's contents never change, so browsers can keep them forever.
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
 @app.route('/images/<int:image_id>/<file_name>')
 def get_image(image_id, file_name):
-    img = db.get_recipe_image(image_id)
-    img_data = img['image_bytes']
-    chunk_size = 255
-    
-    def generate():
-        for chunk_start in range(0, len(img_data), chunk_size):
-            yield img_data[chunk_start:chunk_start + chunk_size]
+    # revalidation only needs the hash, not the image itself.
+    if request.if_none_match:
+        content_hash = db.get_recipe_image_hash(image_id)
+        if content_hash is None:
+            abort(werkzeug.exceptions.NotFound.code)
+        if request.if_none_match.contains(content_hash):
+            response = Response(status=304)
+            response.set_etag(content_hash)
+            response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+            return response
+
+    img = db.get_recipe_image(image_id, load_bytes=False)
+    if img is None:
+        abort(werkzeug.exceptions.NotFound.code)
     
-    # return Response(img['image_bytes'], mimetype=img['file_type'])
-    return Response(generate(), mimetype=img['file_type'])
+    if img['file_path']:
+        # blob store files go out through the server's file wrapper
+        # (or X-Sendfile, with USE_X_SENDFILE), without being read here.
+        response = send_file(img['file_path'], 
+            mimetype=img['file_type'], add_etags=False)
+        complete_length = os.path.getsize(img['file_path'])
+    else:
+        # the whole body goes out in one write.
+        response = Response(img['image_bytes'], mimetype=img['file_type'])
+        complete_length = len(img['image_bytes'])
+
+    # make_conditional handles Range requests (206) as well.
+    response.set_etag(img['content_hash'])
+    response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+    return response.make_conditional(request, 
+        accept_ranges=not app.config.get('USE_X_SENDFILE'),
+        complete_length=complete_length)
+
+@app.route('/images/<int:image_id>/<int:width>/<file_name>')
+def get_image_variant(image_id, width, file_name):
+    '''serves the image scaled down to one of the WIDTH_VARIANTS.
+    Images no wider than that don't have the variant, and redirect
+    to the original; so do ones whose variants haven't been generated
+    yet (`admin.py` can generate the missing ones).'''
+    if width not in WIDTH_VARIANTS:
+        abort(werkzeug.exceptions.NotFound.code)
+
+    variant = db.get_recipe_image_rendition(image_id, get_variant_name(width))
+    if not variant:
+        size = db.get_recipe_image_size(image_id)
+        if size is None:
+            abort(werkzeug.exceptions.NotFound.code)
+        original_url = url_for('get_image', image_id=image_id, file_name=file_name)
+        image_width, image_height = size
+        if image_width is not None and image_width <= width:
+            response = redirect(original_url, code=301)
+            response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+            return response
+        return redirect(original_url)
+
+    response = Response(variant['image_bytes'], mimetype=variant['file_type'])
+    response.set_etag(hashlib.md5(variant['image_bytes']).hexdigest())
+    response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+    return response.make_conditional(request)
+
+def get_image_widths(img):
+    '''the WIDTH_VARIANTS an image from recipe_json's `images` has,
+    and its own width if known, as (url, width) pairs.'''
+    image_width = img.get('image_width')
+    urls = [(url_for('get_image_variant', 
+            image_id=img['image_id'], 
+            width=width,
+            file_name=img['image_file_name']), width)
+        for width in WIDTH_VARIANTS
+        if image_width is None or width < image_width]
+    if image_width is not None:
+        urls.append((url_for('get_image', 
+            image_id=img['image_id'], 
+            file_name=img['image_file_name']), image_width))
+    return urls
+
+@app.template_global()
+def image_srcset(img):
+    '''srcset attribute value listing the widths of an image
+    from recipe_json's `images` (see get_image_widths).'''
+    return ', '.join(f'{url} {width}w' for url, width in get_image_widths(img))
+
+@app.template_global()
+def image_variant_url(img, width=WIDTH_VARIANTS[-1]):
+    '''URL of the image's narrowest width variant that's at least
+    the given width, or else of its widest (maybe the original).'''
+    widths = get_image_widths(img)
+    return next((url for url, w in widths if w >= width), widths[-1][0])
 
 @app.route('/thumbnails/<int:image_id>/<file_name>')
 def get_image_thumbnail(image_id, file_name):
+    '''serves a resized image. ?size= picks the rendition 
+    (see RENDITION_SIZES), and defaults to thumbnail.
+    '''
+    size = request.args.get('size', 'thumbnail')
+    if size not in RENDITION_SIZES:
+        abort(werkzeug.exceptions.NotFound.code)
+
+    rendition = db.get_recipe_image_rendition(image_id, size)
+    if rendition:
+        return Response(rendition['image_bytes'], 
+            mimetype=rendition['file_type'])
+
+    # fallback for images without stored renditions;
+    # `admin.py` can generate the missing ones.
     img_data = db.get_recipe_image(image_id)
     img_bytes = img_data['image_bytes']
     img_file_type = img_data['file_type']
 
     img = Image.open(io.BytesIO(img_bytes))
-    img.thumbnail((90,90))
+    img.thumbnail(RENDITION_SIZES[size])
 
     img_bytes = io.BytesIO()
     img.save(img_bytes, format=img.format)
     return Response(img_bytes.getvalue(), mimetype=img_file_type)
 
+def process_image_uploads(files, file_descriptions, temp_paths):
+    '''spools uploaded files to temporary files and processes them
+    (see process_uploads), returning the list for add_recipe_images.
+    Files without a name (empty upload fields) are skipped.
+    Every temporary file is added to temp_paths, for the caller 
+    to remove once the images are saved.
+    Raises ValueError if some files are not valid images,
+    or TimeoutError if processing takes longer than UPLOAD_TIMEOUT.
+    '''
+    file_list = []
+    # spool each upload to its own file, so no upload is
+    # held in memory and worker processes can open them.
+    for i, f in enumerate(files):
+        if f.filename:
+            fd, path = tempfile.mkstemp()
+            os.close(fd)
+            temp_paths.append(path)
+            f.save(path)
+
+            d = {}
+            d['image_file_name'] = secure_filename(f.filename)
+            d['image_desc'] = file_descriptions[i]
+            d['image_path'] = path
+            file_list.append(d)
+
+    if not file_list: return file_list
+
+    results = process_uploads(
+        [d['image_path'] for d in file_list],
+        max_workers=app.config['UPLOAD_PROCESSES'],
+        timeout=app.config['UPLOAD_TIMEOUT'],
+        max_size=app.config['UPLOAD_MAX_DIMENSIONS'],
+        convert_to_webp=app.config['UPLOAD_CONVERT_TO_WEBP'])
+
+    for d, result in zip(file_list, results):
+        if result['image_path'] != d['image_path']:
+            temp_paths.append(result['image_path'])
+        temp_paths.extend(r['image_path'] for r in result['renditions'].values())
+        if result['file_type'] == 'image/webp':
+            d['image_file_name'] = (os.path.splitext(
+                d['image_file_name'])[0] + '.webp')
+        d['image_path'] = result['image_path']
+        d['file_type'] = result['file_type']
+        d['image_width'] = result['width']
+        d['image_height'] = result['height']
+        d['renditions'] = result['renditions']
+
+    return file_list
+
 @app.route('/recipes/<int:recipe_id>/edit/images/', methods=['GET', 'POST'])
 @flask_login.login_required
 def edit_recipe_images(recipe_id):
@@ -70,17 +220,21 @@ def edit_recipe_images(recipe_id):
             flash('Some files were missing descriptions')
             return redirect(request.url)
         elif files:
-            file_list = []
-            for i, f in enumerate(files):
-                if f.filename:
-                    d = {}
-                    d['image_file_name'] = secure_filename(f.filename)
-                    d['file_type'] = f.mimetype
-                    d['image_desc'] = file_descriptions[i]
-                    d['image_bytes'] = f.read()
-                    file_list.append(d)
+            temp_paths = []
+            try:
+                try:
+                    file_list = process_image_uploads(
+                        files, file_descriptions, temp_paths)
+                except ValueError:
+                    flash('Some files were not valid images')
+                    return redirect(request.url)
+                except TimeoutError:
+                    flash('Processing the images took too long, please try again')
+                    return redirect(request.url)
             
-            db.add_recipe_images(recipe_id, file_list)
+                db.add_recipe_images(recipe_id, file_list)
+            finally:
+                for path in temp_paths: os.remove(path)
             
         return redirect(url_for('get_recipe', recipe_id=recipe_id))
                 
@@ -90,8 +244,22 @@ def edit_recipe_images(recipe_id):
 
 @app.route('/share/recipe/<int:recipe_id>/')
 def share_recipe(recipe_id):
-    url = url_for('get_recipe', recipe_id=recipe_id, _external=True)
-    qr = pyqrcode.create(url)
-    buffer = io.BytesIO()
-    qr.svg(buffer, scale=4)
-    return Response(buffer.getvalue(), mimetype='image/svg+xml')
\ No newline at end of file
+    kind = request.args.get('format', 'svg')
+    scale = request.args.get('scale', qr_codes.DEFAULT_SCALE, type=int)
+    if kind not in qr_codes.MIME_TYPES or not 1 <= scale <= qr_codes.MAX_SCALE:
+        abort(werkzeug.exceptions.NotFound.code)
+    # a primary key lookup, so made-up IDs can't fill the cache.
+    if db.get_recipe_updated_at(recipe_id) is None:
+        abort(werkzeug.exceptions.NotFound.code)
+
+    # the code only depends on its inputs, so neither a cache lookup
+    # nor generation is needed to answer a revalidation.
+    etag = qr_codes.get_qr_code_key(recipe_id, scale, kind)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(qr_codes.get_qr_code(recipe_id, scale, kind), 
+            mimetype=qr_codes.MIME_TYPES[kind])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+    return response
@@ -1,5 +1,4 @@
 import werkzeug
-from werkzeug.datastructures import MultiDict
 from flask import render_template, redirect, url_for, request, session, Response, abort, flash
 import flask_login
 
@@ -18,36 +17,14 @@ def edit_recipe_tags(recipe_id):
         flash("You can only edit recipes you've created")
         abort(werkzeug.exceptions.Forbidden.code)
     
-    formdata = session.get('formdata', None)
-    tags = session.get('tag_choices', [])
-    
-    if formdata:
-        form = RecipeForm(data=MultiDict(formdata))
-        form.recipe_tags.choices = tags
-        form.validate()
-    else:
-        form = RecipeForm()
-    
-    if not tags:
-        tags = get_tags()
-    
+    form = RecipeForm()
     form.recipe_tags.choices = [
         (t['tag_id'], t['tag_name']) for t in get_tags()]
     
     if form.validate_on_submit():
         db.update_recipe_tags(recipe_id, form.recipe_tags.data)
-        
-        pages = session.get('pages', None)
-        if pages:
-            page = pages.pop(0)
-            session['pages'] = pages
-            return redirect(url_for(page, 
-                recipe_id=recipe_id), code=307)
-        else:
-            return redirect(url_for('get_recipe', recipe_id=recipe_id))
+        return redirect(url_for('get_recipe', recipe_id=recipe_id))
     else:
-        if 'formdata' in session: session.pop('formdata')
-        if 'pages' in session: session.pop('pages')
         # prepopulate fields
         if data['tags']:
             form.recipe_tags.data = [tag['tag_id'] for tag in data['tags']]
@@ -1,13 +1,12 @@
-import os
-
-from flask import render_template, redirect, url_for, flash
+from flask import render_template, redirect, url_for, flash, request
 
 import flask_login
 
-import scrypt
-
 from simple_recipes import app, login_manager
 from simple_recipes.db.users import *
+from simple_recipes.passwords import hash_password
+from simple_recipes.rate_limiting import check_login_rate, record_failed_login
+from simple_recipes.db.session import read_write
 from simple_recipes.forms import UserForm
 
 class User(flask_login.UserMixin):
@@ -15,7 +14,7 @@ class User(flask_login.UserMixin):
 
 @login_manager.user_loader
 def user_loader(user_name):
-    d = get_user(user_name=user_name)
+    d = get_user_principal(user_name)
     if not d: return
 
     user = User()
@@ -28,12 +27,18 @@ def request_loader(request):
     user_name = request.form.get('user_name')
     entered_password = request.form.get('user_pw')
 
-    if user_name and entered_password and get_user(user_name=user_name):
+    if not (user_name and entered_password): return
+    check_login_rate(user_name, request.remote_addr)
+
+    if get_user(user_name=user_name):
         user = User()
         user.id = user_name
         if is_user_password_valid(entered_password, user_name=user_name):
             user.is_authenticated = True
-        else: flash("Incorrect Password")
+        else:
+            record_failed_login(user_name)
+            flash("Incorrect Password")
+    else: record_failed_login(user_name)
 
 @app.route('/login/', methods=['GET', 'POST'])
 def login():
@@ -45,6 +50,7 @@ def login():
     if form.validate_on_submit():
         user_name = form.user_name.data
         user_pw = form.current_pw.data
+        check_login_rate(user_name, request.remote_addr)
 
         try:
             if is_user_password_valid(user_pw, user_name=user_name):
@@ -54,8 +60,10 @@ def login():
 
                 return redirect(url_for('account'))
             else:
+                record_failed_login(user_name)
                 flash("Incorrect username or password")
         except PermissionError as exc:
+            record_failed_login(user_name)
             flash(exc)
 
     return render_template('users/login.html', form=form)
@@ -67,6 +75,7 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/account/', methods=['GET', 'POST'])
+@read_write # clears the RESET status on GET
 @flask_login.login_required
 def account():
     user_name = flask_login.current_user.id
@@ -91,10 +100,9 @@ def change_password():
     if form.validate_on_submit():
         if form.new_pw.data != form.new_pw_confirmation.data:
             flash("New password must match in both fields!")
-        if is_user_password_valid(user_name, current_pw):
-            salt = os.urandom(64)
-            hashed = scrypt.hash(form.new_pw.data, salt)
-            update_user_password(hashed, salt, user_name=user_name)
+        # the new password replaces the hash anyway, so don't upgrade it first.
+        if is_user_password_valid(current_pw, rehash=False, user_name=user_name):
+            update_user_password(*hash_password(form.new_pw.data), user_name=user_name)
             flash("Password successfully changed")
             return redirect(url_for('account'))
 
@@ -3,8 +3,11 @@ import psycopg2.extras
 import os
 
 from simple_recipes import app
+from simple_recipes.db.pool import get_pool, get_pool_stats, close_pool, PooledConnection
+from simple_recipes.db.session import get_request_session, read_write, after_commit, init_app as init_request_session
+from simple_recipes.db.units import UnitCatalogCache
 
-def get_connection():
+def get_database_url():
     DATABASE_URL = None
     if app.config['ENV'] == 'development':
         DATABASE_URL = app.config['DATABASE_URL']
@@ -12,7 +15,52 @@ def get_connection():
         DATABASE_URL = os.environ['DATABASE_URL']
     else:
         DATABASE_URL = 'host=localhost port=5432 dbname=recipes user=postgres password=admin'
-    return connect(DATABASE_URL)
+    return DATABASE_URL
+
+def get_connection():
+    '''returns a context manager for a database connection.
+    Use it the same way as a psycopg2 connection:
+
+    with get_connection() as cn:
+        with get_cursor(cn) as cur:
+            ...
+
+    Inside a Flask request, every call joins the request's session
+    (see simple_recipes.db.session): one connection and one transaction,
+    committed once after the view returns.
+    Outside a request, the connection comes from this process's pool
+    and the transaction is committed (or rolled back on error)
+    when the block exits.
+    Pool sizing comes from the DB_POOL_* settings in app.config;
+    set DB_POOL_MAX_SIZE to 0 to disable pooling altogether.
+    '''
+    session = get_request_session()
+    if session is not None:
+        return session.join()
+
+    if not app.config['DB_POOL_MAX_SIZE']:
+        return connect(get_database_url())
+    return PooledConnection(_get_pool())
+
+def _get_pool():
+    return get_pool(get_database_url(),
+        min_size=app.config['DB_POOL_MIN_SIZE'],
+        max_size=app.config['DB_POOL_MAX_SIZE'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+        check_on_checkout=app.config['DB_POOL_CHECK_ON_CHECKOUT'])
+
+def _acquire_connection():
+    if not app.config['DB_POOL_MAX_SIZE']:
+        return connect(get_database_url())
+    return _get_pool().getconn()
+
+def _release_connection(cn, close=False):
+    if not app.config['DB_POOL_MAX_SIZE']:
+        cn.close()
+    else:
+        _get_pool().putconn(cn, close=close)
+
+init_request_session(app, _acquire_connection, _release_connection)
         
 def get_cursor(cn):
     return cn.cursor(cursor_factory = psycopg2.extras.DictCursor)
@@ -54,38 +102,43 @@ def get_table_counts():
             cur.execute(statement)
             return cur.fetchall()
         
-def get_measurement_units(**criteria):
+def _load_measurement_units():
     statement = "SELECT units_json();"
     with get_connection() as cn:
         with get_cursor(cn) as cur:
             cur.execute(statement)
-            data = cur.fetchone()[0]
-
-            '''
-            # search data based on provided criteria
-            if 'unit_id' in criteria:
-                criterion = criteria['unit_id']
-                data = [u for u in data if u['unit_id'] == criterion]
-            elif 'unit_name' in criteria:
-                criterion = criteria['unit_name']
-                data = [u for u in data if criterion in (
-                    u['unit_plural'],
-                    u['unit_singular'],
-                    u['unit_abbr'])]
-            elif 'unit_system' in criteria or 'unit_category' in criteria:
-                cat = criteria.get('unit_category')
-                sys = criteria.get('unit_system')
-                data = [u for u in data if
-                        (u['unit_category'] == cat or not cat) and
-                        (u['unit_system'] == sys or not sys)]
-
-            if 'only_include_convertibles' in criteria:
-                data = [u for u in data if u['include_in_conversions']]
-            '''
-
-            return data
+            return cur.fetchone()[0]
+
+_unit_cache = UnitCatalogCache(_load_measurement_units,
+    ttl=app.config['UNITS_CACHE_TTL'])
+
+def get_unit_catalog():
+    '''returns the cached UnitCatalog (see simple_recipes.db.units)'''
+    return _unit_cache.get()
+
+def invalidate_measurement_units():
+    '''call this after changing the units table,
+    so the next lookup reloads the catalog.
+    '''
+    _unit_cache.invalidate()
+
+def get_measurement_units(**criteria):
+    '''returns a dict of measurement units, keyed by pint unit name.
+    The catalog is cached in-process (see UNITS_CACHE_TTL),
+    so the returned dict is shared and must not be modified.
+
+    optional criteria:
+     - unit_id
+     - unit_name: matches plural, singular or abbreviation
+     - unit_category and/or unit_system
+     - only_include_convertibles
+    '''
+    return get_unit_catalog().find(**criteria)
         
 def get_unit_strings(**criteria):
+    if not criteria:
+        return list(get_unit_catalog().unit_strings)
+
     units = get_measurement_units(**criteria)
     strings = []
 
@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+
+from psycopg2 import connect, pool, OperationalError, InterfaceError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+class ConnectionPool:
+    '''a small, thread-safe pool of psycopg2 connections.
+
+    Connections are created lazily up to max_size. Checking out a
+    connection when the pool is exhausted blocks for up to `timeout`
+    seconds before raising psycopg2.pool.PoolError.
+    If check_on_checkout is set, idle connections are pinged with
+    `SELECT 1` before being handed out, and discarded if that fails.
+    '''
+    def __init__(self, dsn, min_size=1, max_size=10,
+            timeout=30, check_on_checkout=True):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("pool sizes must satisfy 0 <= min_size <= max_size")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_on_checkout = check_on_checkout
+        self.pid = os.getpid()
+
+        self._idle = []
+        self._in_use = 0
+        self._lock = threading.Condition()
+        self._closed = False
+        self._stats = {
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'checkouts': 0,
+            'checkout_waits': 0,
+            'checkout_timeouts': 0,
+            'failed_health_checks': 0,
+        }
+
+        for _ in range(min_size):
+            self._idle.append(self._connect())
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _connect(self):
+        cn = connect(self.dsn)
+        self._count('connections_created')
+        return cn
+
+    def _discard(self, cn):
+        self._count('connections_discarded')
+        try: cn.close()
+        except Exception: pass
+
+    def _is_healthy(self, cn):
+        if cn.closed: return False
+        if not self.check_on_checkout: return True
+        try:
+            with cn.cursor() as cur:
+                cur.execute("SELECT 1")
+            cn.rollback()
+            return True
+        except (OperationalError, InterfaceError):
+            self._count('failed_health_checks')
+            return False
+
+    def getconn(self):
+        '''checks out a connection, blocking if the pool is exhausted.'''
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise pool.PoolError("connection pool is closed")
+                if self._idle or self._in_use < self.max_size:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['checkout_timeouts'] += 1
+                    raise pool.PoolError("connection pool exhausted")
+                self._stats['checkout_waits'] += 1
+                self._lock.wait(remaining)
+
+            # reserve the slot before doing any I/O,
+            # so other threads can't overshoot max_size meanwhile.
+            cn = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+
+        try:
+            if cn is not None and not self._is_healthy(cn):
+                self._discard(cn)
+                cn = None
+            if cn is None:
+                cn = self._connect()
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+        return cn
+
+    def putconn(self, cn, close=False):
+        '''returns a connection to the pool.
+        Connections that are broken are discarded, and connections
+        left inside a transaction are rolled back before reuse.
+        '''
+        if not close and not cn.closed:
+            try:
+                if cn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    cn.rollback()
+            except (OperationalError, InterfaceError):
+                close = True
+
+        with self._lock:
+            self._in_use -= 1
+            keep = not (close or cn.closed or self._closed)
+            if keep: self._idle.append(cn)
+            self._lock.notify()
+
+        if not keep: self._discard(cn)
+
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._lock.notify_all()
+        for cn in idle: self._discard(cn)
+
+    def get_stats(self):
+        '''returns a snapshot of the pool's counters and current sizes.'''
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'pid': self.pid,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+            })
+            return stats
+
+class PooledConnection:
+    '''context manager wrapping a pooled connection.
+
+    Behaves like `with psycopg2.connect(...) as cn`: the block gets the
+    raw connection, which is committed on success and rolled back on
+    error. Unlike a plain psycopg2 connection, the connection is then
+    returned to the pool instead of being left open.
+    '''
+    def __init__(self, connection_pool):
+        self._pool = connection_pool
+        self._cn = None
+
+    def __enter__(self):
+        self._cn = self._pool.getconn()
+        return self._cn.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        cn, self._cn = self._cn, None
+        broken = False
+        try:
+            cn.__exit__(exc_type, exc, tb)
+        except (OperationalError, InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._pool.putconn(cn, close=broken or bool(cn.closed))
+
+def _detach_connection(cn):
+    '''makes a connection inherited from a parent process safe to drop.
+
+    Closing a libpq connection, explicitly or when it's garbage
+    collected, tells the server to end the session, which still
+    belongs to the parent. Pointing this process's copy of the socket
+    at /dev/null first means only that copy is closed.
+    '''
+    try:
+        fd = cn.fileno()
+    except (OperationalError, InterfaceError):
+        return # already closed
+    devnull = os.open(os.devnull, os.O_RDWR)
+    try:
+        os.dup2(devnull, fd)
+    finally:
+        os.close(devnull)
+    try: cn.close()
+    except Exception: pass
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(dsn, **pool_options):
+    '''returns this process's connection pool, creating it if necessary.
+    A pool created before a fork (e.g. in a gunicorn master started
+    with --preload) is abandoned in the child and replaced.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid != os.getpid():
+            _abandon_pool(_pool)
+            _pool = None
+        if _pool is None:
+            _pool = ConnectionPool(dsn, **pool_options)
+        return _pool
+
+def _abandon_pool(inherited_pool):
+    '''drops a pool inherited from a parent process,
+    leaving the parent's sessions open (see _detach_connection).'''
+    # not under the pool's lock, which a thread that didn't survive
+    # the fork may have been holding.
+    idle, inherited_pool._idle = inherited_pool._idle, []
+    for cn in idle: _detach_connection(cn)
+
+def reset_pool():
+    '''drops the current process's pool without ending its connections'
+    sessions. Called automatically in child processes after a fork.
+    '''
+    global _pool, _pool_lock
+    # the lock may have been held by another thread at fork time.
+    _pool_lock = threading.Lock()
+    if _pool is not None:
+        _abandon_pool(_pool)
+        _pool = None
+
+def close_pool():
+    '''closes all idle connections in this process's pool.'''
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            if _pool.pid == os.getpid(): _pool.closeall()
+            else: _abandon_pool(_pool)
+        _pool = None
+
+def get_pool_stats():
+    with _pool_lock:
+        return _pool.get_stats() if _pool is not None else None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_pool)
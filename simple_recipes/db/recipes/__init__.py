@@ -1,57 +1,306 @@
 from fractions import Fraction
 from datetime import timedelta
 import json
+import re
 
 from psycopg2 import sql
 
-from simple_recipes.db import get_connection, get_cursor
+from simple_recipes import app
+from simple_recipes.db import get_connection, get_cursor, after_commit
 from simple_recipes.db.users import get_user
 from simple_recipes.db.recipes.images import *
+from simple_recipes.db.recipes.ingredients import save_recipe_ingredient_terms, \
+    get_recipe_ingredient_terms, get_recipes_by_ingredients
 from simple_recipes.formatting import get_readable_time
+from simple_recipes.unit_conversion import compile_recipe_text, get_recipe_text_hash
+from simple_recipes.db.typeahead import update_typeahead_name, remove_typeahead_name
+from simple_recipes.caching import clear_recipe_searches
+
+# recipe text fields that are stored as compiled token streams
+COMPILED_TEXT_FIELDS = ['ingredients', 'instructions']
 
 def get_recipe(recipe_id):
     '''Get a dictionary object based on provided recipe ID
     This function does not return the recipe image;
     a separate function call is required for that.
+    ingredients_tokens and instructions_tokens hold the compiled
+    token streams, or None if they're missing or out of date.
+    Each of the images gets its image_width (None if not recorded).
     Returns None for invalid recipe_id
     '''
-    statement = "SELECT recipe_json(%s)"
+    statement = (   "SELECT "
+                        "recipe_json(%(id)s), "
+                        "(SELECT row_to_json(t) FROM recipe_text_tokens t "
+                            "WHERE t.recipe_id = %(id)s), "
+                        "(SELECT json_object_agg(image_id, image_width) FROM recipe_images "
+                            "WHERE recipe_id = %(id)s)")
 
     with get_connection() as cn:
         with get_cursor(cn) as cur:
-            cur.execute(statement, (recipe_id,))
-            data = cur.fetchone()[0]
+            cur.execute(statement, {'id': recipe_id})
+            data, tokens, image_widths = cur.fetchone()
 
             if data:
+                image_widths = image_widths or {}
+                for img in data.get('images') or []:
+                    img['image_width'] = image_widths.get(str(img['image_id']))
+
                 if data['total_time_minutes']:
                     template = ''
                     h, m = divmod(data['total_time_minutes'], 60)
                     data['total_time'] = timedelta(hours=h, minutes=m)
                     data['total_time_string'] = get_readable_time(h, m)
 
+                tokens = tokens or {}
+                for field in COMPILED_TEXT_FIELDS:
+                    text = data.get(field)
+                    is_current = (text and 
+                        tokens.get(f'{field}_hash') == get_recipe_text_hash(text))
+                    data[f'{field}_tokens'] = \
+                        tokens[f'{field}_tokens'] if is_current else None
+
             return data
+
+def save_recipe_text_tokens(recipe_id, ingredients=None, instructions=None):
+    '''compiles and stores the token streams for a recipe's
+    ingredients and/or instructions text.
+    New ingredients are also parsed into the ingredient index.
+    Fields passed as None keep their currently stored tokens.
+    '''
+    texts = {'ingredients': ingredients, 'instructions': instructions}
+    values = {'recipe_id': recipe_id}
+    for field, text in texts.items():
+        if text is None:
+            values[f'{field}_hash'] = values[f'{field}_tokens'] = None
+        else:
+            tokens = compile_recipe_text(text)
+            values[f'{field}_hash'] = get_recipe_text_hash(text)
+            values[f'{field}_tokens'] = json.dumps(tokens)
+            if field == 'ingredients':
+                save_recipe_ingredient_terms(recipe_id, tokens)
+
+    columns = list(values)
+    statement = sql.SQL(    "INSERT INTO recipe_text_tokens ({columns}) "
+                            "VALUES ({values}) "
+                            "ON CONFLICT (recipe_id) DO UPDATE SET "
+                                "{updates}, "
+                                "compiled_at = CURRENT_TIMESTAMP").format(
+        columns=sql.SQL(', ').join(sql.Identifier(c) for c in columns),
+        values=sql.SQL(', ').join(sql.Placeholder(c) for c in columns),
+        updates=sql.SQL(', ').join(
+            sql.SQL("{c} = COALESCE(EXCLUDED.{c}, recipe_text_tokens.{c})").format(
+                c=sql.Identifier(c))
+            for c in columns if c != 'recipe_id'))
+
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(statement, values)
+
+def get_recipe_updated_at(recipe_id):
+    '''returns when anything shown on the recipe's page last changed
+    (see sql/recipes_updated_at.sql), or None for invalid recipe_id.'''
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute("SELECT updated_at FROM recipes WHERE recipe_id = %s", (recipe_id,))
+            record = cur.fetchone()
+            return record[0] if record else None
+
+def get_recipe_ids():
+    '''returns the IDs of every recipe, in order.'''
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute("SELECT recipe_id FROM recipes ORDER BY recipe_id")
+            return [record[0] for record in cur]
+
+def compile_recipe_texts(recipe_ids=None):
+    '''(re)builds stored token streams and the ingredient index
+    for existing recipes, e.g. after TOKEN_FORMAT_VERSION changes.
+    Compiles every recipe if recipe_ids is None.
+    Returns the number of recipes compiled.
+    '''
+    if recipe_ids is None: recipe_ids = get_recipe_ids()
+
+    count = 0
+    for recipe_id in recipe_ids:
+        data = get_recipe(recipe_id)
+        if not data: continue
+        save_recipe_text_tokens(recipe_id, 
+            **{field: data.get(field) for field in COMPILED_TEXT_FIELDS})
+        count += 1
+
+    return count
             
-def get_recipes(tsquery):
-    '''returns a list of tuples (recipe_id, recipe_name)
-    based on provided tsquery
+# search types, and the Postgres function that turns their text into a tsquery.
+# Both accept any text, unlike TO_TSQUERY, which fails on stray punctuation.
+TSQUERY_FUNCTIONS = {
+    'all' : 'plainto_tsquery',
+    'any' : 'websearch_to_tsquery',
+    'custom' : 'websearch_to_tsquery',
+}
+
+search_word_pattern = re.compile(r'\w+')
+
+def normalize_search_query(text, how='all'):
+    '''turns search box text into a canonical (search type, text) query
+    for get_recipes, so equivalent searches share a cache key.
+    Returns None if there's nothing to search for.
+
+    normalize_search_query('Chicken, soup!', 'all')  => ('all', 'chicken soup')
+    normalize_search_query('soup chicken', 'any')    => ('any', 'chicken or soup')
+    normalize_search_query('"Chicken  soup" -rice', 'custom')
+                                                => ('custom', '"chicken soup" -rice')
+    '''
+    how = how.lower() if how and how.lower() in TSQUERY_FUNCTIONS else 'custom'
+
+    if how == 'custom':
+        # websearch syntax: "quoted phrases", or, -excluded
+        text = ' '.join(text.lower().split())
+    else:
+        # word order doesn't change what matches, or how it ranks.
+        words = sorted(set(search_word_pattern.findall(text.lower())))
+        text = (' or ' if how == 'any' else ' ').join(words)
+
+    return (how, text) if text else None
+
+def get_recipes(query, page_size=None, after=None, tag_ids=None, with_facets=False):
+    '''returns one page of recipes matching the provided query,
+    from normalize_search_query, best match first:
+
+    {
+        'recipes': [{recipe_id, recipe_name, created_by, tags, rank}, ...],
+        'count': total matches, up to RECIPE_SEARCH_COUNT_LIMIT,
+        'count_is_capped': True if there may be more than that,
+        'next': cursor for the following page, or None on the last one,
+        'facets': [{tag_id, tag_name, recipe_count}, ...] for all matches,
+            most common first, if with_facets is True (otherwise None)
+    }
+
+    tag_ids limits matches to recipes having all of those tags.
+    Pages continue from a (rank, recipe_id) cursor rather than an OFFSET,
+    so later pages cost the same as the first.
+    Everything comes back in a single query.
     '''
-    recipes = []
-    statement = sql.SQL(    "SELECT "
-                                "recipe_id, "
-                                "recipe_name, "
-                                "created_by, "
-                                "tags, "
-                                "{rank} as rank "
-                            "FROM recipe_documents "
-                            "WHERE doc @@ TO_TSQUERY(%(q)s) "
-                            "ORDER BY {rank} DESC" ).format(
-                        rank=sql.SQL("TS_RANK(doc, TO_TSQUERY(%(q)s))"))
-                        
+    how, text = query
+    page_size = page_size or app.config['RECIPE_SEARCH_PAGE_SIZE']
+    count_limit = app.config['RECIPE_SEARCH_COUNT_LIMIT']
+
+    tag_filter = sql.SQL("")
+    if tag_ids:
+        tag_filter = sql.SQL(   "AND recipe_id IN ("
+                                    "SELECT recipe_id FROM recipe_tags "
+                                    "WHERE tag_id = ANY(%(tag_ids)s) "
+                                    "GROUP BY recipe_id "
+                                    "HAVING COUNT(*) = %(tag_count)s) ")
+
+    facets = sql.SQL("NULL")
+    if with_facets:
+        facets = sql.SQL(   "(SELECT COALESCE(json_agg(f ORDER BY recipe_count DESC, tag_name), '[]') "
+                            "FROM ("
+                                "SELECT tags.tag_id, tags.tag_name, COUNT(*) AS recipe_count "
+                                "FROM matches "
+                                    "JOIN recipe_tags USING (recipe_id) "
+                                    "JOIN tags USING (tag_id) "
+                                "GROUP BY tags.tag_id, tags.tag_name"
+                            ") f)")
+
+    # the query is parsed, and each row ranked, once.
+    # rank is a real, so the cursor's rank is compared as one.
+    statement = sql.SQL(    "WITH matches AS ("
+                                "SELECT "
+                                    "recipe_id, "
+                                    "recipe_name, "
+                                    "created_by, "
+                                    "tags, "
+                                    "TS_RANK(doc, q) as rank "
+                                "FROM recipe_documents, {tsquery}(%(q)s) q "
+                                "WHERE doc @@ q {tag_filter}"
+                            ") "
+                            "SELECT "
+                                "(SELECT COALESCE(json_agg(p), '[]') FROM ("
+                                    "SELECT * FROM matches "
+                                    "{after} "
+                                    "ORDER BY rank DESC, recipe_id DESC "
+                                    "LIMIT %(limit)s"
+                                ") p) AS recipes, "
+                                "(SELECT COUNT(*) FROM ("
+                                    "SELECT 1 FROM matches LIMIT %(count_limit)s"
+                                ") c) AS count, "
+                                "{facets} AS facets").format(
+                        tsquery=sql.SQL(TSQUERY_FUNCTIONS[how]),
+                        tag_filter=tag_filter,
+                        facets=facets,
+                        after=sql.SQL(
+                            "WHERE (rank, recipe_id) < (%(rank)s::real, %(recipe_id)s)" 
+                            if after else ""))
+
+    params = {
+        'q' : text, 
+        'limit' : page_size + 1, 
+        'count_limit' : count_limit + 1
+    }
+    if after: params['rank'], params['recipe_id'] = after
+    if tag_ids: 
+        params['tag_ids'] = list(set(tag_ids))
+        params['tag_count'] = len(params['tag_ids'])
+
     with get_connection() as cn:
         with get_cursor(cn) as cur:
-            cur.execute(statement, {'q' : tsquery})
-            
-            return cur.fetchall()
+            cur.execute(statement, params)
+            recipes, count, facets = cur.fetchone()
+
+    next_cursor = None
+    if len(recipes) > page_size:
+        recipes = recipes[:page_size]
+        next_cursor = (recipes[-1]['rank'], recipes[-1]['recipe_id'])
+
+    return {
+        'recipes' : recipes,
+        'count' : min(count, count_limit),
+        'count_is_capped' : count > count_limit,
+        'next' : next_cursor,
+        'facets' : facets
+    }
+
+def create_recipe(new_data, tag_ids=None, images=None):
+    '''adds a complete recipe and returns its ID.
+
+    new_data takes the same keys as add_or_update_recipe for a new
+    recipe (recipe_name is required; created_by is a user name).
+    tag_ids is a list of tag IDs, and images a list for add_recipe_images.
+
+    The recipe, its text, token streams, ingredient index rows and tags
+    go to the database in a single call to the create_recipe function
+    (see sql/create_recipe.sql). Images and the typeahead entry are
+    added after it with separate statements, in the same transaction
+    when called during a request.
+    '''
+    recipe = {k: new_data.get(k) for k in ('recipe_name', 'recipe_desc', 
+        'servings', 'total_time_minutes', 'created_by')}
+    recipe['tag_ids'] = list(tag_ids or [])
+
+    for field in COMPILED_TEXT_FIELDS:
+        text = new_data.get(f'recipe_{field}')
+        if text is None: continue
+        tokens = compile_recipe_text(text)
+        recipe[field] = text
+        recipe[f'{field}_hash'] = get_recipe_text_hash(text)
+        recipe[f'{field}_tokens'] = tokens
+        if field == 'ingredients':
+            recipe['ingredient_terms'] = [
+                dict(zip(('ingredient_no', 'ingredient_name', 'term'), row))
+                for row in get_recipe_ingredient_terms(tokens)]
+
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute("SELECT create_recipe(%s)", (json.dumps(recipe),))
+            recipe_id = cur.fetchone()[0]
+
+    if images: add_recipe_images(recipe_id, images)
+
+    update_typeahead_name('recipe', recipe_id, recipe['recipe_name'])
+    # new recipes can show up in cached search results.
+    after_commit(clear_recipe_searches)
+    return recipe_id
 
 def add_or_update_recipe(new_data):
     '''updates or adds basic recipe info
@@ -93,6 +342,10 @@ def add_or_update_recipe(new_data):
             user = get_user(user_name=new_data['created_by'])
             if user: new_data['created_by'] = user['user_id']
         
+    # compile ingredients/instructions text, if provided.
+    texts = {field: new_data.get(f'recipe_{field}') 
+        for field in COMPILED_TEXT_FIELDS}
+
     # keys that will go into UPDATE statement
     valid_keys = ['recipe_id', 'recipe_name', 
         'servings', 'total_time', 'recipe_desc', 'created_by']
@@ -112,6 +365,12 @@ def add_or_update_recipe(new_data):
         with get_connection() as cn:
             with cn.cursor() as cur:
                 cur.execute(snip, new_data)
+
+        if any(t is not None for t in texts.values()):
+            save_recipe_text_tokens(new_data['recipe_id'], **texts)
+        if 'recipe_name' in new_data:
+            update_typeahead_name('recipe', new_data['recipe_id'], new_data['recipe_name'])
+        after_commit(clear_recipe_searches)
     else:
         # assume we're adding a new recipe
         snip = sql.SQL( "INSERT INTO recipes "
@@ -125,7 +384,14 @@ def add_or_update_recipe(new_data):
         with get_connection() as cn:
             with cn.cursor() as cur:
                 cur.execute(snip, new_data)
-                return cur.fetchone()[0]
+                recipe_id = cur.fetchone()[0]
+
+        if any(t is not None for t in texts.values()):
+            save_recipe_text_tokens(recipe_id, **texts)
+        update_typeahead_name('recipe', recipe_id, new_data['recipe_name'])
+        # new recipes can show up in cached search results.
+        after_commit(clear_recipe_searches)
+        return recipe_id
                 
 def delete_recipe(recipe_id):
     sql = (    "DELETE FROM recipes "
@@ -135,6 +401,9 @@ def delete_recipe(recipe_id):
         with cn.cursor() as cur:
             cur.execute(sql, (recipe_id,))
 
+    remove_typeahead_name('recipe', recipe_id)
+    after_commit(clear_recipe_searches)
+
 def update_recipe_tags(recipe_id, new_tags):
     '''updates the specified recipe's tags
     to match what's provided
@@ -157,4 +426,6 @@ def update_recipe_tags(recipe_id, new_tags):
     with get_connection() as cn:
         with cn.cursor() as cur:
             cur.execute(sql, 
-                (recipe_id, json.dumps(new_tags)))
\ No newline at end of file
+                (recipe_id, json.dumps(new_tags)))
+
+    after_commit(clear_recipe_searches)
\ No newline at end of file
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import tempfile
+
+class BlobStore:
+    '''content-addressed file storage for image bytes.
+
+    Each blob is stored once, under its SHA-256 hex digest,
+    in a two-level directory fan-out: root/ab/cd/abcd...
+    Writing the same bytes twice just returns the existing hash.
+    '''
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, content_hash):
+        return os.path.join(self.root, 
+            content_hash[:2], content_hash[2:4], content_hash)
+
+    def put(self, data):
+        '''stores data (if not already stored) and returns its hash.'''
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self.path_for(content_hash)
+        if os.path.exists(path):
+            # counts as new again, so delete_unreferenced_blobs doesn't
+            # remove it before the row referring to it is committed.
+            try:
+                os.utime(path)
+                return content_hash
+            except FileNotFoundError:
+                pass # deleted in the meantime, so write it again
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # write to a temporary file and rename it into place,
+        # so readers never see a partially written blob.
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path): os.remove(temp_path)
+            raise
+
+        return content_hash
+
+    def get(self, content_hash):
+        with open(self.path_for(content_hash), 'rb') as f:
+            return f.read()
+
+    def exists(self, content_hash):
+        return os.path.exists(self.path_for(content_hash))
+
+    def modified_at(self, content_hash):
+        '''when the blob was last written, as a timestamp.'''
+        return os.path.getmtime(self.path_for(content_hash))
+
+    def delete(self, content_hash):
+        try: os.remove(self.path_for(content_hash))
+        except FileNotFoundError: pass
+
+    def iter_hashes(self):
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if len(file_name) == 64: yield file_name
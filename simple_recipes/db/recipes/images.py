@@ -1,7 +1,25 @@
+import time
+
 from psycopg2 import sql, connect
 import psycopg2.extras
 
-from simple_recipes.db import get_connection, get_cursor
+from simple_recipes import app
+from simple_recipes.db import get_connection, get_cursor, after_commit
+from simple_recipes.db.recipes.blob_store import BlobStore
+from simple_recipes.caching import clear_recipe_searches
+from simple_recipes.image_processing import make_renditions, get_image_size, RENDITION_SIZES
+
+# seconds a new blob store file is kept, referenced or not,
+# to give the transaction adding its image time to commit.
+BLOB_GRACE_PERIOD = 60 * 60
+
+def get_blob_store():
+    return BlobStore(app.config['IMAGE_STORAGE_PATH'])
+
+def is_using_blob_store():
+    '''True if new images go to the on-disk blob store
+    rather than the recipe_images table.'''
+    return app.config['IMAGE_STORAGE'] == 'filesystem'
 
 def add_recipe_images(recipe_id, images):
     ''' adds the list of images to the specified recipe.
@@ -12,24 +30,158 @@ def add_recipe_images(recipe_id, images):
      - image_file_name
      - file_type (MIME type)
      - image_desc (may be None)
-     - image_bytes
+     - image_bytes, or image_path to read them from a file
+     - image_width and image_height (optional)
+     - renditions (optional): output of make_renditions,
+       whose renditions may also give an image_path instead of bytes
+
+    Resized renditions of each image (see RENDITION_SIZES)
+    are generated, if not provided, and stored along with it.
+    With IMAGE_STORAGE set to 'filesystem', image_bytes are written
+    to the blob store and only their hash goes into the database.
+    Each image is inserted with its own statement, and files given
+    by image_path are read one at a time, so memory use is bounded
+    by the largest image rather than the whole upload.
+    Returns the list of new Image IDs.
     '''
     columns = ['recipe_id', 'image_file_name', 'file_type', 
-        'image_desc', 'image_bytes']
+        'image_desc', 'image_bytes', 'content_sha256', 'image_width', 'image_height']
     
     statement = sql.SQL(    "INSERT INTO recipe_images "
-                            "({column_names})" 
-                            "VALUES "
-                            "({column_values})"
+                            "({column_names}) " 
+                            "VALUES ({values}) "
+                            "RETURNING image_id"
     ).format(
         column_names=sql.SQL(', ').join(sql.Identifier(s) for s in columns),
-        column_values = sql.SQL(', ').join(sql.Placeholder(s) for s in columns))
+        values=sql.SQL(', ').join(sql.Placeholder(s) for s in columns))
     
+    image_ids = []
+    for img_dict in images:
+        img_dict['recipe_id'] = recipe_id
+        row = {k: img_dict.get(k) for k in columns}
+        row['image_bytes'] = _read_image_bytes(img_dict)
+        if is_using_blob_store():
+            row['content_sha256'] = get_blob_store().put(row['image_bytes'])
+            row['image_bytes'] = None
+
+        with get_connection() as cn:
+            with cn.cursor() as cur:
+                cur.execute(statement, row)
+                image_id = cur.fetchone()[0]
+        image_ids.append(image_id)
+
+        renditions = img_dict.get('renditions')
+        if renditions is None:
+            add_recipe_image_renditions(image_id, _read_image_bytes(img_dict))
+        else:
+            add_recipe_image_renditions(image_id, None, renditions)
+
+    after_commit(clear_recipe_searches)
+    return image_ids
+
+def _read_image_bytes(img_dict):
+    if 'image_path' in img_dict:
+        with open(img_dict['image_path'], 'rb') as f:
+            return f.read()
+    return img_dict['image_bytes']
+
+def add_recipe_image_renditions(image_id, image_bytes, renditions=None):
+    '''generates and stores resized renditions of an image,
+    replacing any that already exist.
+    renditions may be a dict from make_renditions, if already made.
+    Images Pillow can't read are skipped; they'll be served
+    through the on-the-fly fallback instead.
+    '''
+    if renditions is None:
+        try:
+            renditions = make_renditions(image_bytes)
+        except (OSError, ValueError):
+            return
+    if not renditions: return
+
+    columns = ['image_id', 'rendition', 'file_type', 
+        'width', 'height', 'image_bytes']
+    statement = sql.SQL(    "INSERT INTO recipe_image_renditions "
+                            "({column_names}) "
+                            "VALUES %s "
+                            "ON CONFLICT (image_id, rendition) DO UPDATE SET "
+                                "{updates}"
+    ).format(
+        column_names=sql.SQL(', ').join(sql.Identifier(s) for s in columns),
+        updates=sql.SQL(', ').join(
+            sql.SQL("{c} = EXCLUDED.{c}").format(c=sql.Identifier(s))
+            for s in columns[2:]))
+    template = sql.SQL("({})").format(
+        sql.SQL(', ').join(sql.Placeholder(s) for s in columns))
+
+    rows = [dict(rendition, image_id=image_id, rendition=name,
+            image_bytes=_read_image_bytes(rendition))
+        for name, rendition in renditions.items()]
+
     with get_connection() as cn:
         with get_cursor(cn) as cur:
-            for img_dict in images:
-                img_dict['recipe_id'] = recipe_id
-                cur.execute(statement, img_dict)
+            psycopg2.extras.execute_values(cur, 
+                statement.as_string(cn), rows, 
+                template=template.as_string(cn),
+                page_size=len(rows))
+
+def get_recipe_image_rendition(image_id, rendition):
+    ''' returns a stored rendition of an image and its MIME type,
+    or None if it hasn't been generated.
+    {'file_type': 'foo', 'image_bytes': b''}
+    '''
+    statement = sql.SQL(    "SELECT file_type, image_bytes "
+                            "FROM recipe_image_renditions "
+                            "WHERE image_id = %s AND rendition = %s")
+
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(statement, (image_id, rendition))
+            record = cur.fetchone()
+            if not record: return None
+            return {
+                'file_type' : record[0],
+                'image_bytes' : bytes(record[1])
+            }
+
+def generate_missing_renditions():
+    '''backfill job: generates renditions (and width variants) for
+    images that don't have all of them yet, e.g. ones uploaded before
+    renditions existed or after RENDITION_SIZES changed, and records
+    the size of images uploaded before it was.
+    Returns the number of images processed.
+    '''
+    statement = sql.SQL(    "SELECT image_id FROM recipe_images i "
+                            "WHERE i.image_width IS NULL OR ("
+                                "SELECT COUNT(*) FROM recipe_image_renditions r "
+                                "WHERE r.image_id = i.image_id "
+                                    "AND r.rendition = ANY(%s)"
+                            ") < %s "
+                            "ORDER BY image_id")
+    names = list(RENDITION_SIZES)
+
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(statement, (names, len(names)))
+            image_ids = [record[0] for record in cur]
+
+    # one image at a time, so only one original is in memory at once.
+    for image_id in image_ids:
+        img = get_recipe_image(image_id)
+        try:
+            width, height = get_image_size(img['image_bytes'])
+        except (OSError, ValueError):
+            continue
+        add_recipe_image_renditions(image_id, img['image_bytes'])
+
+        with get_connection() as cn:
+            with cn.cursor() as cur:
+                cur.execute(    "UPDATE recipe_images "
+                                "SET image_width = %s, image_height = %s "
+                                "WHERE image_id = %s", 
+                                (width, height, image_id))
+
+    return len(image_ids)
 
 def delete_recipe_images(image_ids):
     '''deletes the Image IDs specified in the provided list.
@@ -39,19 +191,30 @@ def delete_recipe_images(image_ids):
     '''
     
     statement = sql.SQL(    "DELETE FROM recipe_images "
-                            "WHERE image_id IN ({image_ids})")
+                            "WHERE image_id IN ({image_ids}) "
+                            "RETURNING recipe_id")
     image_id_literals = sql.SQL(", ").join(
         sql.Literal(i) for i in image_ids)
     
     with get_connection() as cn:
         with get_cursor(cn) as cur:
             cur.execute(statement.format(image_ids=image_id_literals))
+            recipe_ids = {record[0] for record in cur}
+
+    if recipe_ids: after_commit(clear_recipe_searches)
                 
-def get_recipe_image(image_id):
-    ''' returns an image and its MIME type.
-    {'file_type': 'foo', 'image_bytes': b''}
+def get_recipe_image(image_id, load_bytes=True):
+    ''' returns an image, its MIME type and a hash of its contents.
+    {'file_type': 'foo', 'image_bytes': b'', 'content_hash': 'abc', 'file_path': None}
+    For images in the blob store, file_path is the file's location,
+    and image_bytes is only read from it if load_bytes is True.
+    Returns None for invalid image_id
     '''
-    statement = sql.SQL(    "SELECT file_type, image_bytes "
+    statement = sql.SQL(    "SELECT "
+                                "file_type, "
+                                "image_bytes, "
+                                "content_sha256, "
+                                "COALESCE(content_sha256, md5(image_bytes)) "
                             "FROM recipe_images "
                             "WHERE image_id = %s")
                             
@@ -60,8 +223,99 @@ def get_recipe_image(image_id):
             cur.execute(statement, (image_id,))
             
             record = cur.fetchone()
-            
-            return {
-                'file_type' : record[0],
-                'image_bytes' : bytes(record[1])
-            }
\ No newline at end of file
+            if not record: return None
+
+    img = {
+        'file_type' : record[0],
+        'image_bytes' : None,
+        'content_hash' : record[3],
+        'file_path' : None
+    }
+    if record[1] is not None:
+        img['image_bytes'] = bytes(record[1])
+    else:
+        store = get_blob_store()
+        img['file_path'] = store.path_for(record[2])
+        if load_bytes: img['image_bytes'] = store.get(record[2])
+    return img
+
+def get_recipe_image_size(image_id):
+    ''' returns an image's (width, height), which are None for images
+    whose size hasn't been recorded yet. Returns None for invalid image_id
+    '''
+    statement = sql.SQL(    "SELECT image_width, image_height "
+                            "FROM recipe_images "
+                            "WHERE image_id = %s")
+
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(statement, (image_id,))
+            record = cur.fetchone()
+            return tuple(record) if record else None
+
+def get_recipe_image_hash(image_id):
+    ''' returns the hash of an image's contents, as in get_recipe_image,
+    without sending the image itself. Returns None for invalid image_id
+    '''
+    statement = sql.SQL(    "SELECT COALESCE(content_sha256, md5(image_bytes)) "
+                            "FROM recipe_images "
+                            "WHERE image_id = %s")
+
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(statement, (image_id,))
+            record = cur.fetchone()
+            return record[0] if record else None
+
+def move_images_to_blob_store():
+    '''migration: moves image bytes still stored in recipe_images
+    into the blob store, one image (and transaction) at a time.
+    Returns the number of images moved.
+    '''
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(    "SELECT image_id FROM recipe_images "
+                            "WHERE image_bytes IS NOT NULL "
+                            "ORDER BY image_id")
+            image_ids = [record[0] for record in cur]
+
+    store = get_blob_store()
+    for image_id in image_ids:
+        img = get_recipe_image(image_id)
+        content_hash = store.put(img['image_bytes'])
+
+        with get_connection() as cn:
+            with cn.cursor() as cur:
+                cur.execute(    "UPDATE recipe_images "
+                                "SET content_sha256 = %s, image_bytes = NULL "
+                                "WHERE image_id = %s", 
+                                (content_hash, image_id))
+
+    return len(image_ids)
+
+def delete_unreferenced_blobs(grace_period=BLOB_GRACE_PERIOD):
+    '''removes blob store files no image refers to anymore,
+    e.g. after images are deleted. Blobs are shared between
+    identical images, so they can't be removed along with the image.
+    Files written in the last grace_period seconds are kept, since
+    the rows referring to them may not be committed yet.
+    Returns the number of files removed.
+    '''
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(    "SELECT DISTINCT content_sha256 FROM recipe_images "
+                            "WHERE content_sha256 IS NOT NULL")
+            referenced = {record[0] for record in cur}
+
+    store = get_blob_store()
+    cutoff = time.time() - grace_period
+    count = 0
+    for content_hash in store.iter_hashes():
+        if content_hash in referenced: continue
+        try:
+            if store.modified_at(content_hash) > cutoff: continue
+        except FileNotFoundError:
+            continue
+        store.delete(content_hash)
+        count += 1
+    return count
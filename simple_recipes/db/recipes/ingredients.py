@@ -0,0 +1,91 @@
+import psycopg2.extras
+
+from simple_recipes import app
+from simple_recipes.db import get_connection, get_cursor
+from simple_recipes.ingredients import get_ingredient_names, get_ingredient_terms, \
+    normalize_ingredient_name
+
+def get_recipe_ingredient_terms(tokens):
+    '''the ingredient index rows for a recipe, as (ingredient_no,
+    ingredient_name, term) tuples, given its ingredients as a
+    token stream from compile_recipe_text.
+    Alternatives ('butter or margarine') share an ingredient_no,
+    so either one covers the ingredient.
+    '''
+    rows = {}
+    for i, names in enumerate(get_ingredient_names(tokens)):
+        for name in names:
+            for term in get_ingredient_terms(name):
+                rows.setdefault((i, term), name)
+    return [(i, name, term) for (i, term), name in rows.items()]
+
+def save_recipe_ingredient_terms(recipe_id, tokens):
+    '''replaces a recipe's rows in the ingredient index,
+    given its ingredients as a token stream from compile_recipe_text.
+    '''
+    rows = [(recipe_id, *row) for row in get_recipe_ingredient_terms(tokens)]
+
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(    "DELETE FROM recipe_ingredient_terms "
+                            "WHERE recipe_id = %s", (recipe_id,))
+            if rows:
+                psycopg2.extras.execute_values(cur, 
+                    "INSERT INTO recipe_ingredient_terms "
+                    "(recipe_id, ingredient_no, ingredient_name, term) "
+                    "VALUES %s", rows)
+
+def get_recipes_by_ingredients(pantry_items, limit=20):
+    '''returns up to limit recipes using any of the pantry items,
+    ranked by the share of their ingredients the pantry covers:
+
+    [{recipe_id, recipe_name, covered, total, coverage, missing}, ...]
+
+    where missing lists the names of ingredients not covered.
+    Only the PANTRY_SEARCH_CANDIDATES recipes using the most pantry
+    items are ranked, so that common items like salt, which most
+    recipes use, don't make every recipe a candidate.
+    '''
+    terms = {normalize_ingredient_name(item) for item in pantry_items}
+    terms = list(terms - {None})
+    if not terms: return []
+
+    statement = (   "SELECT "
+                        "recipes.recipe_id, "
+                        "recipes.recipe_name, "
+                        "i.covered, "
+                        "i.total, "
+                        "i.covered::real / i.total AS coverage, "
+                        "i.missing "
+                    "FROM ("
+                        "SELECT recipe_id FROM recipe_ingredient_terms "
+                        "WHERE term = ANY(%(terms)s) "
+                        "GROUP BY recipe_id "
+                        "ORDER BY COUNT(DISTINCT ingredient_no) DESC, recipe_id "
+                        "LIMIT %(candidates)s"
+                    ") candidates "
+                    "JOIN recipes USING (recipe_id) "
+                    "CROSS JOIN LATERAL ("
+                        "SELECT "
+                            "COUNT(*) FILTER (WHERE covered) AS covered, "
+                            "COUNT(*) AS total, "
+                            "COALESCE(array_agg(ingredient_name ORDER BY ingredient_no) "
+                                "FILTER (WHERE NOT covered), '{}') AS missing "
+                        "FROM ("
+                            "SELECT "
+                                "ingredient_no, "
+                                "MIN(ingredient_name) AS ingredient_name, "
+                                "bool_or(term = ANY(%(terms)s)) AS covered "
+                            "FROM recipe_ingredient_terms t "
+                            "WHERE t.recipe_id = candidates.recipe_id "
+                            "GROUP BY ingredient_no"
+                        ") ingredients"
+                    ") i "
+                    "ORDER BY coverage DESC, i.covered DESC, recipes.recipe_id "
+                    "LIMIT %(limit)s")
+
+    with get_connection() as cn:
+        with get_cursor(cn) as cur:
+            cur.execute(statement, {'terms' : terms, 'limit' : limit,
+                'candidates' : app.config['PANTRY_SEARCH_CANDIDATES']})
+            return [dict(record) for record in cur]
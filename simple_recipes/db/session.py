@@ -0,0 +1,130 @@
+from functools import wraps
+
+from flask import g, has_request_context, request
+import psycopg2
+
+# methods whose requests get a READ ONLY transaction,
+# unless the view is decorated with @read_write.
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+class TransactionFailed(Exception):
+    '''raised when a request whose transaction hit a database error
+    would otherwise succeed, so its lost writes end up as a 500
+    instead of going unnoticed.'''
+
+class RequestSession:
+    '''one connection and one transaction shared by an entire request.
+
+    The connection is only checked out the first time a db function
+    runs, so requests that never touch the database don't pay for one.
+    acquire() must return a raw psycopg2 connection, and release(cn, close)
+    gives it back when the request is over.
+    '''
+    def __init__(self, acquire, release, read_only=False):
+        self._acquire = acquire
+        self._release = release
+        self.read_only = read_only
+        self.failed = False
+        self.cn = None
+        self.commit_callbacks = []
+
+    def join(self):
+        '''returns a context manager yielding the request's connection.
+        Unlike a standalone connection, leaving the block doesn't commit;
+        that happens once, at the end of the request.
+        '''
+        return _JoinedConnection(self)
+
+    def connection(self):
+        if self.cn is None:
+            cn = self._acquire()
+            # psycopg2 folds this into its BEGIN statement,
+            # so it doesn't cost an extra round trip.
+            if self.read_only: cn.readonly = True
+            self.cn = cn
+        return self.cn
+
+    def commit(self):
+        if self.cn is None: return
+        if self.failed:
+            raise TransactionFailed("A database error aborted this request's transaction")
+        self.cn.commit()
+        callbacks, self.commit_callbacks = self.commit_callbacks, []
+        for func in callbacks: func()
+
+    def close(self):
+        '''rolls back anything uncommitted and releases the connection.'''
+        cn, self.cn = self.cn, None
+        if cn is None: return
+
+        broken = bool(cn.closed)
+        if not broken:
+            try:
+                cn.rollback()
+                if self.read_only: cn.readonly = None
+            except Exception:
+                broken = True
+        self._release(cn, broken)
+
+class _JoinedConnection:
+    def __init__(self, session):
+        self._session = session
+
+    def __enter__(self):
+        return self._session.connection()
+
+    def __exit__(self, exc_type, exc, tb):
+        # the transaction is aborted now, so it must not be committed
+        # at the end of the request. other exceptions leave it usable.
+        if exc_type is not None and issubclass(exc_type, psycopg2.Error):
+            self._session.failed = True
+        return False
+
+def read_write(view):
+    '''marks a view that writes to the database on GET requests,
+    so its request session isn't made READ ONLY.
+    '''
+    view.db_read_write = True
+    return view
+
+def get_request_session():
+    '''returns the current request's session, or None outside a request.'''
+    if not has_request_context(): return None
+    return g.get('db_session')
+
+def after_commit(func):
+    '''runs func once the current request's transaction is committed,
+    e.g. to invalidate caches only after a write is visible.
+    Outside a request, the standalone connection has already committed,
+    so func runs right away.
+    '''
+    session = get_request_session()
+    if session is not None and session.cn is not None:
+        session.commit_callbacks.append(func)
+    else:
+        func()
+
+def init_app(app, acquire, release):
+    '''registers the request hooks that open, commit and close
+    the per-request session.
+    '''
+    @app.before_request
+    def open_db_session():
+        view = app.view_functions.get(request.endpoint)
+        read_only = (request.method in READ_ONLY_METHODS
+            and not getattr(view, 'db_read_write', False))
+        g.db_session = RequestSession(acquire, release, read_only)
+
+    @app.after_request
+    def commit_db_session(response):
+        # committing here, rather than on teardown,
+        # means a failed commit still turns into an error response.
+        # error responses (from error handlers or not) are rolled back.
+        session = g.get('db_session')
+        if session is not None and response.status_code < 400: session.commit()
+        return response
+
+    @app.teardown_request
+    def close_db_session(exc):
+        session = g.pop('db_session', None)
+        if session is not None: session.close()
@@ -0,0 +1,47 @@
+-- adds a recipe with its ingredients, instructions, compiled token
+-- streams, ingredient index rows and tags in one call, returning its ID
+-- (see simple_recipes.db.recipes.create_recipe, which builds the argument).
+-- a new recipe has no tags to replace, so they're inserted directly
+-- rather than through set_recipe_tags.
+CREATE OR REPLACE FUNCTION create_recipe(recipe jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_recipe_id integer;
+BEGIN
+    INSERT INTO recipes (
+        recipe_name, recipe_desc, servings, total_time,
+        created_by, ingredients, instructions)
+    SELECT
+        recipe->>'recipe_name',
+        recipe->>'recipe_desc',
+        COALESCE((recipe->>'servings')::integer, 1),
+        make_interval(mins => (recipe->>'total_time_minutes')::integer),
+        (SELECT user_id FROM users
+            WHERE lower(user_name) = lower(recipe->>'created_by')),
+        recipe->>'ingredients',
+        recipe->>'instructions'
+    RETURNING recipe_id INTO new_recipe_id;
+
+    INSERT INTO recipe_text_tokens (
+        recipe_id, ingredients_hash, ingredients_tokens,
+        instructions_hash, instructions_tokens)
+    VALUES (
+        new_recipe_id,
+        recipe->>'ingredients_hash', recipe->'ingredients_tokens',
+        recipe->>'instructions_hash', recipe->'instructions_tokens');
+
+    INSERT INTO recipe_ingredient_terms (
+        recipe_id, ingredient_no, ingredient_name, term)
+    SELECT new_recipe_id, t.ingredient_no, t.ingredient_name, t.term
+    FROM jsonb_to_recordset(COALESCE(recipe->'ingredient_terms', '[]'))
+        AS t(ingredient_no smallint, ingredient_name text, term text);
+
+    INSERT INTO recipe_tags (recipe_id, tag_id)
+    SELECT DISTINCT new_recipe_id, tag_id::integer
+    FROM jsonb_array_elements_text(COALESCE(recipe->'tag_ids', '[]')) AS tag_id;
+
+    RETURN new_recipe_id;
+END;
+$$;
@@ -0,0 +1,12 @@
+-- resized copies of recipe images, generated at upload time
+-- (see simple_recipes.image_processing.RENDITION_SIZES).
+CREATE TABLE IF NOT EXISTS recipe_image_renditions (
+    image_id integer NOT NULL
+        REFERENCES recipe_images(image_id) ON DELETE CASCADE,
+    rendition text NOT NULL,
+    file_type text NOT NULL,
+    width integer NOT NULL,
+    height integer NOT NULL,
+    image_bytes bytea NOT NULL,
+    PRIMARY KEY (image_id, rendition)
+);
@@ -0,0 +1,9 @@
+-- lets recipe image contents live in the on-disk blob store
+-- (see simple_recipes.db.recipes.blob_store) instead of inline.
+-- rows keep either image_bytes or content_sha256 (or both).
+ALTER TABLE recipe_images 
+    ADD COLUMN IF NOT EXISTS content_sha256 text,
+    ALTER COLUMN image_bytes DROP NOT NULL;
+
+CREATE INDEX IF NOT EXISTS recipe_images_content_sha256_idx
+    ON recipe_images (content_sha256);
@@ -0,0 +1,7 @@
+-- the size of each recipe image, recorded at upload, so width variants
+-- (see simple_recipes.image_processing.WIDTH_VARIANTS) are only offered
+-- when they're smaller than the original. older images get theirs from
+-- generate_missing_renditions.
+ALTER TABLE recipe_images
+    ADD COLUMN IF NOT EXISTS image_width integer,
+    ADD COLUMN IF NOT EXISTS image_height integer;
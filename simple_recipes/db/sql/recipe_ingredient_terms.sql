@@ -0,0 +1,15 @@
+-- inverted index of recipe ingredients, for pantry searches
+-- (see simple_recipes.db.recipes.ingredients). one row per lookup term
+-- of each ingredient line (see simple_recipes.ingredients.get_ingredient_terms),
+-- rebuilt whenever a recipe's ingredients are saved.
+CREATE TABLE IF NOT EXISTS recipe_ingredient_terms (
+    recipe_id integer NOT NULL
+        REFERENCES recipes(recipe_id) ON DELETE CASCADE,
+    ingredient_no smallint NOT NULL,
+    ingredient_name text NOT NULL,
+    term text NOT NULL,
+    PRIMARY KEY (recipe_id, ingredient_no, term)
+);
+
+CREATE INDEX IF NOT EXISTS recipe_ingredient_terms_term_idx
+    ON recipe_ingredient_terms (term, recipe_id, ingredient_no);
@@ -0,0 +1,5 @@
+-- lookups of recipes by tag, for tag filters in recipe search
+-- (see simple_recipes.db.recipes.get_recipes). lookups of tags by
+-- recipe, for tag facets, use the (recipe_id, tag_id) primary key.
+CREATE INDEX IF NOT EXISTS recipe_tags_tag_id_recipe_id_idx
+    ON recipe_tags (tag_id, recipe_id);
@@ -0,0 +1,13 @@
+-- compiled token streams for recipe ingredients and instructions
+-- (see simple_recipes.unit_conversion.compile_recipe_text).
+-- each *_hash identifies the text (and compiler version) the tokens
+-- were built from, so stale rows are simply ignored.
+CREATE TABLE IF NOT EXISTS recipe_text_tokens (
+    recipe_id integer PRIMARY KEY
+        REFERENCES recipes(recipe_id) ON DELETE CASCADE,
+    ingredients_hash text,
+    ingredients_tokens jsonb,
+    instructions_hash text,
+    instructions_tokens jsonb,
+    compiled_at timestamp with time zone NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,76 @@
+-- when anything shown on a recipe's page last changed. Rendered pages
+-- are cached under it (see simple_recipes.caching.get_recipe_cache_key),
+-- so every worker stops serving a page as soon as an edit commits.
+ALTER TABLE recipes ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone
+    NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION set_recipe_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$;
+
+-- touches the recipe a tag or image row belongs to.
+CREATE OR REPLACE FUNCTION touch_recipe()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE recipes SET updated_at = clock_timestamp()
+    WHERE recipe_id = (CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END).recipe_id;
+    RETURN NULL;
+END;
+$$;
+
+-- tag and user names show up on the pages of every recipe using them.
+CREATE OR REPLACE FUNCTION touch_tag_recipes()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE recipes SET updated_at = clock_timestamp()
+    WHERE recipe_id IN (
+        SELECT recipe_id FROM recipe_tags WHERE tag_id = NEW.tag_id);
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION touch_user_recipes()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE recipes SET updated_at = clock_timestamp()
+    WHERE created_by = NEW.user_id;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS recipes_updated_at ON recipes;
+CREATE TRIGGER recipes_updated_at
+    BEFORE UPDATE ON recipes
+    FOR EACH ROW EXECUTE FUNCTION set_recipe_updated_at();
+
+DROP TRIGGER IF EXISTS recipe_tags_touch_recipe ON recipe_tags;
+CREATE TRIGGER recipe_tags_touch_recipe
+    AFTER INSERT OR UPDATE OR DELETE ON recipe_tags
+    FOR EACH ROW EXECUTE FUNCTION touch_recipe();
+
+DROP TRIGGER IF EXISTS recipe_images_touch_recipe ON recipe_images;
+CREATE TRIGGER recipe_images_touch_recipe
+    AFTER INSERT OR UPDATE OF image_desc, image_file_name OR DELETE ON recipe_images
+    FOR EACH ROW EXECUTE FUNCTION touch_recipe();
+
+DROP TRIGGER IF EXISTS tags_touch_recipes ON tags;
+CREATE TRIGGER tags_touch_recipes
+    AFTER UPDATE OF tag_name ON tags
+    FOR EACH ROW EXECUTE FUNCTION touch_tag_recipes();
+
+DROP TRIGGER IF EXISTS users_touch_recipes ON users;
+CREATE TRIGGER users_touch_recipes
+    AFTER UPDATE OF user_name ON users
+    FOR EACH ROW EXECUTE FUNCTION touch_user_recipes();
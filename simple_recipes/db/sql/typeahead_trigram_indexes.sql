@@ -0,0 +1,10 @@
+-- trigram indexes for name suggestions with TYPEAHEAD_BACKEND = 'database'
+-- (see simple_recipes.db.typeahead.get_name_suggestions_from_database).
+-- they serve both the ILIKE prefix matches and the fuzzy % matches.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS recipes_recipe_name_trgm_idx
+    ON recipes USING gin (recipe_name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS tags_tag_name_trgm_idx
+    ON tags USING gin (tag_name gin_trgm_ops);
@@ -0,0 +1,6 @@
+-- exact, case-insensitive user name lookups
+-- (see simple_recipes.db.users.check_user_criteria).
+-- user names differing only in case have to be renamed first,
+-- or this index can't be created.
+CREATE UNIQUE INDEX IF NOT EXISTS users_lower_user_name_idx
+    ON users (lower(user_name));
@@ -0,0 +1,4 @@
+-- scrypt cost parameters each password hash was made with,
+-- e.g. {"N": 16384, "r": 8, "p": 1} (see simple_recipes.passwords).
+-- NULL means py-scrypt's defaults, which those values are.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS password_params jsonb;
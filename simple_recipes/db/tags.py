@@ -1,5 +1,7 @@
 from psycopg2 import sql
-from simple_recipes.db import get_connection, get_cursor
+from simple_recipes.db import get_connection, get_cursor, after_commit
+from simple_recipes.db.typeahead import update_typeahead_name, remove_typeahead_name
+from simple_recipes.caching import clear_recipe_searches
 
 def get_tags():
     tags = []
@@ -45,6 +47,10 @@ def delete_tag(tag_id):
     with get_connection() as cn:
         with get_cursor(cn) as cur:
             cur.execute(statement, (tag_id,))
+
+    remove_typeahead_name('tag', tag_id)
+    # tag names show up on every recipe page using them.
+    after_commit(clear_recipe_searches)
     
 def add_tag(tag_name, user_name=None, tag_desc=None):
     ''' adds a tag and returns its ID
@@ -58,7 +64,10 @@ def add_tag(tag_name, user_name=None, tag_desc=None):
     with get_connection() as cn:
         with get_cursor(cn) as cur:
             cur.execute(statement, (tag_name, tag_desc, user_name))
-            return cur.fetchone()["tag_id"]
+            tag_id = cur.fetchone()["tag_id"]
+
+    update_typeahead_name('tag', tag_id, tag_name)
+    return tag_id
     
 def update_tag(tag_id, new_name, new_desc=None):
     statement = sql.SQL(    "UPDATE tags "
@@ -72,4 +81,7 @@ def update_tag(tag_id, new_name, new_desc=None):
             cur.execute(statement, {
                 'tag_id' : tag_id, 
                 'tag_name' : new_name,
-                'tag_desc' : new_desc})
\ No newline at end of file
+                'tag_desc' : new_desc})
+
+    update_typeahead_name('tag', tag_id, new_name)
+    after_commit(clear_recipe_searches)
\ No newline at end of file
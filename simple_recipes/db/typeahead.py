@@ -0,0 +1,243 @@
+import re
+import threading
+import time
+
+from simple_recipes import app
+from simple_recipes.db import get_connection, after_commit
+
+name_word_pattern = re.compile(r'\w+')
+
+def normalize_name(text):
+    '''lowercase words separated by single spaces, as names are indexed.'''
+    return ' '.join(name_word_pattern.findall(text.lower()))
+
+class _TrieNode:
+    __slots__ = ('children', 'entries')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = set()
+
+class PrefixTrie:
+    '''prefix index over recipe and tag names.
+
+    Entries are (kind, id, name) tuples. Every word-start of a name is
+    indexed, so 'chicken noodle soup' is found by 'chi', 'nood' and 'soup'.
+    Not thread-safe by itself; see TypeaheadIndex.
+    '''
+    def __init__(self):
+        self.root = _TrieNode()
+        self.names = {}
+
+    def _keys(self, name):
+        words = normalize_name(name).split(' ')
+        return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+    def add(self, kind, id, name):
+        '''adds or renames an entry.'''
+        self.discard(kind, id)
+        entry = (kind, id, name)
+        for key in self._keys(name):
+            node = self.root
+            for c in key:
+                node = node.children.setdefault(c, _TrieNode())
+            node.entries.add(entry)
+        self.names[(kind, id)] = name
+
+    def discard(self, kind, id):
+        name = self.names.pop((kind, id), None)
+        if name is None: return
+        entry = (kind, id, name)
+        for key in self._keys(name):
+            path = [self.root]
+            for c in key:
+                path.append(path[-1].children[c])
+            path[-1].entries.discard(entry)
+            # prune nodes nothing is indexed under anymore.
+            for i in range(len(key), 0, -1):
+                node = path[i]
+                if node.entries or node.children: break
+                del path[i - 1].children[key[i - 1]]
+
+    def _collect(self, node, results, limit):
+        '''adds entries in node's subtree to results (a dict used as an
+        ordered set), shortest keys first, until there are limit of them.'''
+        level = [node]
+        while level and len(results) < limit:
+            next_level = []
+            for n in level:
+                for entry in sorted(n.entries, key=lambda e: e[2].lower()):
+                    results[entry] = None
+                    if len(results) >= limit: return
+                next_level.extend(n.children[c] for c in sorted(n.children))
+            level = next_level
+
+    def search(self, prefix, limit=10):
+        '''entries with a word starting with prefix.'''
+        results = {}
+        node = self.root
+        for c in normalize_name(prefix):
+            node = node.children.get(c)
+            if node is None: return []
+        self._collect(node, results, limit)
+        return list(results)
+
+    def fuzzy_search(self, prefix, limit=10, max_distance=1):
+        '''entries with a word starting within max_distance edits of
+        prefix, closest first. Walks the trie with one row of the
+        Levenshtein table per node, skipping branches that can't match.
+        '''
+        prefix = normalize_name(prefix)
+        matches = []
+
+        def walk(node, c, previous_row):
+            row = [previous_row[0] + 1]
+            for i in range(1, len(prefix) + 1):
+                row.append(min(row[i - 1] + 1, previous_row[i] + 1,
+                    previous_row[i - 1] + (prefix[i - 1] != c)))
+            if row[-1] <= max_distance:
+                # everything below starts with this match, too.
+                matches.append((row[-1], node))
+            elif min(row) <= max_distance:
+                for c, child in node.children.items():
+                    walk(child, c, row)
+
+        first_row = list(range(len(prefix) + 1))
+        for c, child in self.root.children.items():
+            walk(child, c, first_row)
+
+        results = {}
+        for _, node in sorted(matches, key=lambda m: m[0]):
+            self._collect(node, results, limit)
+            if len(results) >= limit: break
+        return list(results)
+
+class TypeaheadIndex:
+    '''process-local PrefixTrie of every recipe and tag name.
+
+    It's loaded on first use and reloaded after `ttl` seconds, to pick up
+    other workers' writes; this worker's own writes are applied as they
+    commit, through add() and discard().
+    load() must return an iterable of (kind, id, name).
+    '''
+    def __init__(self, load, ttl=300):
+        self._load = load
+        self.ttl = ttl
+
+        self._trie = None
+        self._loaded_at = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _is_stale(self):
+        return (self._trie is None
+            or time.monotonic() - self._loaded_at >= self.ttl)
+
+    def _get_trie(self):
+        trie = self._trie
+        if not self._is_stale(): return trie
+
+        # while one thread reloads, the others keep using the old trie.
+        if self._load_lock.acquire(blocking=trie is None):
+            try:
+                if self._is_stale(): self._reload()
+            finally:
+                self._load_lock.release()
+        return self._trie
+
+    def _reload(self):
+        with self._lock:
+            self._pending = []
+        trie = PrefixTrie()
+        try:
+            for kind, id, name in self._load():
+                trie.add(kind, id, name)
+        finally:
+            with self._lock:
+                # replay writes that committed while the names were loading.
+                for update in self._pending:
+                    update(trie)
+                self._pending = None
+        with self._lock:
+            self._trie = trie
+            self._loaded_at = time.monotonic()
+
+    def _update(self, update):
+        with self._lock:
+            if self._pending is not None: self._pending.append(update)
+            if self._trie is not None: update(self._trie)
+
+    def add(self, kind, id, name):
+        self._update(lambda trie: trie.add(kind, id, name))
+
+    def discard(self, kind, id):
+        self._update(lambda trie: trie.discard(kind, id))
+
+    def search(self, prefix, limit=10):
+        '''prefix matches, topped up with fuzzy ones for longer prefixes.'''
+        trie = self._get_trie()
+        with self._lock:
+            results = trie.search(prefix, limit)
+            if len(results) < limit and len(normalize_name(prefix)) >= 3:
+                for entry in trie.fuzzy_search(prefix, limit):
+                    if entry not in results: results.append(entry)
+                    if len(results) >= limit: break
+        return results
+
+def _load_names():
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(    "SELECT 'recipe', recipe_id, recipe_name FROM recipes "
+                            "UNION ALL "
+                            "SELECT 'tag', tag_id, tag_name FROM tags")
+            return cur.fetchall()
+
+typeahead_index = TypeaheadIndex(_load_names, ttl=app.config['TYPEAHEAD_TTL'])
+
+def get_name_suggestions(prefix, limit=10):
+    '''returns up to limit (kind, id, name) tuples of recipes and tags
+    whose names have a word starting with (or close to) prefix.
+    With TYPEAHEAD_BACKEND set to 'database', they come from
+    a pg_trgm query instead of the in-process index.
+    '''
+    if app.config['TYPEAHEAD_BACKEND'] == 'database':
+        return get_name_suggestions_from_database(prefix, limit)
+    return typeahead_index.search(prefix, limit)
+
+def get_name_suggestions_from_database(prefix, limit=10):
+    '''like get_name_suggestions, using the trigram indexes
+    from sql/typeahead_trigram_indexes.sql.
+    '''
+    statement = (   "SELECT kind, id, name FROM ("
+                        "SELECT 'recipe' AS kind, recipe_id AS id, recipe_name AS name "
+                        "FROM recipes "
+                        "UNION ALL "
+                        "SELECT 'tag', tag_id, tag_name FROM tags"
+                    ") names "
+                    "WHERE name ILIKE %(starts)s OR name ILIKE %(word_starts)s "
+                        "OR name %% %(q)s "
+                    "ORDER BY "
+                        "name ILIKE %(starts)s OR name ILIKE %(word_starts)s DESC, "
+                        "similarity(name, %(q)s) DESC, "
+                        "name "
+                    "LIMIT %(limit)s")
+
+    q = normalize_name(prefix)
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    with get_connection() as cn:
+        with cn.cursor() as cur:
+            cur.execute(statement, {
+                'q' : q,
+                'starts' : f'{escaped}%',
+                'word_starts' : f'% {escaped}%',
+                'limit' : limit})
+            return [tuple(record) for record in cur]
+
+def update_typeahead_name(kind, id, name):
+    '''adds or renames a recipe or tag in the index, once committed.'''
+    after_commit(lambda: typeahead_index.add(kind, id, name))
+
+def remove_typeahead_name(kind, id):
+    '''removes a recipe or tag from the index, once committed.'''
+    after_commit(lambda: typeahead_index.discard(kind, id))
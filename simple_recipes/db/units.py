@@ -0,0 +1,115 @@
+import threading
+import time
+
+class UnitCatalog:
+    '''the measurement unit catalog returned by `units_json()`,
+    plus prebuilt indexes for the lookups in get_measurement_units.
+
+    `units` is the original dict, keyed by pint unit name.
+    Every index maps to a dict in the same shape,
+    so a lookup returns the matching subset without scanning.
+    All of it is shared between callers and must be treated as read-only.
+    '''
+    def __init__(self, units, version=0):
+        self.units = units
+        self.version = version
+
+        self.by_id = {}
+        self.by_name = {}
+        self.by_category = {}
+        self.by_system = {}
+        self.by_category_and_system = {}
+        self.convertibles = {}
+
+        for k, u in units.items():
+            entry = {k: u}
+            self.by_id[u.get('unit_id')] = entry
+            for name in (u['unit_plural'], u['unit_singular'], u['unit_abbr']):
+                if name: self.by_name.setdefault(name, {})[k] = u
+
+            cat, sys = u['unit_category'], u['unit_system']
+            self.by_category.setdefault(cat, {})[k] = u
+            self.by_system.setdefault(sys, {})[k] = u
+            self.by_category_and_system.setdefault((cat, sys), {})[k] = u
+            if u.get('include_in_conversions'): self.convertibles[k] = u
+
+        # plurals, then singular, then abbr., to match on longest string first.
+        self.unit_strings = (
+            [u['unit_plural'] for u in units.values()] +
+            [u['unit_singular'] for u in units.values()] +
+            [u['unit_abbr'] for u in units.values() if u['unit_abbr']])
+
+    def find(self, **criteria):
+        '''returns the dict of units matching the criteria.
+        With no criteria, that's all of them.
+        Supported criteria are the same as get_measurement_units.
+        '''
+        if 'unit_id' in criteria:
+            data = self.by_id.get(criteria['unit_id'], {})
+        elif 'unit_name' in criteria:
+            data = self.by_name.get(criteria['unit_name'], {})
+        elif 'unit_system' in criteria or 'unit_category' in criteria:
+            cat = criteria.get('unit_category')
+            sys = criteria.get('unit_system')
+            if cat and sys: data = self.by_category_and_system.get((cat, sys), {})
+            elif cat: data = self.by_category.get(cat, {})
+            elif sys: data = self.by_system.get(sys, {})
+            else: data = self.units
+        else:
+            data = self.units
+
+        if criteria.get('only_include_convertibles'):
+            if data is self.units: data = self.convertibles
+            else: data = {k: u for k, u in data.items() if k in self.convertibles}
+
+        return data
+
+class UnitCatalogCache:
+    '''process-local cache of the unit catalog.
+
+    The catalog is reloaded when it's older than `ttl` seconds,
+    or after invalidate() bumps the version counter.
+    load() must return the raw dict from `units_json()`.
+    If the reloaded units are unchanged, the existing catalog is kept,
+    so anything cached per catalog (like the conversion table
+    in simple_recipes.unit_conversion) stays valid.
+    '''
+    def __init__(self, load, ttl=300):
+        self._load = load
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._catalog = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        catalog = self._catalog
+        if (catalog is not None and catalog.version == self.version
+                and time.monotonic() - self._loaded_at < self.ttl):
+            self.hits += 1
+            return catalog
+
+        with self._lock:
+            # another thread may have refreshed it while we waited.
+            catalog = self._catalog
+            if (catalog is None or catalog.version != self.version
+                    or time.monotonic() - self._loaded_at >= self.ttl):
+                self.misses += 1
+                version = self.version
+                units = self._load()
+                if catalog is not None and units == catalog.units:
+                    catalog.version = version
+                else:
+                    catalog = UnitCatalog(units, version)
+                    self._catalog = catalog
+                self._loaded_at = time.monotonic()
+            else:
+                self.hits += 1
+            return catalog
+
+    def invalidate(self):
+        '''forces the next get() to reload the catalog.'''
+        self.version += 1
@@ -1,9 +1,17 @@
-from os import urandom
+import atexit
+from datetime import datetime, timezone
+import json
+import os
+import threading
+import time
 
 from psycopg2 import sql
-import scrypt
+import psycopg2.extras
 
-from simple_recipes.db import get_connection, get_cursor
+from simple_recipes import app
+from simple_recipes.db import get_connection, get_cursor, after_commit
+from simple_recipes.passwords import hash_password, verify_password, needs_rehash
+from simple_recipes.caching import clear_recipe_searches, user_principals
 
 LOCKED = 1
 RESET = 2
@@ -16,15 +24,20 @@ def check_user_criteria(**user_criteria):
     Either user_id or user_name (just one), and nothing else.
     if criterion is valid, returns the sql.Composable that can be plugged into a query.
     Otherwise, returns a TypeError.
+    User names are matched exactly, but case-insensitively,
+    using the lower(user_name) index in sql/users_lower_user_name.sql.
     '''
     if len(user_criteria) != 1: raise TypeError("Only 1 (and exactly 1) criterion allowed")
     field_name = list(user_criteria)[0]
     if field_name not in ['user_id', 'user_name']: 
         raise TypeError(f"'{field_name}'' is invalid criterion name")
 
+    if field_name == 'user_name':
+        return sql.SQL("lower(user_name) = lower({})").format(
+            sql.Placeholder(field_name))
     return sql.Composed([
         sql.Identifier(field_name),
-        sql.SQL("~*" if field_name == 'user_name' else "="),
+        sql.SQL("="),
         sql.Placeholder(field_name)
     ])
 
@@ -44,6 +57,30 @@ def get_user(**user_criteria):
             record = cur.fetchone()
             return dict(record) if record else None
 
+def get_user_principal(user_name):
+    '''returns the few fields needed to authenticate a request
+    {'user_id': 1, 'user_name': 'foo', 'user_status': None}
+    or None if there's no such user. Cached for USER_CACHE_TTL seconds,
+    or until the user is locked, unlocked or renamed.
+    '''
+    key = user_name.lower()
+    principal = user_principals.get(key)
+    if principal is None:
+        user = get_user(user_name=user_name)
+        if not user: return None
+        principal = {k: user[k] for k in ('user_id', 'user_name', 'user_status')}
+        user_principals.set(key, principal)
+    return principal
+
+def invalidate_user_principal(**user_criteria):
+    '''drops a cached principal once the current transaction commits.
+    Principals are keyed by name, so all of them are dropped for user_id.'''
+    user_name = user_criteria.get('user_name')
+    if user_name is None:
+        after_commit(user_principals.clear)
+    else:
+        after_commit(lambda: user_principals.pop(user_name.lower()))
+
 def change_user_status(new_status=None, **user_criteria):
     '''use this to lock, unlock (reset), or remove a locked/reset status.
     Pass LOCKED or RESET as the first argument to update to that status,
@@ -77,6 +114,8 @@ def change_user_status(new_status=None, **user_criteria):
         with get_cursor(cn) as cur:
             cur.execute(statement, user_criteria)
 
+    invalidate_user_principal(**user_criteria)
+
 def lock_user(**user_criteria):
     change_user_status(LOCKED, **user_criteria)
 
@@ -102,7 +141,77 @@ def register_login_attempt(is_successful, **user_criteria):
         with get_cursor(cn) as cur:
             cur.execute(statement, user_criteria)
 
-def is_user_password_valid(password, **user_criteria):
+#####################################################################
+# successful logins' last_login, written in batches
+
+_login_times = {}
+_login_times_lock = threading.Lock()
+_login_flusher_pid = None
+
+def _reset_login_times():
+    global _login_times, _login_times_lock
+    # the parent process flushes its own.
+    _login_times = {}
+    _login_times_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_login_times)
+
+def record_login_time(user_id):
+    '''queues the current time as user_id's last_login.
+    Queued times are written every LOGIN_FLUSH_INTERVAL seconds
+    by a background thread (see flush_login_times).
+    '''
+    global _login_flusher_pid
+    with _login_times_lock:
+        _login_times[user_id] = datetime.now(timezone.utc)
+        if _login_flusher_pid != os.getpid():
+            _login_flusher_pid = os.getpid()
+            threading.Thread(target=_flush_login_times_periodically, daemon=True).start()
+
+def _flush_login_times_periodically():
+    while True:
+        time.sleep(app.config['LOGIN_FLUSH_INTERVAL'])
+        try:
+            flush_login_times()
+        except Exception:
+            pass # they're queued again, for the next try.
+
+def flush_login_times():
+    '''writes every queued last_login in one UPDATE.
+    Returns the number of users updated.
+    '''
+    global _login_times
+    with _login_times_lock:
+        times, _login_times = _login_times, {}
+    if not times: return 0
+
+    statement = (   "UPDATE users SET last_login = v.login_time "
+                    "FROM (VALUES %s) AS v (user_id, login_time) "
+                    "WHERE users.user_id = v.user_id "
+                        "AND (last_login IS NULL OR last_login < v.login_time)")
+    try:
+        with get_connection() as cn:
+            with cn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, statement, list(times.items()))
+    except Exception:
+        with _login_times_lock:
+            for user_id, login_time in times.items():
+                _login_times.setdefault(user_id, login_time)
+        raise
+    return len(times)
+
+@atexit.register
+def _flush_login_times_at_exit():
+    try:
+        flush_login_times()
+    except Exception:
+        pass
+
+def is_user_password_valid(password, rehash=True, **user_criteria):
+    '''True if password is the user's. Unless rehash is False, a hash
+    made with outdated cost parameters is upgraded on success.
+    Raises PermissionError if the user doesn't exist or is locked.
+    '''
     user_dict = get_user(**user_criteria)
     if not user_dict: 
         vals = list(user_criteria.items())[0]
@@ -111,26 +220,37 @@ def is_user_password_valid(password, **user_criteria):
     if user_dict['user_status'] == LOCKED:
         raise PermissionError("This account is locked")
     if user_dict['unsuccessful_logins'] >= ALLOWED_ATTEMPTS:
-        lock_user(**criteria)
+        lock_user(**user_criteria)
         raise PermissionError("This account is locked")
 
     salt = bytes(user_dict['password_salt'])
-    h1 = bytes(user_dict['password_hash'])
-    h2 = scrypt.hash(password, salt)
+    params = user_dict.get('password_params')
+    success = verify_password(password, bytes(user_dict['password_hash']), salt, params)
+    if success and user_dict['unsuccessful_logins'] == 0:
+        # there's no failure count to reset, just last_login,
+        # which can wait for the next batch.
+        record_login_time(user_dict['user_id'])
+    else:
+        register_login_attempt(success, **user_criteria)
 
-    success = (h1 == h2)
-    register_login_attempt(success, **user_criteria)
+    if rehash and success and needs_rehash(params):
+        # the password is at hand, so upgrade its hash to the current cost.
+        update_user_password(*hash_password(password), **user_criteria)
     return success
 
-def add_user(user_name, password_hash, salt):
+def add_user(user_name, password_hash, salt, params=None):
+    '''params are the scrypt cost parameters the hash was made with
+    (see simple_recipes.passwords.hash_password).
+    '''
     statement = sql.SQL(    "INSERT INTO users "
-                            "(user_name, password_hash, password_salt) "
-                            "VALUES (%s, %s, %s) "
+                            "(user_name, password_hash, password_salt, password_params) "
+                            "VALUES (%s, %s, %s, %s) "
                             "RETURNING user_id")
     
     with get_connection() as cn:
         with get_cursor(cn) as cur:
-            cur.execute(statement, (user_name, password_hash, salt))
+            cur.execute(statement, (user_name, password_hash, salt,
+                json.dumps(params) if params else None))
             return cur.fetchone()['user_id']
 
 def update_user_name(new_user_name, **user_criteria):
@@ -139,7 +259,7 @@ def update_user_name(new_user_name, **user_criteria):
                             "WHERE {where};")
 
     where_clause = check_user_criteria(**user_criteria)
-    data = user_criteria
+    data = dict(user_criteria)
     data['new'] = new_user_name
     statement = statement.format(where=where_clause)
 
@@ -147,17 +267,26 @@ def update_user_name(new_user_name, **user_criteria):
         with get_cursor(cn) as cur:
             cur.execute(statement, data)
 
-def update_user_password(password_hash, salt=None, **user_criteria):
-    if not salt: salt = urandom(64)
+    invalidate_user_principal(**user_criteria)
+    invalidate_user_principal(user_name=new_user_name)
 
+    # user names show up as created_by on recipe pages.
+    after_commit(clear_recipe_searches)
+
+def update_user_password(password_hash, salt, params=None, **user_criteria):
+    '''params are the scrypt cost parameters the hash was made with
+    (see simple_recipes.passwords.hash_password).
+    '''
     where_clause = check_user_criteria(**user_criteria)
-    data = user_criteria
+    data = dict(user_criteria)
     data['password'] = password_hash
     data['salt'] = salt
+    data['params'] = json.dumps(params) if params else None
     statement = sql.SQL(    "UPDATE users "
                             "SET "
                                 "password_hash=%(password)s, "
-                                "password_salt=%(salt)s "
+                                "password_salt=%(salt)s, "
+                                "password_params=%(params)s "
                             "WHERE {where}")
 
     statement = statement.format(where=where_clause)
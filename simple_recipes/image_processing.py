@@ -0,0 +1,213 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait
+import io
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+# name => maximum (width, height) of each stored rendition.
+# images are only ever scaled down, keeping their aspect ratio.
+RENDITION_SIZES = {
+    'thumbnail': (90, 90),
+    'medium': (480, 480),
+    'large': (1024, 1024),
+}
+
+# widths (in pixels) of the responsive variants offered in srcset.
+# they're stored as renditions too, but only for images wider than that.
+WIDTH_VARIANTS = (320, 640, 960, 1280)
+
+def get_variant_name(width):
+    '''rendition name a width variant is stored under.'''
+    return f'w{width}'
+
+def make_width_variant(image_bytes, width):
+    '''returns a copy of the image scaled down to the given width,
+    in the same format as make_rendition, or None if the image
+    is no wider than that already (the original should be used).
+    '''
+    img = Image.open(io.BytesIO(image_bytes))
+    img_format = img.format
+    file_type = Image.MIME.get(img_format, 'application/octet-stream')
+
+    if img.width <= width: return None
+
+    height = max(1, round(img.height * width / img.width))
+    img = img.resize((width, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=img_format)
+    return {
+        'file_type': file_type,
+        'width': img.width,
+        'height': img.height,
+        'image_bytes': buffer.getvalue(),
+    }
+
+def make_rendition(image_bytes, rendition):
+    '''returns a resized copy of the image for the named rendition,
+    as a dictionary:
+    {'file_type': 'image/jpeg', 'width': 90, 'height': 60, 'image_bytes': b''}
+    The image keeps its original format.
+    '''
+    img = Image.open(io.BytesIO(image_bytes))
+    img_format = img.format
+    img.thumbnail(RENDITION_SIZES[rendition])
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=img_format)
+    return {
+        'file_type': Image.MIME.get(img_format, 'application/octet-stream'),
+        'width': img.width,
+        'height': img.height,
+        'image_bytes': buffer.getvalue(),
+    }
+
+def make_renditions(image_bytes):
+    '''returns {rendition name: rendition} for every RENDITION_SIZES entry,
+    and every WIDTH_VARIANTS width the image is wider than.'''
+    renditions = {name: make_rendition(image_bytes, name) for name in RENDITION_SIZES}
+    for width in WIDTH_VARIANTS:
+        variant = make_width_variant(image_bytes, width)
+        if variant: renditions[get_variant_name(width)] = variant
+    return renditions
+
+def get_image_size(image_bytes):
+    '''(width, height) of an image, without decoding it.'''
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        return img.size
+
+def save_renditions(renditions):
+    '''moves each rendition's image_bytes to a temporary file,
+    replacing them with its image_path. The caller must delete the files.'''
+    for rendition in renditions.values():
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(rendition.pop('image_bytes'))
+        rendition['image_path'] = path
+    return renditions
+
+def remove_upload_files(path, result):
+    '''deletes the temporary files process_upload made for the upload
+    originally at path (but not that file itself).'''
+    if result['image_path'] != path: os.remove(result['image_path'])
+    for rendition in result['renditions'].values():
+        os.remove(rendition['image_path'])
+
+def process_upload(path, max_size=None, convert_to_webp=False):
+    '''validates and normalizes an uploaded image stored at path.
+    Meant to run in a worker process (see get_upload_pool).
+
+     - raises ValueError if Pillow can't read the file as an image
+     - rotates it according to its EXIF orientation
+     - scales it down to fit within max_size (width, height), if given
+     - re-encodes it as WebP if convert_to_webp is set
+
+    If none of that changes the image, the original file is kept as-is.
+    Otherwise the result goes to a new temporary file. Returns a dictionary:
+    {'image_path': '...', 'file_type': 'image/jpeg', 
+        'width': 1, 'height': 1, 'renditions': {...}}
+    where renditions is the output of make_renditions for the result,
+    with each rendition saved to a temporary file (see save_renditions),
+    so nothing the size of an image is sent back to the caller.
+    The caller must delete the new files (see remove_upload_files).
+    '''
+    try:
+        with Image.open(path) as img:
+            img.verify()
+    except Exception as exc:
+        raise ValueError(f"not a valid image: {exc}")
+
+    # verify() leaves the image unusable, so it's opened again.
+    with Image.open(path) as img:
+        try:
+            img.load()
+        except Exception as exc:
+            raise ValueError(f"not a valid image: {exc}")
+
+        img_format = img.format
+        processed = img
+        is_changed = False
+
+        # EXIF orientation tag; 1 means the image is already upright.
+        if img.getexif().get(0x0112, 1) != 1:
+            processed = ImageOps.exif_transpose(img)
+            is_changed = True
+
+        if max_size and (processed.width > max_size[0] or processed.height > max_size[1]):
+            processed.thumbnail(max_size)
+            is_changed = True
+
+        if convert_to_webp and img_format != 'WEBP':
+            img_format = 'WEBP'
+            is_changed = True
+
+        output_path = path
+        if is_changed:
+            save_options = {}
+            if img_format == 'JPEG':
+                save_options['quality'] = 85
+                if processed.mode not in ('RGB', 'L'):
+                    processed = processed.convert('RGB')
+            elif img_format == 'WEBP':
+                save_options['quality'] = 85
+                if processed.mode not in ('RGB', 'RGBA'):
+                    has_alpha = 'A' in processed.getbands() or 'transparency' in processed.info
+                    processed = processed.convert('RGBA' if has_alpha else 'RGB')
+
+            fd, output_path = tempfile.mkstemp()
+            with os.fdopen(fd, 'wb') as f:
+                processed.save(f, format=img_format, **save_options)
+
+    with open(output_path, 'rb') as f:
+        renditions = save_renditions(make_renditions(f.read()))
+
+    return {
+        'image_path': output_path,
+        'file_type': Image.MIME.get(img_format, 'application/octet-stream'),
+        'width': processed.width,
+        'height': processed.height,
+        'renditions': renditions,
+    }
+
+# process pool for process_upload, created lazily per process
+# so it isn't shared between forked gunicorn workers.
+_upload_pool = None
+_upload_pool_pid = None
+
+def get_upload_pool(max_workers=None):
+    global _upload_pool, _upload_pool_pid
+    if _upload_pool is None or _upload_pool_pid != os.getpid():
+        _upload_pool = ProcessPoolExecutor(max_workers=max_workers)
+        _upload_pool_pid = os.getpid()
+    return _upload_pool
+
+def process_uploads(paths, max_workers=None, timeout=None, **options):
+    '''runs process_upload for every path in a process pool.
+    Returns the results in the same order;
+    raises the first ValueError for an invalid image,
+    or TimeoutError if they aren't all done within timeout seconds.
+    '''
+    if len(paths) <= 1:
+        return [process_upload(path, **options) for path in paths]
+
+    pool = get_upload_pool(max_workers)
+    futures = [pool.submit(process_upload, path, **options) for path in paths]
+    done, not_done = wait(futures, timeout=timeout)
+
+    failed = [f for f in done if f.exception() is not None]
+    if failed or not_done:
+        # don't leave the other uploads' output files behind,
+        # including those of uploads still being processed.
+        for path, future in zip(paths, futures):
+            if future in done:
+                if future.exception() is None:
+                    remove_upload_files(path, future.result())
+            elif not future.cancel():
+                future.add_done_callback(
+                    lambda f, path=path: f.exception() is None 
+                        and remove_upload_files(path, f.result()))
+        if failed: raise failed[0].exception()
+        raise TimeoutError(f"processing uploads took longer than {timeout} seconds")
+
+    return [future.result() for future in futures]
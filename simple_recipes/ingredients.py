@@ -0,0 +1,85 @@
+import re
+
+# words that describe an amount or how an ingredient is prepared,
+# rather than what it is.
+IGNORED_WORDS = {
+    'a', 'an', 'and', 'or', 'of', 'the', 'to', 'for', 'with', 'into', 'about',
+    'cup', 'tablespoon', 'tbsp', 'teaspoon', 'tsp', 'ounce', 'oz', 'pound', 'lb',
+    'gram', 'g', 'kg', 'ml', 'l', 'liter', 'litre', 'quart', 'qt', 'pint', 'gallon',
+    'pinch', 'dash', 'handful', 'can', 'package', 'pkg', 'jar', 'bunch', 'stick',
+    'large', 'medium', 'small', 'whole', 'fresh', 'freshly', 'dried', 'frozen',
+    'chopped', 'diced', 'minced', 'sliced', 'grated', 'shredded', 'crushed',
+    'ground', 'melted', 'softened', 'peeled', 'beaten', 'divided', 'optional',
+    'finely', 'roughly', 'thinly', 'taste', 'needed', 'more',
+    'cut', 'cubed', 'halved', 'quartered', 'seeded', 'pitted', 'cored',
+    'trimmed', 'rinsed', 'drained', 'cooked', 'toasted', 'room', 'temperature',
+}
+
+ingredient_word_pattern = re.compile(r'[^\W\d_]+')
+ingredient_note_pattern = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+ingredient_conjunction_pattern = re.compile(r'\s+and\s+|\s*&\s*', re.IGNORECASE)
+ingredient_alternative_pattern = re.compile(r'\s+or\s+', re.IGNORECASE)
+
+def singularize(word):
+    '''rough English singular, good enough to match "eggs" with "egg".'''
+    if len(word) > 4 and word.endswith('ies'): return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('oes', 'ches', 'shes', 'sses')): return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+def normalize_ingredient_name(text):
+    '''reduces an ingredient line (without its quantity) or a pantry item
+    to a canonical name, or None if there's nothing left.
+
+    normalize_ingredient_name('- large eggs, beaten')        => 'egg'
+    normalize_ingredient_name('all-purpose flour (sifted)')  => 'all purpose flour'
+    '''
+    # notes after a comma or in brackets are preparation, not the ingredient.
+    text = ingredient_note_pattern.sub(' ', text.lower()).split(',')[0]
+    words = [singularize(w) for w in ingredient_word_pattern.findall(text)]
+    words = [w for w in words if w not in IGNORED_WORDS]
+    return ' '.join(words) or None
+
+def split_ingredient_line(line):
+    '''splits an ingredient line (without its quantity) into the
+    ingredients it lists, each a list of normalized alternative names.
+
+    split_ingredient_line('salt and pepper')                 => [['salt'], ['pepper']]
+    split_ingredient_line('butter or margarine, softened')   => [['butter', 'margarine']]
+    split_ingredient_line('onions, carrots & celery')        => [['onion'], ['carrot'], ['celery']]
+
+    Commas only separate ingredients in lines that also have a
+    conjunction; otherwise what follows one is a note, as in
+    'chicken breasts, cut into strips'.
+    '''
+    line = ingredient_note_pattern.sub(' ', line)
+    parts = ingredient_conjunction_pattern.split(line)
+    if len(parts) > 1:
+        parts = [p for part in parts for p in part.split(',')]
+
+    ingredients = []
+    for part in parts:
+        names = [normalize_ingredient_name(alternative)
+            for alternative in ingredient_alternative_pattern.split(part)]
+        names = list(dict.fromkeys(name for name in names if name))
+        if names: ingredients.append(names)
+    return ingredients
+
+def get_ingredient_names(tokens):
+    '''returns the ingredients listed in a token stream from
+    compile_recipe_text, in order, each as a list of normalized
+    alternative names (see split_ingredient_line).
+    Quantities marked up as `{{ }}` tokens are left out.
+    '''
+    text = ''.join(t if isinstance(t, str) else ' ' for t in tokens)
+    return [names for line in text.splitlines() 
+        for names in split_ingredient_line(line)]
+
+def get_ingredient_terms(name):
+    '''the lookup terms for a normalized name: the name and every
+    shorter run of its trailing words, so "extra virgin olive oil"
+    is found by "olive oil" and "oil", but not by "olive".
+    '''
+    words = name.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
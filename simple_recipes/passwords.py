@@ -0,0 +1,97 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import hmac
+import os
+import threading
+
+import scrypt
+
+from simple_recipes import app
+
+# what py-scrypt uses when none are given, so users whose hashes
+# predate stored parameters still verify.
+DEFAULT_SCRYPT_PARAMS = {'N': 16384, 'r': 8, 'p': 1}
+
+class PasswordServiceUnavailable(Exception):
+    '''raised when too many password checks are already queued,
+    or one takes longer than PASSWORD_TIMEOUT. Answered with a 503.'''
+
+def get_scrypt_params():
+    '''the cost parameters new password hashes are made with.'''
+    return {
+        'N': app.config['SCRYPT_N'],
+        'r': app.config['SCRYPT_R'],
+        'p': app.config['SCRYPT_P']
+    }
+
+def _hash(password, salt, params):
+    return scrypt.hash(password, salt, N=params['N'], r=params['r'], p=params['p'])
+
+_password_pool = None
+_password_pool_pid = None
+_password_slots = None
+_password_pool_lock = threading.Lock()
+
+def _reset_password_pool_lock():
+    global _password_pool_lock
+    _password_pool_lock = threading.Lock()
+
+# a lock held by another thread at fork time would never be released.
+os.register_at_fork(after_in_child=_reset_password_pool_lock)
+
+def get_password_pool():
+    '''returns this process' pool for scrypt, and the semaphore
+    bounding how many hashes can be queued or running in it.'''
+    global _password_pool, _password_pool_pid, _password_slots
+    if _password_pool is None or _password_pool_pid != os.getpid():
+        # concurrent first logins would otherwise each make a pool.
+        with _password_pool_lock:
+            if _password_pool is None or _password_pool_pid != os.getpid():
+                _password_slots = threading.BoundedSemaphore(
+                    app.config['PASSWORD_QUEUE_LIMIT'])
+                _password_pool = ProcessPoolExecutor(
+                    max_workers=app.config['PASSWORD_PROCESSES'])
+                _password_pool_pid = os.getpid()
+    return _password_pool, _password_slots
+
+def _run(password, salt, params):
+    '''hashes in the password pool, so a burst of logins queues up
+    there instead of tying up request workers.
+    With PASSWORD_PROCESSES set to 0, it hashes right here.
+    '''
+    if not app.config['PASSWORD_PROCESSES']:
+        return _hash(password, salt, params)
+
+    pool, slots = get_password_pool()
+    if not slots.acquire(blocking=False):
+        raise PasswordServiceUnavailable("Too many logins at once, please try again")
+    try:
+        future = pool.submit(_hash, password, salt, params)
+    except Exception:
+        slots.release()
+        raise
+    # the slot stays taken until the hash is done (or cancelled),
+    # even if this request stops waiting for it.
+    future.add_done_callback(lambda f: slots.release())
+
+    try:
+        return future.result(timeout=app.config['PASSWORD_TIMEOUT'])
+    except TimeoutError:
+        future.cancel()
+        raise PasswordServiceUnavailable("Logging in took too long, please try again")
+
+def hash_password(password, salt=None, params=None):
+    '''returns (password_hash, salt, params) for a new password,
+    using the current cost parameters unless others are given.'''
+    salt = salt or os.urandom(64)
+    params = params or get_scrypt_params()
+    return _run(password, salt, params), salt, params
+
+def verify_password(password, password_hash, salt, params=None):
+    '''True if password matches a hash made with the given parameters.'''
+    h = _run(password, salt, params or DEFAULT_SCRYPT_PARAMS)
+    return hmac.compare_digest(h, password_hash)
+
+def needs_rehash(params):
+    '''True if a hash made with params should be upgraded
+    to the current cost parameters.'''
+    return (params or DEFAULT_SCRYPT_PARAMS) != get_scrypt_params()
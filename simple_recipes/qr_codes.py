@@ -0,0 +1,150 @@
+import hashlib
+import io
+import os
+import tempfile
+
+import pyqrcode
+from flask import request, url_for
+
+from simple_recipes import app
+from simple_recipes.caching import LRUCache
+
+MIME_TYPES = {
+    'svg': 'image/svg+xml',
+    'png': 'image/png',
+}
+
+DEFAULT_SCALE = 4
+MAX_SCALE = 16
+
+# QR codes are fully determined by (recipe, scale, format) and the site
+# URL they point at, so they're kept in memory and in QR_CODE_CACHE_PATH,
+# which is shared between workers and filled ahead of time by
+# pregenerate_qr_codes. at most QR_CODE_DISK_LIMIT files are kept there,
+# give or take the files written between evictions.
+qr_codes = LRUCache('qr_codes', maxsize=app.config['QR_CODE_CACHE_SIZE'])
+
+# files this process writes between evictions, which scan the directory.
+EVICTION_INTERVAL = 100
+_writes_since_eviction = 0
+
+def get_site_url():
+    '''the address share links point at: SITE_URL, or else
+    the one the current request came to. Requires a request context.
+    '''
+    return (app.config['SITE_URL'] or request.host_url).rstrip('/')
+
+def get_qr_code_key(recipe_id, scale=DEFAULT_SCALE, kind='svg', site_url=None):
+    '''deterministic identifier for a recipe's QR code, used as its
+    ETag and file name. Doesn't require generating the code.
+    Requires a request context unless site_url is given.
+    '''
+    site_url = site_url or get_site_url()
+    site = hashlib.sha256(site_url.encode('utf-8')).hexdigest()[:16]
+    return f'recipe-{recipe_id}-{scale}-{site}.{kind}'
+
+def get_share_url(recipe_id, site_url=None):
+    '''the public URL of the recipe that its QR code points at.
+    Requires a request context.
+    '''
+    site_url = site_url or get_site_url()
+    return site_url + url_for('get_recipe', recipe_id=recipe_id)
+
+def make_qr_code(url, scale=DEFAULT_SCALE, kind='svg'):
+    '''generates a QR code image for the URL, as bytes.
+    PNG output requires the pypng package.
+    '''
+    qr = pyqrcode.create(url)
+    buffer = io.BytesIO()
+    if kind == 'png':
+        qr.png(buffer, scale=scale)
+    else:
+        qr.svg(buffer, scale=scale)
+    return buffer.getvalue()
+
+def _get_file_path(key):
+    return os.path.join(app.config['QR_CODE_CACHE_PATH'], key)
+
+def _write_file(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def evict_qr_code_files(limit=None):
+    '''deletes the least recently written QR code files beyond the limit
+    (QR_CODE_DISK_LIMIT by default). Returns the number deleted.
+    '''
+    if limit is None: limit = app.config['QR_CODE_DISK_LIMIT']
+    directory = app.config['QR_CODE_CACHE_PATH']
+    try:
+        entries = [e for e in os.scandir(directory) if not e.name.startswith('.')]
+    except FileNotFoundError:
+        return 0
+    if len(entries) <= limit: return 0
+
+    def mtime(entry):
+        try:
+            return entry.stat().st_mtime
+        except FileNotFoundError:
+            return 0
+    entries.sort(key=mtime)
+
+    count = 0
+    for entry in entries[:len(entries) - limit]:
+        try:
+            os.remove(entry.path)
+            count += 1
+        except FileNotFoundError:
+            pass # another worker got to it first
+    return count
+
+def _count_write():
+    global _writes_since_eviction
+    _writes_since_eviction += 1
+    if _writes_since_eviction >= EVICTION_INTERVAL:
+        _writes_since_eviction = 0
+        evict_qr_code_files()
+
+def get_qr_code(recipe_id, scale=DEFAULT_SCALE, kind='svg'):
+    '''returns the recipe's QR code, generating it only if it's
+    neither in memory nor on disk yet. Requires a request context.
+    '''
+    key = get_qr_code_key(recipe_id, scale, kind)
+    data = qr_codes.get(key)
+    if data is not None: return data
+
+    path = _get_file_path(key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = make_qr_code(get_share_url(recipe_id), scale, kind)
+        try:
+            _write_file(path, data)
+            _count_write()
+        except OSError:
+            pass # the on-disk copy is only an optimization
+
+    qr_codes.set(key, data)
+    return data
+
+def pregenerate_qr_codes(recipe_ids, scales=(DEFAULT_SCALE,), kinds=('svg',)):
+    '''writes QR codes for every recipe, scale and format to disk,
+    skipping ones that already exist, up to QR_CODE_DISK_LIMIT files.
+    Requires a request context. Returns the number generated.
+    '''
+    site_url = get_site_url()
+    count = 0
+    for recipe_id in recipe_ids:
+        for scale in scales:
+            for kind in kinds:
+                path = _get_file_path(get_qr_code_key(recipe_id, scale, kind, site_url))
+                if os.path.exists(path): continue
+                _write_file(path, make_qr_code(
+                    get_share_url(recipe_id, site_url), scale, kind))
+                count += 1
+    evict_qr_code_files()
+    return count
@@ -0,0 +1,141 @@
+from collections import deque
+import os
+import sqlite3
+import threading
+import time
+
+from simple_recipes import app
+
+class TooManyLoginAttempts(Exception):
+    '''raised before any database or password work when a user name
+    or client has used up its login attempts. Answered with a 429.'''
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class MemoryStore:
+    '''sliding-window attempt log for this process only.'''
+    def __init__(self):
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now, window):
+        attempts = self._attempts.get(key)
+        if attempts is None: return deque()
+        while attempts and attempts[0] <= now - window:
+            attempts.popleft()
+        return attempts
+
+    def hit(self, key, limit, window):
+        '''records an attempt for key, unless there have already been limit
+        of them in the last window seconds. Returns 0 if it was recorded,
+        or the number of seconds until the next one would be.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, now, window)
+            if len(attempts) >= limit:
+                return attempts[0] + window - now
+            attempts.append(now)
+            self._attempts[key] = attempts
+
+            # forget keys that have gone quiet, so the dict doesn't grow forever.
+            if len(self._attempts) > 10000:
+                self._attempts = {k: a for k, a in self._attempts.items()
+                    if a and a[-1] > now - window}
+            return 0
+
+    def retry_after(self, key, limit, window):
+        '''like hit, without recording an attempt.'''
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, now, window)
+            if len(attempts) >= limit:
+                return attempts[0] + window - now
+            return 0
+
+class SQLiteStore:
+    '''sliding-window attempt log in a local SQLite file,
+    shared by every worker process on the machine.'''
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # connections can't be shared across threads or forks.
+        cn = getattr(self._local, 'cn', None)
+        if cn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            cn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            cn.execute("CREATE TABLE IF NOT EXISTS login_attempts (key TEXT, at REAL)")
+            cn.execute("CREATE INDEX IF NOT EXISTS login_attempts_key_at "
+                "ON login_attempts (key, at)")
+            self._local.cn, self._local.pid = cn, os.getpid()
+        return cn
+
+    def hit(self, key, limit, window):
+        '''same as MemoryStore.hit.'''
+        now = time.time()
+        cn = self._connection()
+        cn.execute("BEGIN IMMEDIATE")
+        try:
+            cn.execute("DELETE FROM login_attempts WHERE key = ? AND at <= ?",
+                (key, now - window))
+            count, oldest = cn.execute("SELECT COUNT(*), MIN(at) FROM login_attempts "
+                "WHERE key = ?", (key,)).fetchone()
+            if count >= limit:
+                return oldest + window - now
+            cn.execute("INSERT INTO login_attempts (key, at) VALUES (?, ?)", (key, now))
+            return 0
+        finally:
+            cn.execute("COMMIT")
+
+    def retry_after(self, key, limit, window):
+        '''same as MemoryStore.retry_after.'''
+        now = time.time()
+        count, oldest = self._connection().execute(
+            "SELECT COUNT(*), MIN(at) FROM login_attempts "
+            "WHERE key = ? AND at > ?", (key, now - window)).fetchone()
+        if count >= limit:
+            return oldest + window - now
+        return 0
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        if app.config['LOGIN_RATE_LIMIT_BACKEND'] == 'sqlite':
+            _store = SQLiteStore(app.config['LOGIN_RATE_LIMIT_PATH'])
+        else:
+            _store = MemoryStore()
+    return _store
+
+def _user_key(user_name):
+    return f'user:{user_name.lower()}'
+
+def _raise_if_limited(retry_after):
+    if retry_after:
+        raise TooManyLoginAttempts(
+            "Too many login attempts, please try again later",
+            int(retry_after) + 1)
+
+def check_login_rate(user_name, client_address):
+    '''records a login attempt by the client address, raising
+    TooManyLoginAttempts if it already made LOGIN_ATTEMPTS_PER_CLIENT,
+    or the user name already had LOGIN_ATTEMPTS_PER_USER failed ones
+    (see record_failed_login), in the last LOGIN_RATE_LIMIT_WINDOW seconds.
+    Only failures count against the user name, so that someone else
+    guessing at it can't lock its owner out for long.
+    '''
+    window = app.config['LOGIN_RATE_LIMIT_WINDOW']
+    store = get_store()
+    _raise_if_limited(store.hit(f'client:{client_address}',
+        app.config['LOGIN_ATTEMPTS_PER_CLIENT'], window))
+    _raise_if_limited(store.retry_after(_user_key(user_name),
+        app.config['LOGIN_ATTEMPTS_PER_USER'], window))
+
+def record_failed_login(user_name):
+    '''counts a failed login against the user name.'''
+    get_store().hit(_user_key(user_name),
+        app.config['LOGIN_ATTEMPTS_PER_USER'], app.config['LOGIN_RATE_LIMIT_WINDOW'])
@@ -0,0 +1,222 @@
+import os
+import random
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+import flask_login
+
+# the same serializer Flask uses for cookie sessions,
+# so anything that fit in the cookie fits here too.
+serializer = TaggedJSONSerializer()
+
+session_id_pattern = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+# every save has this chance of purging expired sessions.
+PURGE_PROBABILITY = 0.01
+
+class FilesystemSessionStore:
+    '''one file per session under path, named by the session ID.'''
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, sid):
+        return os.path.join(self.path, sid)
+
+    def load(self, sid):
+        '''returns the session's (serialized data, expiry time),
+        or None if there's no such session.'''
+        try:
+            with open(self._file(sid)) as f:
+                expires, data = f.read().split('\n', 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        return data, float(expires)
+
+    def save(self, sid, data, expires):
+        os.makedirs(self.path, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix='.')
+        with os.fdopen(fd, 'w') as f:
+            f.write(f'{expires}\n{data}')
+        os.replace(temp_path, self._file(sid))
+
+    def delete(self, sid):
+        try:
+            os.remove(self._file(sid))
+        except FileNotFoundError:
+            pass
+
+    def purge_expired(self):
+        now = time.time()
+        for sid in os.listdir(self.path):
+            if not session_id_pattern.match(sid): continue
+            record = self.load(sid)
+            if record and record[1] < now: self.delete(sid)
+
+class SQLiteSessionStore:
+    '''sessions in a local SQLite file, shared by every worker process.'''
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # connections can't be shared across threads or forks.
+        cn = getattr(self._local, 'cn', None)
+        if cn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            cn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            cn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                "(sid TEXT PRIMARY KEY, data TEXT, expires REAL)")
+            self._local.cn, self._local.pid = cn, os.getpid()
+        return cn
+
+    def load(self, sid):
+        '''same as FilesystemSessionStore.load.'''
+        return self._connection().execute(
+            "SELECT data, expires FROM sessions WHERE sid = ?", (sid,)).fetchone()
+
+    def save(self, sid, data, expires):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)",
+            (sid, data, expires))
+
+    def delete(self, sid):
+        self._connection().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def purge_expired(self):
+        self._connection().execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+class ServerSideSession(dict, SessionMixin):
+    '''a session whose contents are only read from the store
+    the first time they're used.'''
+    def __init__(self, load=None, sid=None):
+        super().__init__()
+        self.sid = sid
+        # an ID the client sent that shouldn't be used again.
+        self.old_sid = None
+        self.expires = None
+        self.modified = False
+        self.accessed = False
+        self._load = load
+
+    @property
+    def loaded(self):
+        return self._load is None
+
+    def _ensure_loaded(self):
+        self.accessed = True
+        if self._load is None: return
+        load, self._load = self._load, None
+        record = load()
+        if record is None or record[1] <= time.time():
+            # never reuse an ID that isn't in the store, or a new session
+            # would be saved under an ID someone else chose.
+            self.old_sid, self.sid = self.sid, None
+            return
+        data, self.expires = record
+        super().update(serializer.loads(data))
+
+    def rotate(self):
+        '''moves the contents to a new session ID when next saved,
+        deleting the old one, so an ID from before a login can't be
+        used to ride on it.'''
+        self._ensure_loaded()
+        if self.sid is not None:
+            self.old_sid, self.sid = self.sid, None
+        self.modified = True
+
+def _reader(name):
+    def method(self, *args, **kwargs):
+        self._ensure_loaded()
+        return getattr(dict, name)(self, *args, **kwargs)
+    return method
+
+def _writer(name):
+    def method(self, *args, **kwargs):
+        self._ensure_loaded()
+        self.modified = True
+        return getattr(dict, name)(self, *args, **kwargs)
+    return method
+
+for name in ('__getitem__', '__contains__', '__iter__', '__len__',
+        'get', 'keys', 'values', 'items', 'copy'):
+    setattr(ServerSideSession, name, _reader(name))
+for name in ('__setitem__', '__delitem__', 'pop', 'popitem',
+        'setdefault', 'update', 'clear'):
+    setattr(ServerSideSession, name, _writer(name))
+
+class ServerSideSessionInterface(SessionInterface):
+    '''keeps session contents in a store, with only a random
+    session ID in the cookie. Sessions expire `lifetime` seconds
+    after they were last saved, and are saved again once half
+    of that has passed, so active sessions don't expire.
+    '''
+    def __init__(self, store, lifetime):
+        self.store = store
+        self.lifetime = lifetime
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if not sid or not session_id_pattern.match(sid):
+            return ServerSideSession()
+        return ServerSideSession(lambda: self.store.load(sid), sid)
+
+    def save_session(self, app, session, response):
+        # requests that never touched the session cost nothing here.
+        if not session.loaded: return
+
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed: response.vary.add('Cookie')
+
+        if session.old_sid: self.store.delete(session.old_sid)
+
+        if not session:
+            if session.sid or session.old_sid:
+                if session.sid: self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        refresh = (session.expires is not None
+            and session.expires - now < self.lifetime / 2)
+        if not (session.modified or refresh): return
+
+        if random.random() < PURGE_PROBABILITY: self.store.purge_expired()
+
+        if session.sid is None: session.sid = secrets.token_urlsafe(32)
+        self.store.save(session.sid, serializer.dumps(dict(session)), now + self.lifetime)
+        response.set_cookie(
+            app.session_cookie_name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app))
+
+@flask_login.user_logged_in.connect
+@flask_login.user_logged_out.connect
+def rotate_session_id(sender, **extra):
+    '''gives the session a new ID whenever who it belongs to changes.'''
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.rotate()
+
+def get_session_interface(app):
+    '''the session interface for SESSION_BACKEND, or None to keep
+    Flask's signed-cookie sessions.'''
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'filesystem':
+        store = FilesystemSessionStore(app.config['SESSION_STORE_PATH'])
+    elif backend == 'sqlite':
+        store = SQLiteSessionStore(app.config['SESSION_STORE_PATH'])
+    else:
+        return None
+    return ServerSideSessionInterface(store, app.config['SESSION_LIFETIME'])
@@ -0,0 +1,20 @@
+// points each lightbox link at the smallest image in its data-srcset
+// ("url 320w, url 640w, ...") that still fills the screen, so the
+// lightbox doesn't load a full-size original on a small screen.
+// the lightbox itself (lightbox/) is upstream's, unmodified.
+const neededWidth = window.innerWidth * (window.devicePixelRatio || 1);
+
+document.querySelectorAll('a[data-lightbox][data-srcset]').forEach(link => {
+    const candidates = link.dataset.srcset.split(',')
+        .map(entry => {
+            const [url, width] = entry.trim().split(/\s+/);
+            return {url: url, width: parseInt(width, 10)};
+        })
+        .filter(candidate => candidate.url && candidate.width)
+        .sort((a, b) => a.width - b.width);
+    if (!candidates.length) return;
+
+    const chosen = candidates.find(candidate => candidate.width >= neededWidth)
+        || candidates[candidates.length - 1];
+    link.href = chosen.url;
+});
@@ -1,9 +1,12 @@
 import re
+import hashlib
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
 from fractions import Fraction
 from decimal import Decimal, getcontext
 
 from simple_recipes.formatting import fractionalize, pluralize
-from simple_recipes import ureg, Q_
+from simple_recipes import app, get_unit_registry, Q_
 
 # set precision for decimal library
 getcontext().prec = 6
@@ -70,49 +73,213 @@ quantity_token_pattern = re.compile(r'''
     \s*}}   # more optional space, followd by token end
 ''', re.VERBOSE)
 
+# translation table for vulgar fractions, super- and subscripts,
+# built once rather than on every parse.
+fraction_translation_table = str.maketrans(fraction_translation)
+
+# a letter followed by a period and/or whitespace, within a unit string.
+# the period is dropped and the whitespace becomes an underscore,
+# e.g. `fl. oz` => `fl_oz`
+unit_separator_pattern = re.compile(r'''
+    ([A-Z])     # a letter
+    (?:
+        \.(\s*)  # a period, maybe followed by whitespace
+        |
+        (\s+)    # or just whitespace
+    )
+    ''', re.VERBOSE | re.IGNORECASE)
+
+# how many distinct token strings parse_quantity_string remembers
+QUANTITY_CACHE_SIZE = 4096
+
+def _replace_unit_separator(matchobj):
+    letter, after_period, whitespace = matchobj.groups()
+    return letter + ('_' if after_period or whitespace else '')
+
+@lru_cache(maxsize=None)
+def _get_unit(unit_text):
+    '''pint unit for a normalized unit string, parsed once per string.'''
+    return get_unit_registry().Unit(unit_text)
+
+@lru_cache(maxsize=QUANTITY_CACHE_SIZE)
+def _parse_quantity_parts(quantity_text):
+    '''returns (magnitude, unit) for the raw token text,
+    where unit is None for naked numbers.
+    '''
+    # replace vulgar fractions with parsable characters (e.g. ¼ -> 1/4)
+    quantity_text = quantity_text.strip().translate(fraction_translation_table)
+
+    my_match = quantity_pattern.search(quantity_text)
+    number_part, unit_part = my_match.groups()
+    numbers = number_part.split(maxsplit=1)
+
+    if len(numbers) == 1: 
+        n = Fraction(numbers[0]).limit_denominator(10)
+    elif len(numbers) == 2:
+        n = int(numbers[0]) + Fraction(numbers[1]).limit_denominator(10)
+
+    n = n.numerator / Decimal(n.denominator)
+
+    unit_part = unit_separator_pattern.sub(_replace_unit_separator, unit_part)
+    return n, (_get_unit(unit_part) if unit_part else None)
+
 def parse_quantity_string(quantity_text):
     '''parses a string into a pint quantity,
     where the magnitude is a float. Takes care of things
     like vulgar fraction code points and mixed fractions.
     Naked numbers turn into dimensionless quantities.
+    Results are memoized by the raw text; see get_quantity_cache_info.
     Examples:
     parse_quantity_string('3 cups')     => <Quantity(3.0, 'cup')>
     parse_quantity_string('¼ cup')      => <Quantity(0.25, 'cup')>
     parse_quantity_string('1 1/2 cup')  => <Quantity(1.5, 'cup')>
     parse_quantity_string('7')          => <Quantity(7.0, 'dimensionless')>
     '''
-    
-    # strip text and replace vulgar fractions with parsable characters
-    # (e.g. ¼ -> 1/4)
-    trans = str.maketrans(fraction_translation)
-    quantity_text = quantity_text.strip().translate(trans)
-
-    # remove periods from unit string, and replace spaces with underscores.
-    # e.g. `fl. oz` => `fl_oz`
-    quantity_text = re.sub(
-        r'([A-Z])\.', r'\1', 
-        quantity_text, 
-        flags=re.IGNORECASE)
-    
-    quantity_text = re.sub(
-        r'([A-Z])\s+', r'\1_', 
-        quantity_text, 
-        flags=re.IGNORECASE)
+    n, unit = _parse_quantity_parts(quantity_text)
 
-    my_match = quantity_pattern.search(quantity_text)
-    number_part = my_match.group(1)
-    numbers = number_part.split(maxsplit=1)
+    # a new Quantity every time, so callers can't alter the cached one.
+    if unit is None: return Q_(n)
+    return Q_(n, unit)
 
-    if len(numbers) == 1: 
-        n = Fraction(numbers[0]).limit_denominator(10)
-    elif len(numbers) == 2:
-        n = int(numbers[0]) + Fraction(numbers[1]).limit_denominator(10)
+def get_quantity_cache_info():
+    '''hit/miss counters for parse_quantity_string's cache,
+    as a functools CacheInfo named tuple.
+    '''
+    return _parse_quantity_parts.cache_info()
 
-    n = n.numerator / Decimal(n.denominator)
+def clear_quantity_cache():
+    _parse_quantity_parts.cache_clear()
+    _get_unit.cache_clear()
+
+class _UnitFactor:
+    '''how a unit relates to its pint base units, e.g. cup => 0.000237 m³'''
+    def __init__(self, name):
+        base = Q_(1, name).to_base_units()
+        self.name = name
+        self.base_units = base.u
+        self.from_base = 1 / float(base.magnitude)
+
+class _CandidateGroup:
+    '''target units for one (category, system) pair,
+    sorted by how many of them make up one base unit.
+    '''
+    def __init__(self):
+        self.names = []     # in the same order as the unit catalog
+        self.factors = []
+        self.is_complete = True
+
+    def seal(self):
+        # order of each candidate in the catalog, for tie-breaking
+        # the same way the old linear scan did.
+        ranked = sorted(range(len(self.factors)),
+            key=lambda i: self.factors[i].from_base)
+        self.sorted_ranks = ranked
+        self.sorted_from_base = [self.factors[i].from_base for i in ranked]
+        self.base_units = self.factors[0].base_units if self.factors else None
+        if any(f.base_units != self.base_units for f in self.factors):
+            self.is_complete = False
+
+class ConversionTable:
+    '''precomputed conversion candidates for a unit catalog.
+
+    For each (unit_category, unit_system), the target units are kept
+    sorted by conversion factor, so finding the ones that land inside
+    the thresholds is a bisect rather than a pint conversion per unit.
+    Groups containing units pint can't scale multiplicatively
+    (temperatures, unknown names) are flagged and left to pint.
+    '''
+    def __init__(self, units):
+        self.units = units
+        self.factors = {}
+        self.groups = {}
+        # (from unit, to unit) => (float factor, Decimal factor),
+        # taken from pint so results match it exactly.
+        self.ratios = {}
+
+        for k, u in units.items():
+            group = self.groups.setdefault(
+                (u['unit_category'], u['unit_system']), _CandidateGroup())
+            factor = None
+            try:
+                # offset units (e.g. degF) don't map 0 to 0.
+                if Q_(0, k).to_base_units().magnitude == 0:
+                    factor = _UnitFactor(k)
+            except Exception:
+                pass
+
+            if factor:
+                self.factors[k] = factor
+                group.names.append(k)
+                group.factors.append(factor)
+            else:
+                group.is_complete = False
+
+        for group in self.groups.values(): group.seal()
+
+        for k, u in units.items():
+            if k not in self.factors: continue
+            for (cat, _), group in self.groups.items():
+                if cat != u['unit_category']: continue
+                for name in group.names:
+                    if self.factors[k].base_units != self.factors[name].base_units:
+                        continue
+                    ratio = float(Q_(1.0, k).to(name).magnitude)
+                    self.ratios[k, name] = (ratio, Decimal(repr(ratio)))
+
+    def convert(self, quantity, to_system, min_threshold, max_threshold):
+        '''returns the converted quantity,
+        or None if this conversion has to go through pint.
+        '''
+        from_name = str(quantity.u)
+        from_unit = self.units[from_name]
+        group = self.groups.get((from_unit['unit_category'], to_system))
+        if group is None: return quantity
+        if not group.is_complete: return None
 
-    if len(my_match.groups()) > 1: # there's a unit string.
-        return Q_(n, my_match.group(2))
-    else: return Q_(n)
+        from_factor = self.factors.get(from_name)
+        if not from_factor or from_factor.base_units != group.base_units:
+            return None
+
+        m = quantity.magnitude
+        is_decimal = isinstance(m, Decimal)
+
+        def magnitude(i):
+            ratio = self.ratios[from_name, group.names[i]]
+            return m * (ratio[1] if is_decimal else ratio[0])
+
+        # candidates whose factor could put them inside the thresholds.
+        # widened by one on each side, and rechecked below,
+        # so float rounding at the edges can't change the result.
+        base_float = float(m) / from_factor.from_base
+        if base_float:
+            bounds = sorted((min_threshold / base_float, max_threshold / base_float))
+            lo = bisect_left(group.sorted_from_base, bounds[0])
+            hi = bisect_right(group.sorted_from_base, bounds[1])
+            candidates = group.sorted_ranks[max(lo - 1, 0):hi + 1]
+        else:
+            candidates = group.sorted_ranks
+
+        matches = [i for i in candidates
+            if min_threshold <= magnitude(i) <= max_threshold]
+
+        # same choice as scanning the catalog in order: first match wins,
+        # and with no match, the last candidate does.
+        i = min(matches) if matches else len(group.names) - 1
+        return Q_(magnitude(i), group.names[i])
+
+# (units dict, ConversionTable) for the most recently used unit catalog.
+_conversion_table = (None, None)
+
+def get_conversion_table(units):
+    '''returns the ConversionTable for the unit catalog,
+    building it the first time the catalog is seen.
+    '''
+    global _conversion_table
+    cached_units, table = _conversion_table
+    if cached_units is not units:
+        table = ConversionTable(units)
+        _conversion_table = (units, table)
+    return table
 
 def convert_quantity(quantity, to_system, units, min_threshold=None, max_threshold=None):
     '''Converts a Pint quantity to another measurement system, 
@@ -123,6 +290,18 @@ def convert_quantity(quantity, to_system, units, min_threshold=None, max_thresho
     if not min_threshold: min_threshold = 0.25
     if not max_threshold: max_threshold = 5 if to_system == 'US' else 100
 
+    converted = get_conversion_table(units).convert(
+        quantity, to_system, min_threshold, max_threshold)
+    if converted is not None: return converted
+
+    return convert_quantity_with_pint(
+        quantity, to_system, units, min_threshold, max_threshold)
+
+def convert_quantity_with_pint(quantity, to_system, units, min_threshold, max_threshold):
+    '''the original conversion: tries every unit in the same category
+    and system with pint, until one lands inside the thresholds.
+    Used for units the ConversionTable can't handle, like temperatures.
+    '''
     to_quantity = quantity
     from_unit = units[str(quantity.u)]
     for k in units.keys():
@@ -139,6 +318,116 @@ def convert_quantity(quantity, to_system, units, min_threshold=None, max_thresho
 
     return to_quantity
 
+# bump this whenever compile_recipe_text's output changes,
+# so previously stored token streams are treated as stale.
+TOKEN_FORMAT_VERSION = 1
+
+def get_recipe_text_hash(recipe_text):
+    '''identifies the text a stored token stream was compiled from.'''
+    key = f"{TOKEN_FORMAT_VERSION}:{recipe_text}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def compile_recipe_text(recipe_text):
+    '''splits text into a token stream that can be stored as JSON
+    and rendered later by render_recipe_text, without re-parsing.
+    Literal text becomes plain strings; each `{{ }}` token becomes a dict:
+     - text: the token's text, e.g. `1 ½ cups`
+     - no_multiply: True for `{{! }}` tokens
+     - magnitude: the parsed magnitude, as a Decimal string
+     - unit: the canonical pint unit name, or None for naked numbers
+    magnitude and unit are left out for tokens that don't parse,
+    so they're rendered as their text, unchanged.
+    Example:
+    compile_recipe_text('{{ ½ cup }} sugar') =>
+        [{'text': '½ cup', 'no_multiply': False, 'magnitude': '0.5', 'unit': 'cup'},
+        ' sugar']
+    '''
+    tokens = []
+    position = 0
+    for matchobj in quantity_token_pattern.finditer(recipe_text):
+        if matchobj.start() > position:
+            tokens.append(recipe_text[position:matchobj.start()])
+        position = matchobj.end()
+
+        token = {
+            'text': matchobj.group(2).strip(),
+            'no_multiply': matchobj.group(1) == '!'}
+        try:
+            quantity = parse_quantity_string(token['text'])
+            unit = None if quantity.dimensionless else str(quantity.u)
+            token.update(magnitude=str(quantity.magnitude), unit=unit)
+        except Exception as e:
+            app.logger.warning("Couldn't parse quantity %r: %s", token['text'], e)
+        tokens.append(token)
+
+    if position < len(recipe_text):
+        tokens.append(recipe_text[position:])
+    return tokens
+
+def format_quantity(quantity, multiplier=1, to_system=None, units=None):
+    '''multiplies and (optionally) converts a quantity,
+    and returns it as a human-readable string.
+    '''
+    quantity *= Decimal(multiplier)
+    magnitude = quantity.magnitude
+    #quantity.default_format = "~P" # short pretty format
+
+    if quantity.dimensionless:
+        return str(magnitude)
+
+    # continue with unit conversion if requested
+    if to_system:
+        quantity = convert_quantity(quantity, to_system, units)
+
+    quantity_unit = units[str(quantity.u)]
+    if quantity_unit['unit_system'] == 'SI':
+        return '{:.2f} {}'.format(
+            quantity.magnitude,
+            quantity_unit['unit_abbr'])
+    else:
+        return '{} {}'.format(
+            fractionalize(quantity.magnitude),
+            pluralize(
+                quantity.magnitude, 
+                quantity_unit['unit_singular'], 
+                quantity_unit['unit_plural']))
+
+def render_recipe_text(tokens, multiplier=1, to_system=None, units=None, quantity_tag=None, **quantity_attribs):
+    '''renders a token stream from compile_recipe_text.
+    Arguments are the same as convert_recipe_text.
+    '''
+    if units == None:
+        raise ValueError("units must be defined")
+
+    if quantity_tag:
+        attribs = ' '.join(f"{k.lower()}=\"{quantity_attribs[k]}\"" for k in quantity_attribs)
+        tag_template = f"<{quantity_tag} {attribs}>{{}}</{quantity_tag}>"
+    else:
+        tag_template = "{}"
+
+    parts = []
+    for token in tokens:
+        if isinstance(token, str):
+            parts.append(token)
+            continue
+
+        quantity_string = token['text']
+        if 'magnitude' in token:
+            try:
+                n = Decimal(token['magnitude'])
+                unit = token['unit']
+                quantity = Q_(n, _get_unit(unit)) if unit else Q_(n)
+                quantity_string = format_quantity(quantity, 
+                    multiplier=1 if token['no_multiply'] else multiplier,
+                    to_system=to_system,
+                    units=units)
+            except Exception as e:
+                print(e)
+
+        parts.append(tag_template.format(quantity_string))
+
+    return ''.join(parts)
+
 def convert_recipe_text(recipe_text, multiplier=1, to_system=None, units=None, quantity_tag=None, **quantity_attribs):
     '''parses the provided text for tokenized measurements
     multiplies measurements by multipler
@@ -146,53 +435,11 @@ def convert_recipe_text(recipe_text, multiplier=1, to_system=None, units=None, q
     if to_system is specified (US or SI), measurements not in that to_system
     are "coerced" to the unit system.
     (e.g. if to_system is SI, {{ 2 cups }} might be converted to {{ 0.47 Litres }}
+    If the text has already been compiled with compile_recipe_text,
+    use render_recipe_text instead.
     '''
-
     if units == None:
         raise ValueError("units must be defined")
 
-    def my_repl(matchobj):
-        do_not_multiply = False
-        quantity_string = matchobj.group(2).strip()
-        if matchobj.group(1) == '!': 
-            do_not_multiply = True
-        try:
-            quantity = parse_quantity_string(quantity_string)
-            if not do_not_multiply: quantity *= Decimal(multiplier)
-            magnitude = quantity.magnitude
-            #quantity.default_format = "~P" # short pretty format
-
-            if quantity.dimensionless:
-                quantity_string =  str(magnitude)
-            else:
-                # quantity_string = str(quantity)
-                # continue with unit conversion if requested
-                if to_system:
-                    quantity = convert_quantity(quantity, to_system, units)
-
-                quantity_unit = units[str(quantity.u)]
-                if quantity_unit['unit_system'] == 'SI':
-                    quantity_string = '{:.2f} {}'.format(
-                        quantity.magnitude,
-                        quantity_unit['unit_abbr'])
-                else:
-                    quantity_string = '{} {}'.format(
-                        fractionalize(quantity.magnitude),
-                       pluralize(
-                            quantity.magnitude, 
-                            quantity_unit['unit_singular'], 
-                            quantity_unit['unit_plural']))
-
-        except Exception as e:
-            # return matchobj.group(0)
-            print(e)
-
-        if quantity_tag:
-            attribs = ' '.join(f"{k.lower()}=\"{quantity_attribs[k]}\"" for k in quantity_attribs)
-            quantity_string = f"<{quantity_tag} {attribs}>{quantity_string}</{quantity_tag}>"
-        return quantity_string
-        
-    converted = recipe_text
-    converted = re.sub(quantity_token_pattern, my_repl, recipe_text)
-
-    return converted
+    return render_recipe_text(compile_recipe_text(recipe_text),
+        multiplier, to_system, units, quantity_tag, **quantity_attribs)
@@ -0,0 +1,48 @@
+import contextlib
+import os
+import time
+
+import pytest
+
+from simple_recipes import app
+from simple_recipes.db.recipes import images
+from simple_recipes.db.recipes.blob_store import BlobStore
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'IMAGE_STORAGE_PATH', str(tmp_path))
+    return BlobStore(str(tmp_path))
+
+def _age(store, content_hash, seconds):
+    then = time.time() - seconds
+    os.utime(store.path_for(content_hash), (then, then))
+
+def test_put_and_get(store):
+    content_hash = store.put(b'image')
+    assert store.put(b'image') == content_hash
+    assert store.get(content_hash) == b'image'
+    assert list(store.iter_hashes()) == [content_hash]
+
+def test_putting_again_counts_as_new(store):
+    content_hash = store.put(b'image')
+    _age(store, content_hash, 7200)
+    store.put(b'image')
+    assert store.modified_at(content_hash) > time.time() - 60
+
+def test_delete_unreferenced_blobs_keeps_new_files(store, monkeypatch):
+    referenced, old, new = (store.put(data) for data in (b'referenced', b'old', b'new'))
+    for content_hash in (referenced, old):
+        _age(store, content_hash, 7200)
+
+    @contextlib.contextmanager
+    def get_connection():
+        class Cursor(list):
+            def execute(self, statement): self.append((referenced,))
+        class Connection:
+            @contextlib.contextmanager
+            def cursor(self): yield Cursor()
+        yield Connection()
+    monkeypatch.setattr(images, 'get_connection', get_connection)
+
+    assert images.delete_unreferenced_blobs(grace_period=3600) == 1
+    assert sorted(store.iter_hashes()) == sorted([referenced, new])
@@ -0,0 +1,128 @@
+from flask import Flask, abort
+import psycopg2
+import pytest
+
+from simple_recipes.db.session import RequestSession, TransactionFailed, after_commit, \
+    get_request_session, init_app
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.readonly = None
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+class Pool:
+    def __init__(self):
+        self.released = []
+
+    def acquire(self):
+        return FakeConnection()
+
+    def release(self, cn, close):
+        self.released.append((cn, close))
+
+@pytest.fixture
+def pool():
+    return Pool()
+
+def test_connection_is_only_acquired_when_used(pool):
+    session = RequestSession(pool.acquire, pool.release)
+    session.commit()
+    session.close()
+    assert pool.released == []
+
+def test_commit_and_close(pool):
+    session = RequestSession(pool.acquire, pool.release, read_only=True)
+    calls = []
+    with session.join() as cn:
+        assert cn.readonly
+    # leaving the block doesn't commit
+    assert cn.commits == 0
+    session.commit_callbacks.append(lambda: calls.append('committed'))
+    session.commit()
+    session.close()
+    assert (cn.commits, calls) == (1, ['committed'])
+    assert pool.released == [(cn, False)]
+    assert cn.readonly is None
+
+def test_caught_non_database_errors_leave_the_transaction_usable(pool):
+    session = RequestSession(pool.acquire, pool.release)
+    with pytest.raises(PermissionError):
+        with session.join():
+            raise PermissionError("locked")
+    session.commit()
+    assert session.cn.commits == 1
+
+def test_database_errors_fail_the_commit(pool):
+    session = RequestSession(pool.acquire, pool.release)
+    try:
+        with session.join():
+            raise psycopg2.IntegrityError("duplicate key")
+    except psycopg2.Error:
+        pass
+    with pytest.raises(TransactionFailed):
+        session.commit()
+    cn = session.cn
+    session.close()
+    assert (cn.commits, cn.rollbacks) == (0, 1)
+
+def test_broken_connections_are_closed(pool):
+    session = RequestSession(pool.acquire, pool.release)
+    with session.join() as cn:
+        cn.closed = 2
+    session.close()
+    assert pool.released == [(cn, True)]
+
+@pytest.fixture
+def client(pool):
+    app = Flask(__name__)
+    init_app(app, pool.acquire, pool.release)
+
+    def write():
+        with get_request_session().join():
+            after_commit(lambda: app.config.setdefault('COMMITTED', True))
+
+    @app.route('/write', methods=['POST'])
+    def ok():
+        write()
+        return ''
+
+    @app.route('/write-then-404', methods=['POST'])
+    def not_found():
+        write()
+        abort(404)
+
+    @app.route('/swallowed-db-error', methods=['POST'])
+    def swallowed():
+        try:
+            with get_request_session().join():
+                raise psycopg2.OperationalError("server closed the connection")
+        except psycopg2.Error:
+            pass
+        return 'looks fine'
+
+    return app.test_client()
+
+def test_request_commits(client, pool):
+    assert client.post('/write').status_code == 200
+    cn, close = pool.released[0]
+    assert cn.commits == 1
+    assert client.application.config.get('COMMITTED')
+
+def test_error_responses_roll_back(client, pool):
+    assert client.post('/write-then-404').status_code == 404
+    cn, close = pool.released[0]
+    assert (cn.commits, cn.rollbacks) == (0, 1)
+    assert not client.application.config.get('COMMITTED')
+
+def test_swallowed_database_error_is_a_500(client, pool):
+    assert client.post('/swallowed-db-error').status_code == 500
+    cn, close = pool.released[0]
+    assert cn.commits == 0
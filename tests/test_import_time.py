@@ -0,0 +1,70 @@
+'''import-time benchmarks for simple_recipes and its unit registry.
+Each measurement runs in a fresh interpreter, so nothing is already
+imported or built. Run this file directly for a timing report:
+
+    python tests/test_import_time.py
+'''
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_APP = '''
+import sys, time
+start = time.perf_counter()
+import simple_recipes
+print(time.perf_counter() - start, 'pint' in sys.modules)
+'''
+
+BUILD_REGISTRY = '''
+import time
+import simple_recipes
+start = time.perf_counter()
+simple_recipes.get_unit_registry()
+print(time.perf_counter() - start, True)
+'''
+
+def _run(code, cache_folder):
+    '''runs code in a new interpreter with the given UNIT_REGISTRY_CACHE_FOLDER
+    ('' for none), returning the (seconds, pint imported) it prints.'''
+    env = dict(os.environ, UNIT_REGISTRY_CACHE_FOLDER=cache_folder)
+    env.pop('UNIT_REGISTRY_PRELOAD', None)
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT,
+        env=env, check=True, capture_output=True, text=True).stdout
+    seconds, pint_imported = output.split()
+    return float(seconds), pint_imported == 'True'
+
+def _median(code, cache_folder, runs):
+    return statistics.median(_run(code, cache_folder)[0] for _ in range(runs))
+
+@pytest.fixture(scope='module')
+def warm_cache():
+    with tempfile.TemporaryDirectory() as cache_folder:
+        _run(BUILD_REGISTRY, cache_folder)
+        yield cache_folder
+
+def test_import_leaves_pint_alone():
+    seconds, pint_imported = _run(IMPORT_APP, '')
+    assert not pint_imported
+
+def test_registry_cache_speeds_up_build(warm_cache):
+    assert _median(BUILD_REGISTRY, warm_cache, 3) < _median(BUILD_REGISTRY, '', 3)
+
+def main(runs=5):
+    with tempfile.TemporaryDirectory() as cache_folder:
+        _run(BUILD_REGISTRY, cache_folder)
+        rows = [
+            ('import simple_recipes', _median(IMPORT_APP, '', runs)),
+            ('build registry, no cache', _median(BUILD_REGISTRY, '', runs)),
+            ('build registry, warm cache', _median(BUILD_REGISTRY, cache_folder, runs)),
+        ]
+    print(f'median of {runs} runs')
+    for name, seconds in rows:
+        print(f'{name:<28} {seconds * 1000:8.1f} ms')
+
+if __name__ == '__main__': main()
@@ -0,0 +1,48 @@
+import pytest
+
+from simple_recipes.db.recipes.ingredients import get_recipe_ingredient_terms
+from simple_recipes.ingredients import normalize_ingredient_name, split_ingredient_line, \
+    get_ingredient_names, get_ingredient_terms
+
+@pytest.mark.parametrize('text, name', [
+    ('- large eggs, beaten', 'egg'),
+    ('all-purpose flour (sifted)', 'all purpose flour'),
+    ('Tomatoes', 'tomato'),
+    ('cherries', 'cherry'),
+    ('couscous', 'couscous'),
+    ('freshly ground black pepper', 'black pepper'),
+    ('pinch of', None),
+])
+def test_normalize_ingredient_name(text, name):
+    assert normalize_ingredient_name(text) == name
+
+@pytest.mark.parametrize('line, ingredients', [
+    ('salt and pepper', [['salt'], ['pepper']]),
+    ('Salt & pepper to taste', [['salt'], ['pepper']]),
+    ('onions, carrots and celery', [['onion'], ['carrot'], ['celery']]),
+    ('butter or margarine, softened', [['butter', 'margarine']]),
+    ('chicken breasts, cut into strips', [['chicken breast']]),
+    ('tomatoes, seeded and diced', [['tomato']]),
+    ('olive oil (or vegetable oil)', [['olive oil']]),
+    ('sandwich bread', [['sandwich bread']]),
+    ('', []),
+])
+def test_split_ingredient_line(line, ingredients):
+    assert split_ingredient_line(line) == ingredients
+
+def test_get_ingredient_names_skips_quantities():
+    tokens = [{'text': '2 cups'}, ' flour\n', {'text': '1 tsp'}, ' salt and pepper\n\n']
+    assert get_ingredient_names(tokens) == [['flour'], ['salt'], ['pepper']]
+
+def test_get_ingredient_terms():
+    assert get_ingredient_terms('extra virgin olive oil') == [
+        'extra virgin olive oil', 'virgin olive oil', 'olive oil', 'oil']
+
+def test_alternatives_share_an_ingredient_without_duplicate_terms():
+    rows = get_recipe_ingredient_terms(['eggs\nolive oil or vegetable oil\n'])
+    assert rows == [
+        (0, 'egg', 'egg'),
+        (1, 'olive oil', 'olive oil'),
+        (1, 'olive oil', 'oil'),
+        (1, 'vegetable oil', 'vegetable oil'),
+    ]
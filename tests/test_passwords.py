@@ -0,0 +1,89 @@
+from concurrent.futures import Future
+import threading
+
+import pytest
+
+from simple_recipes import app
+from simple_recipes import passwords
+from simple_recipes.passwords import PasswordServiceUnavailable, hash_password, \
+    verify_password, needs_rehash
+
+# cheap costs, so the tests don't spend their time hashing.
+CHEAP_PARAMS = {'N': 16, 'r': 1, 'p': 1}
+
+@pytest.fixture
+def config(monkeypatch):
+    monkeypatch.setitem(app.config, 'SCRYPT_N', CHEAP_PARAMS['N'])
+    monkeypatch.setitem(app.config, 'SCRYPT_R', CHEAP_PARAMS['r'])
+    monkeypatch.setitem(app.config, 'SCRYPT_P', CHEAP_PARAMS['p'])
+    monkeypatch.setitem(app.config, 'PASSWORD_PROCESSES', 0)
+    monkeypatch.setitem(app.config, 'PASSWORD_TIMEOUT', 10)
+    return app.config
+
+class StuckPool:
+    '''a pool whose hashes never finish.'''
+    def submit(self, *args):
+        return Future()
+
+def test_hash_and_verify_inline(config):
+    password_hash, salt, params = hash_password('secret')
+    assert params == CHEAP_PARAMS
+    assert verify_password('secret', password_hash, salt, params)
+    assert not verify_password('Secret', password_hash, salt, params)
+
+def test_hash_and_verify_in_pool(config, monkeypatch):
+    config['PASSWORD_PROCESSES'] = 1
+    monkeypatch.setattr(passwords, '_password_pool', None)
+    password_hash, salt, params = hash_password('secret')
+    try:
+        assert verify_password('secret', password_hash, salt, params)
+        # the same hash as without the pool
+        config['PASSWORD_PROCESSES'] = 0
+        assert hash_password('secret', salt, params)[0] == password_hash
+    finally:
+        passwords._password_pool.shutdown()
+
+def test_needs_rehash(config):
+    assert not needs_rehash(CHEAP_PARAMS)
+    assert needs_rehash(dict(CHEAP_PARAMS, N=32))
+    # hashes made before parameters were stored used py-scrypt's defaults
+    assert needs_rehash(None)
+    config['SCRYPT_N'] = passwords.DEFAULT_SCRYPT_PARAMS['N']
+    config['SCRYPT_R'] = passwords.DEFAULT_SCRYPT_PARAMS['r']
+    assert not needs_rehash(None)
+
+def test_full_queue_is_unavailable(config, monkeypatch):
+    config['PASSWORD_PROCESSES'] = 1
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(passwords, 'get_password_pool', lambda: (StuckPool(), slots))
+    with pytest.raises(PasswordServiceUnavailable):
+        hash_password('secret')
+
+def test_timeout_is_unavailable_and_frees_the_slot(config, monkeypatch):
+    config['PASSWORD_PROCESSES'] = 1
+    config['PASSWORD_TIMEOUT'] = 0.01
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(passwords, 'get_password_pool', lambda: (StuckPool(), slots))
+    with pytest.raises(PasswordServiceUnavailable):
+        hash_password('secret')
+    assert slots.acquire(blocking=False)
+
+def test_concurrent_first_calls_share_one_pool(config, monkeypatch):
+    created = []
+    class SlowPool:
+        def __init__(self, max_workers=None):
+            created.append(self)
+            threading.Event().wait(0.05)
+    monkeypatch.setattr(passwords, 'ProcessPoolExecutor', SlowPool)
+    monkeypatch.setattr(passwords, '_password_pool', None)
+    monkeypatch.setattr(passwords, '_password_slots', None)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(passwords.get_password_pool()))
+        for _ in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    assert len(created) == 1
+    assert all(result == results[0] for result in results)
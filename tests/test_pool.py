@@ -0,0 +1,111 @@
+import os
+import socket
+import threading
+
+import pytest
+from psycopg2 import pool as psycopg2_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from simple_recipes.db import pool
+
+class FakeInfo:
+    transaction_status = TRANSACTION_STATUS_IDLE
+
+class FakeConnection:
+    '''stands in for a psycopg2 connection, over one end of a socket
+    pair. Closing it sends a byte, like libpq's terminate message.'''
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.closed = 0
+        self.info = FakeInfo()
+        self.rollbacks = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        if self.closed: return
+        self.sock.send(b'X')
+        self.sock.close()
+        self.closed = 1
+
+@pytest.fixture
+def connections(monkeypatch):
+    made = []
+    def connect(dsn):
+        made.append(FakeConnection())
+        return made[-1]
+    monkeypatch.setattr(pool, 'connect', connect)
+    return made
+
+def make_pool(**options):
+    options = dict({'min_size': 0, 'max_size': 2,
+        'timeout': 0.05, 'check_on_checkout': False}, **options)
+    return pool.ConnectionPool('dbname=test', **options)
+
+def test_returned_connections_are_reused(connections):
+    p = make_pool()
+    cn = p.getconn()
+    p.putconn(cn)
+    assert p.getconn() is cn
+    assert p.get_stats()['connections_created'] == 1
+    assert p.get_stats()['checkouts'] == 2
+
+def test_open_transactions_are_rolled_back_on_return(connections):
+    p = make_pool()
+    cn = p.getconn()
+    cn.info.transaction_status = TRANSACTION_STATUS_INTRANS
+    p.putconn(cn)
+    assert cn.rollbacks == 1
+
+def test_closed_connections_are_replaced(connections):
+    p = make_pool()
+    cn = p.getconn()
+    cn.close()
+    p.putconn(cn)
+    assert p.getconn() is not cn
+    assert p.get_stats()['connections_discarded'] == 1
+
+def test_exhausted_pool_times_out(connections):
+    p = make_pool()
+    p.getconn(), p.getconn()
+    with pytest.raises(psycopg2_pool.PoolError):
+        p.getconn()
+    stats = p.get_stats()
+    assert stats['checkout_timeouts'] == 1
+    assert stats['in_use'] == 2
+    assert len(connections) == 2
+
+def test_waiters_get_returned_connections(connections):
+    p = make_pool(max_size=1, timeout=5)
+    cn = p.getconn()
+    threading.Timer(0.05, p.putconn, (cn,)).start()
+    assert p.getconn() is cn
+    assert p.get_stats()['checkout_waits'] >= 1
+
+def test_child_process_leaves_inherited_sessions_open(connections, monkeypatch):
+    inherited = make_pool(min_size=2)
+    monkeypatch.setattr(pool, '_pool', inherited)
+
+    pid = os.fork()
+    if pid == 0:
+        # reset_pool has already run, as an after-fork hook.
+        status = 1
+        try:
+            new = pool.get_pool('dbname=test', min_size=0)
+            if new is not inherited and not inherited._idle: status = 0
+        finally:
+            os._exit(status)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    # the parent's connections weren't closed from the child
+    for cn in connections[:2]:
+        cn.peer.setblocking(False)
+        with pytest.raises(BlockingIOError):
+            cn.peer.recv(1)
+        assert not cn.closed
@@ -0,0 +1,53 @@
+import os
+import time
+
+import pytest
+
+from simple_recipes import app
+from simple_recipes import qr_codes
+from simple_recipes.db import recipes as db
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'QR_CODE_CACHE_PATH', str(tmp_path))
+    monkeypatch.setitem(app.config, 'QR_CODE_DISK_LIMIT', 3)
+    monkeypatch.setitem(app.config, 'SITE_URL', None)
+    monkeypatch.setattr(qr_codes, 'EVICTION_INTERVAL', 4)
+    monkeypatch.setattr(qr_codes, '_writes_since_eviction', 0)
+    monkeypatch.setattr(qr_codes, 'qr_codes', qr_codes.LRUCache('test_qr_codes', maxsize=16))
+    return tmp_path
+
+def test_key_depends_on_site_url(cache):
+    with app.test_request_context(base_url='https://recipes.example'):
+        key = qr_codes.get_qr_code_key(1)
+        assert qr_codes.get_share_url(1) == 'https://recipes.example/recipes/1/'
+    with app.test_request_context(base_url='https://other.example'):
+        assert qr_codes.get_qr_code_key(1) != key
+    app.config['SITE_URL'] = 'https://recipes.example/'
+    with app.test_request_context(base_url='https://other.example'):
+        assert qr_codes.get_qr_code_key(1) == key
+        assert qr_codes.get_share_url(1) == 'https://recipes.example/recipes/1/'
+
+def test_disk_tier_is_evicted_every_few_writes(cache):
+    with app.test_request_context(base_url='https://recipes.example'):
+        for recipe_id in range(3):
+            qr_codes.get_qr_code(recipe_id)
+            time.sleep(0.01)
+        assert len(os.listdir(cache)) == 3
+        qr_codes.get_qr_code(3)
+    # the fourth write evicts the oldest file
+    assert sorted(os.listdir(cache)) == sorted(
+        qr_codes.get_qr_code_key(i, site_url='https://recipes.example') for i in (1, 2, 3))
+
+def test_codes_are_read_back_from_disk(cache, monkeypatch):
+    with app.test_request_context(base_url='https://recipes.example'):
+        data = qr_codes.get_qr_code(7, kind='svg')
+        qr_codes.qr_codes.clear()
+        monkeypatch.setattr(qr_codes, 'make_qr_code', None)
+        assert qr_codes.get_qr_code(7, kind='svg') == data
+
+def test_unknown_recipes_are_not_found(cache, monkeypatch):
+    monkeypatch.setattr(db, 'get_recipe_updated_at', lambda recipe_id: None)
+    response = app.test_client().get('/share/recipe/12345/', base_url='https://localhost')
+    assert response.status_code == 404
+    assert os.listdir(cache) == []
@@ -0,0 +1,79 @@
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from simple_recipes import app
+from simple_recipes import rate_limiting
+from simple_recipes.rate_limiting import MemoryStore, SQLiteStore, TooManyLoginAttempts, \
+    check_login_rate, record_failed_login
+
+class Clock:
+    '''stands in for the time module, for both stores' clocks.'''
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiting, 'time', clock)
+    return clock
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteStore(str(tmp_path / 'login_attempts.sqlite3'))
+    return MemoryStore()
+
+def test_hit_until_limit(store, clock):
+    assert [store.hit('k', 3, 60) for _ in range(3)] == [0, 0, 0]
+    clock.now += 10
+    assert store.hit('k', 3, 60) == pytest.approx(50)
+    assert store.hit('other', 3, 60) == 0
+
+def test_window_slides(store, clock):
+    store.hit('k', 2, 60)
+    clock.now += 30
+    store.hit('k', 2, 60)
+    clock.now += 31
+    # the first attempt is out of the window
+    assert store.hit('k', 2, 60) == 0
+    assert store.hit('k', 2, 60) == pytest.approx(29)
+
+def test_retry_after_does_not_record(store, clock):
+    for _ in range(5):
+        assert store.retry_after('k', 1, 60) == 0
+    store.hit('k', 1, 60)
+    assert store.retry_after('k', 1, 60) == pytest.approx(60)
+
+@pytest.fixture
+def limits(monkeypatch, clock):
+    monkeypatch.setattr(rate_limiting, '_store', MemoryStore())
+    monkeypatch.setitem(app.config, 'LOGIN_ATTEMPTS_PER_USER', 2)
+    monkeypatch.setitem(app.config, 'LOGIN_ATTEMPTS_PER_CLIENT', 4)
+    monkeypatch.setitem(app.config, 'LOGIN_RATE_LIMIT_WINDOW', 60)
+
+def test_only_failures_count_per_user(limits):
+    for client in range(5):
+        check_login_rate('Alice', f'10.0.0.{client}')
+    record_failed_login('alice')
+    check_login_rate('alice', '10.0.0.9')
+    record_failed_login('ALICE')
+    with pytest.raises(TooManyLoginAttempts) as exc_info:
+        check_login_rate('alice', '10.0.0.10')
+    assert exc_info.value.retry_after == 61
+    check_login_rate('bob', '10.0.0.10')
+
+def test_every_attempt_counts_per_client(limits):
+    for user in range(4):
+        check_login_rate(f'user{user}', '10.0.0.1')
+    with pytest.raises(TooManyLoginAttempts):
+        check_login_rate('someone else', '10.0.0.1')
+    check_login_rate('someone else', '10.0.0.2')
+
+def test_forwarded_addresses_are_ignored_by_default():
+    assert app.config['TRUSTED_PROXY_COUNT'] == 0
+    assert not isinstance(app.wsgi_app, ProxyFix)
@@ -0,0 +1,41 @@
+import pytest
+
+from simple_recipes import app
+from simple_recipes.caching import LRUCache, get_recipe_cache_key
+from simple_recipes.controllers import recipe_controllers
+from simple_recipes.db import recipes as db
+from simple_recipes.sessions import ServerSideSessionInterface
+
+class CountingStore:
+    '''a session store that only counts loads, and has nothing in it.'''
+    def __init__(self):
+        self.loads = 0
+    def load(self, sid):
+        self.loads += 1
+        return None
+    def save(self, sid, data, expires): pass
+    def delete(self, sid): pass
+    def purge_expired(self): pass
+
+@pytest.fixture
+def store(monkeypatch):
+    store = CountingStore()
+    monkeypatch.setattr(app, 'session_interface', ServerSideSessionInterface(store, 3600))
+    monkeypatch.setattr(db, 'get_recipe_updated_at', lambda recipe_id: 'then')
+    pages = LRUCache('test_rendered_recipes', maxsize=4)
+    pages.set(get_recipe_cache_key(1, 'then', 1, None), 'cached page')
+    monkeypatch.setattr(recipe_controllers, 'rendered_recipes', pages)
+    return store
+
+def test_cached_page_without_cookie_skips_the_session(store):
+    response = app.test_client().get('/recipes/1/', base_url='https://localhost')
+    assert response.data == b'cached page'
+    assert store.loads == 0
+    assert 'Set-Cookie' not in response.headers
+
+def test_session_is_checked_with_a_cookie(store):
+    client = app.test_client()
+    client.set_cookie('localhost', app.session_cookie_name, 'a' * 43)
+    response = client.get('/recipes/1/', base_url='https://localhost')
+    assert response.data == b'cached page'
+    assert store.loads == 1
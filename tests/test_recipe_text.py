@@ -0,0 +1,41 @@
+from simple_recipes.controllers.recipe_controllers import render_recipe_field
+from simple_recipes.unit_conversion import compile_recipe_text
+
+def _unit(category, system, singular, plural, abbr=None):
+    return {
+        'unit_category' : category,
+        'unit_system' : system,
+        'unit_singular' : singular,
+        'unit_plural' : plural,
+        'unit_abbr' : abbr,
+        'include_in_conversions' : True
+    }
+
+UNITS = {
+    'cup' : _unit('volume', 'US', 'cup', 'cups'),
+    'milliliter' : _unit('volume', 'SI', 'milliliter', 'milliliters', 'ml'),
+    'liter' : _unit('volume', 'SI', 'liter', 'liters', 'l'),
+}
+
+def render(field, text, multiplier=1, to_system=None):
+    return render_recipe_field(field, compile_recipe_text(text), multiplier, to_system, UNITS)
+
+def test_ingredients_are_scaled():
+    assert render('ingredients', '{{ 2 cups }} flour', multiplier=2) == \
+        render('ingredients', '{{ 4 cups }} flour')
+
+def test_instructions_are_not_scaled():
+    text = 'Stir in {{ 1 cup }} of the batter, then bake for {{ 30 minutes }}.'
+    assert render('instructions', text, multiplier=2) == render('instructions', text)
+    assert '30' in render('instructions', text, multiplier=2)
+
+def test_instructions_are_converted():
+    text = 'Stir in {{ 1 cup }} of the batter.'
+    converted = render('instructions', text, multiplier=2, to_system='SI')
+    assert 'cup' not in converted
+    assert converted == render('instructions', text, to_system='SI')
+
+def test_unparsable_tokens_keep_their_text():
+    tokens = compile_recipe_text('{{ a handful }} of nuts')
+    assert tokens == [{'text' : 'a handful', 'no_multiply' : False}, ' of nuts']
+    assert 'a handful' in render('ingredients', '{{ a handful }} of nuts', multiplier=3)
@@ -0,0 +1,25 @@
+import struct
+
+import pytest
+
+from simple_recipes.controllers.recipe_controllers import format_search_cursor, \
+    parse_search_cursor
+
+def _real(x):
+    '''x rounded to a Postgres real, as ts_rank's results come back.'''
+    return struct.unpack('f', struct.pack('f', x))[0]
+
+@pytest.mark.parametrize('rank', [0.0, _real(0.1), _real(0.0607927),
+    _real(1e-20), _real(1 / 3), 1.0, 12.5])
+def test_cursor_round_trip(rank):
+    cursor = (rank, 42)
+    assert parse_search_cursor(format_search_cursor(cursor)) == cursor
+
+def test_cursor_is_url_safe():
+    text = format_search_cursor((_real(1e-20), 7))
+    assert text.replace('_', '').replace('.', '').replace('-', '').isalnum()
+
+@pytest.mark.parametrize('text', [None, '', 'abc', '0.5', '0.5_', '_3',
+    'x_3', '0.5_x', '0.5_3_4', '0.5_3.5'])
+def test_invalid_cursor(text):
+    assert parse_search_cursor(text) is None
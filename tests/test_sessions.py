@@ -0,0 +1,118 @@
+import time
+
+from flask import Flask, session
+import flask_login
+import pytest
+
+from simple_recipes.sessions import FilesystemSessionStore, SQLiteSessionStore, \
+    ServerSideSessionInterface
+
+LIFETIME = 3600
+
+@pytest.fixture(params=['filesystem', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteSessionStore(str(tmp_path / 'sessions.sqlite3'))
+    return FilesystemSessionStore(str(tmp_path / 'sessions'))
+
+class User(flask_login.UserMixin):
+    def __init__(self, user_id):
+        self.id = user_id
+
+@pytest.fixture
+def client(store):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.session_interface = ServerSideSessionInterface(store, LIFETIME)
+    login_manager = flask_login.LoginManager(app)
+    login_manager.user_loader(User)
+
+    @app.route('/set/<value>')
+    def set_value(value):
+        session['value'] = value
+        return ''
+
+    @app.route('/get')
+    def get_value():
+        return session.get('value', '')
+
+    @app.route('/clear')
+    def clear():
+        session.clear()
+        return ''
+
+    @app.route('/nothing')
+    def nothing():
+        return ''
+
+    @app.route('/login')
+    def login():
+        flask_login.login_user(User('alice'))
+        return ''
+
+    return app.test_client()
+
+def get_sid(client):
+    for cookie in client.cookie_jar:
+        if cookie.name == 'session': return cookie.value
+
+def test_store_round_trip(store):
+    sid = 'a' * 43
+    assert store.load(sid) is None
+    store.save(sid, '{"value": 1}', 123.5)
+    assert tuple(store.load(sid)) == ('{"value": 1}', 123.5)
+    store.delete(sid)
+    assert store.load(sid) is None
+
+def test_store_purges_expired(store):
+    store.save('a' * 43, '{}', time.time() - 1)
+    store.save('b' * 43, '{}', time.time() + 60)
+    store.purge_expired()
+    assert store.load('a' * 43) is None
+    assert store.load('b' * 43) is not None
+
+def test_session_round_trip(client, store):
+    client.get('/set/spam')
+    sid = get_sid(client)
+    assert len(sid) == 43
+    assert store.load(sid) is not None
+    assert client.get('/get').data == b'spam'
+    # reading doesn't save it again, or give it a new ID
+    assert get_sid(client) == sid
+
+def test_untouched_session_sets_no_cookie(client):
+    response = client.get('/nothing')
+    assert 'Set-Cookie' not in response.headers
+
+def test_unknown_id_is_not_adopted(client, store):
+    chosen = 'x' * 43
+    client.set_cookie('localhost', 'session', chosen)
+    client.get('/set/spam')
+    assert get_sid(client) != chosen
+    assert store.load(chosen) is None
+    assert client.get('/get').data == b'spam'
+
+def test_expired_id_is_replaced(client, store):
+    expired = 'y' * 43
+    store.save(expired, '{"value": "old"}', time.time() - 1)
+    client.set_cookie('localhost', 'session', expired)
+    assert client.get('/get').data == b''
+    client.get('/set/spam')
+    assert get_sid(client) != expired
+    assert store.load(expired) is None
+
+def test_login_rotates_id(client, store):
+    client.get('/set/spam')
+    before = get_sid(client)
+    client.get('/login')
+    after = get_sid(client)
+    assert after != before
+    assert store.load(before) is None
+    assert client.get('/get').data == b'spam'
+
+def test_empty_session_is_deleted(client, store):
+    client.get('/set/spam')
+    sid = get_sid(client)
+    client.get('/clear')
+    assert get_sid(client) is None
+    assert store.load(sid) is None
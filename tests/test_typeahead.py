@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from simple_recipes.db.typeahead import PrefixTrie, TypeaheadIndex, normalize_name
+
+NAMES = [
+    ('recipe', 1, 'Chicken Noodle Soup'),
+    ('recipe', 2, 'Chickpea Curry'),
+    ('recipe', 3, 'Tomato Soup'),
+    ('tag', 1, 'Soups'),
+]
+
+@pytest.fixture
+def trie():
+    trie = PrefixTrie()
+    for entry in NAMES: trie.add(*entry)
+    return trie
+
+def test_normalize_name():
+    assert normalize_name("  Mom's  Chicken-Soup ") == 'mom s chicken soup'
+
+def test_prefix_of_any_word_matches(trie):
+    assert set(trie.search('chick')) == {NAMES[0], NAMES[1]}
+    assert set(trie.search('nood')) == {NAMES[0]}
+    assert set(trie.search('SOUP')) == {NAMES[0], NAMES[2], NAMES[3]}
+    assert trie.search('noodle soup') == [NAMES[0]]
+    assert trie.search('xyz') == []
+
+def test_shorter_keys_come_first(trie):
+    # 'soup' ends a key for the two recipes; 'soups' is one level deeper.
+    assert trie.search('soup')[-1] == NAMES[3]
+
+def test_limit(trie):
+    assert len(trie.search('soup', limit=2)) == 2
+
+def test_rename_and_discard_prune_the_trie(trie):
+    trie.add('recipe', 2, 'Lentil Curry')
+    assert trie.search('chickp') == []
+    assert trie.search('lent') == [('recipe', 2, 'Lentil Curry')]
+
+    for kind, id, name in NAMES: trie.discard(kind, id)
+    trie.discard('recipe', 2)
+    assert trie.root.children == {}
+    assert trie.names == {}
+
+def test_fuzzy_search_allows_a_typo(trie):
+    assert trie.search('chikc') == []
+    assert set(trie.fuzzy_search('chikc')) == {NAMES[0], NAMES[1]}
+    assert trie.fuzzy_search('tomatp') == [NAMES[2]]
+    assert trie.fuzzy_search('zzzzz') == []
+
+def test_index_tops_up_with_fuzzy_matches():
+    index = TypeaheadIndex(lambda: NAMES)
+    assert index.search('tomatp') == [NAMES[2]]
+    # too short to guess at
+    assert index.search('tx') == []
+
+def test_index_applies_writes_made_while_loading():
+    loading, finish = threading.Event(), threading.Event()
+    def load():
+        loading.set()
+        finish.wait(5)
+        return NAMES
+    index = TypeaheadIndex(load)
+
+    thread = threading.Thread(target=index.search, args=('soup',))
+    thread.start()
+    loading.wait(5)
+    index.add('recipe', 4, 'Pea Soup')
+    index.discard('recipe', 3)
+    finish.set()
+    thread.join()
+
+    names = {name for _, _, name in index.search('soup')}
+    assert names == {'Chicken Noodle Soup', 'Pea Soup', 'Soups'}
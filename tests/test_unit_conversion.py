@@ -0,0 +1,95 @@
+from decimal import Decimal
+import itertools
+
+import pytest
+
+from simple_recipes import Q_
+from simple_recipes.db.units import UnitCatalogCache
+from simple_recipes.unit_conversion import ConversionTable, convert_quantity_with_pint, \
+    get_conversion_table
+
+def _unit(category, system, singular, plural, abbr=None):
+    return {
+        'unit_category' : category,
+        'unit_system' : system,
+        'unit_singular' : singular,
+        'unit_plural' : plural,
+        'unit_abbr' : abbr,
+        'include_in_conversions' : True
+    }
+
+# a catalog in the shape units_json() returns, keyed by pint unit name,
+# in catalog order (ties between candidates are broken by it).
+UNITS = {
+    'teaspoon' : _unit('volume', 'US', 'teaspoon', 'teaspoons', 'tsp'),
+    'tablespoon' : _unit('volume', 'US', 'tablespoon', 'tablespoons', 'tbsp'),
+    'fluid_ounce' : _unit('volume', 'US', 'fluid ounce', 'fluid ounces', 'fl oz'),
+    'cup' : _unit('volume', 'US', 'cup', 'cups'),
+    'pint' : _unit('volume', 'US', 'pint', 'pints', 'pt'),
+    'quart' : _unit('volume', 'US', 'quart', 'quarts', 'qt'),
+    'gallon' : _unit('volume', 'US', 'gallon', 'gallons', 'gal'),
+    'milliliter' : _unit('volume', 'SI', 'milliliter', 'milliliters', 'ml'),
+    'liter' : _unit('volume', 'SI', 'liter', 'liters', 'l'),
+    'ounce' : _unit('mass', 'US', 'ounce', 'ounces', 'oz'),
+    'pound' : _unit('mass', 'US', 'pound', 'pounds', 'lb'),
+    'gram' : _unit('mass', 'SI', 'gram', 'grams', 'g'),
+    'kilogram' : _unit('mass', 'SI', 'kilogram', 'kilograms', 'kg'),
+    'degree_Fahrenheit' : _unit('temperature', 'US', 'degree Fahrenheit', 'degrees Fahrenheit', '°F'),
+    'degree_Celsius' : _unit('temperature', 'SI', 'degree Celsius', 'degrees Celsius', '°C'),
+}
+
+MAGNITUDES = [0, 0.1, 0.25, 1, 1.5, 3, 12, 100, 350, 2500,
+    Decimal('0.5'), Decimal('2'), Decimal('33.3')]
+
+THRESHOLDS = {'US' : (0.25, 5), 'SI' : (0.25, 100)}
+
+@pytest.fixture(scope='module')
+def table():
+    return ConversionTable(UNITS)
+
+@pytest.mark.parametrize('from_name, to_system',
+    list(itertools.product(UNITS, THRESHOLDS)))
+def test_table_matches_pint(table, from_name, to_system):
+    '''every unit in the catalog, converted to every system,
+    gives what the original pint loop does.'''
+    min_threshold, max_threshold = THRESHOLDS[to_system]
+    for m in MAGNITUDES:
+        quantity = Q_(m, from_name)
+        converted = table.convert(quantity, to_system, min_threshold, max_threshold)
+        if converted is None:
+            # left to pint, e.g. temperatures.
+            continue
+        expected = convert_quantity_with_pint(
+            quantity, to_system, UNITS, min_threshold, max_threshold)
+        assert str(converted.u) == str(expected.u), m
+        assert converted.magnitude == pytest.approx(expected.magnitude, rel=1e-12), m
+        assert isinstance(converted.magnitude, Decimal) == \
+            isinstance(expected.magnitude, Decimal), m
+
+def test_offset_units_are_left_to_pint(table):
+    assert table.convert(Q_(350, 'degree_Fahrenheit'), 'SI', 0.25, 100) is None
+
+def test_reloading_unchanged_units_keeps_the_catalog():
+    loads = []
+    def load():
+        loads.append(1)
+        return {k: dict(u) for k, u in UNITS.items()}
+    cache = UnitCatalogCache(load, ttl=0)
+
+    catalog = cache.get()
+    table = get_conversion_table(catalog.convertibles)
+    assert cache.get() is catalog
+    cache.invalidate()
+    assert cache.get() is catalog
+    assert len(loads) == 3
+    # so the conversion table isn't rebuilt either.
+    assert get_conversion_table(cache.get().convertibles) is table
+
+def test_reloading_changed_units_makes_a_new_catalog():
+    units = {k: dict(u) for k, u in UNITS.items()}
+    cache = UnitCatalogCache(lambda: units, ttl=0)
+    catalog = cache.get()
+
+    units = dict(units, cup=dict(units['cup'], include_in_conversions=False))
+    assert cache.get() is not catalog
+    assert 'cup' not in cache.get().convertibles